@@ -0,0 +1,70 @@
+# -*- coding:utf-8 -*-
+#  bench_async_multi_ecu.py
+#
+#  ~~~~~~~~~~~~
+#
+#  ESC, EPS and EPS4wd read on one channel: conversations one after the other
+#  vs. concurrently with uds_asyncio, simulated ECUs with a fixed response latency
+#
+#  usage: python benchmarks/bench_async_multi_ecu.py [rounds] [latency ms]
+#
+#  ~~~~~~~~~~~~
+#
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ccdiag_engine import CCDiagEngine
+
+TARGETS = ("ESC", "EPS", "EPS4wd")
+
+
+async def conversation(client):
+    await client.change_session(3)
+    await client.unlock_security_access(1)
+    await client.read_data_by_identifier(0xF195)
+    await client.get_dtc_by_status_mask(9)
+    await client.change_session(1)
+
+
+async def run(engine, rounds):
+    channel = engine.async_channel().start()
+    clients = [engine.async_client(channel, target) for target in TARGETS]
+    for client in clients:
+        client.conn.open()
+
+    t0 = time.perf_counter()
+    for i in range(rounds):
+        for client in clients:
+            await conversation(client)
+    sequential = (time.perf_counter() - t0) / rounds
+
+    t0 = time.perf_counter()
+    for i in range(rounds):
+        await asyncio.gather(*[conversation(client) for client in clients])
+    concurrent = (time.perf_counter() - t0) / rounds
+
+    for client in clients:
+        await client.conn.close()
+    channel.stop()
+    return sequential, concurrent
+
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    latency = float(sys.argv[2]) / 1000.0 if len(sys.argv) > 2 else 0.02
+
+    engine = CCDiagEngine()
+    engine.open_device("ZCAN-VIRTUAL", 0)
+    engine.open_channel(0, uds=False)
+    for ecu in engine.simulator.ecus:
+        ecu.latency = latency
+    try:
+        sequential, concurrent = asyncio.run(run(engine, rounds))
+    finally:
+        engine.close()
+    print("3 ECUs, latency %.0f ms   one after the other: %7.1f ms/round   concurrent: %7.1f ms/round   x%.2f" % (
+        latency * 1e3, sequential * 1e3, concurrent * 1e3, sequential / concurrent))
@@ -0,0 +1,102 @@
+# -*- coding:utf-8 -*-
+#  bench_can_periodic.py
+#
+#  ~~~~~~~~~~~~
+#
+#  Periodic messages on the virtual device: one PeriodicScheduler thread with many messages
+#  against the Event.wait(period) loop of the former GUI PeriodSendThread (one thread per message). A second
+#  node receives the frames, the report gives the drift of the last frame against its ideal
+#  time and the period error of every message
+#
+#  usage: python benchmarks/bench_can_periodic.py [messages] [seconds]
+#
+#  ~~~~~~~~~~~~
+#
+import collections
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zlgcan import *
+import can_periodic
+
+PERIODS = (0.010, 0.020, 0.050, 0.100)
+
+
+def open_channels():
+    zcan = ZCANVirtualDriver()
+    cfg = ZCAN_CHANNEL_INIT_CONFIG()
+    cfg.can_type = ZCAN_TYPE_CAN
+    tx_chn = zcan.InitCAN(zcan.OpenDevice(ZCAN_VIRTUAL_DEVICE, 0, 0), 0, cfg)
+    rx_chn = zcan.InitCAN(zcan.OpenDevice(ZCAN_VIRTUAL_DEVICE, 0, 0), 0, cfg)
+    zcan.StartCAN(tx_chn)
+    zcan.StartCAN(rx_chn)
+    return zcan, tx_chn, rx_chn
+
+
+def listen(zcan, chn, stamps, stop):
+    while not stop.is_set():
+        msgs, num = zcan.Receive(chn, 1000, 10)
+        for i in range(num):
+            stamps[msgs[i].frame.can_id].append(msgs[i].timestamp)
+
+
+class EventWaitSender(object):
+    """
+    loop of the former GUI PeriodSendThread: send, then Event.wait(period)
+    """
+    def __init__(self, zcan, chn, can_id, period):
+        self.msg = ZCAN_Transmit_Data()
+        self.msg.frame.can_id = can_id
+        self.msg.frame.can_dlc = 8
+        self.zcan, self.chn, self.period = zcan, chn, period
+        self.event = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.start()
+
+    def run(self):
+        self.zcan.Transmit(self.chn, self.msg, 1)
+        while not self.event.wait(self.period):
+            self.zcan.Transmit(self.chn, self.msg, 1)
+
+
+def run(kind, n, seconds):
+    zcan, tx_chn, rx_chn = open_channels()
+    stamps, stop = collections.defaultdict(list), threading.Event()
+    listener = threading.Thread(target=listen, args=(zcan, rx_chn, stamps, stop))
+    listener.start()
+    periods = dict((0x100 + i, PERIODS[i % len(PERIODS)]) for i in range(n))
+    if kind == "scheduler":
+        scheduler = can_periodic.PeriodicScheduler(zcan, tx_chn).start()
+        for can_id, period in periods.items():
+            scheduler.add(can_id, bytes(8), period)
+        time.sleep(seconds)
+        scheduler.stop()
+    else:
+        senders = [EventWaitSender(zcan, tx_chn, can_id, period) for can_id, period in periods.items()]
+        time.sleep(seconds)
+        for sender in senders:
+            sender.event.set()
+            sender.thread.join()
+    stop.set()
+    listener.join()
+
+    drift, error = [], []
+    for can_id, period in periods.items():
+        ts = stamps[can_id]
+        drift.append(((ts[-1] - ts[0]) / 1e6 - (len(ts) - 1) * period) * 1e3)
+        error.extend(abs((b - a) / 1e6 - period) * 1e3 for a, b in zip(ts, ts[1:]))
+    error.sort()
+    print("%-10s %3d messages %2d s: %6d frames, drift of the last frame mean %+8.2f ms max %+8.2f ms, "
+          "period error p99 %.2f ms" % (kind, n, seconds, sum(len(ts) for ts in stamps.values()),
+                                        sum(drift) / len(drift), max(drift, key=abs), error[int(len(error) * 0.99)]))
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    seconds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    run("scheduler", n, seconds)
+    run("event wait", n, seconds)
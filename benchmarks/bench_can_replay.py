@@ -0,0 +1,82 @@
+# -*- coding:utf-8 -*-
+#  bench_can_replay.py
+#
+#  ~~~~~~~~~~~~
+#
+#  Timing of can_replay against the virtual device: a synthetic trace at a constant frame rate
+#  is replayed on one virtual channel while a second node on the same bus receives it. Reports
+#  the sender side jitter (ReplayStats) and the error of the receive timestamps against the
+#  recorded offsets, which also shows any drift over the run
+#
+#  usage: python benchmarks/bench_can_replay.py [frames/s] [seconds]
+#
+#  ~~~~~~~~~~~~
+#
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zlgcan import *
+import can_replay
+import can_trace
+
+BATCH = 100
+
+
+def write_trace(path, rate, seconds):
+    msgs = (ZCAN_Receive_Data * BATCH)()
+    period_us = 1000000 // rate
+    with can_trace.TraceRecorder(path) as recorder:
+        for first in range(0, rate * seconds, BATCH):
+            for i in range(BATCH):
+                msgs[i].frame.can_id = 0x100 + (first + i) % 32
+                msgs[i].frame.can_dlc = 8
+                msgs[i].timestamp = (first + i) * period_us
+            recorder.on_rx(msgs, BATCH)
+
+
+def listen(zcan, chn, stamps, stop):
+    while not stop.is_set():
+        msgs, num = zcan.Receive(chn, 1000, 10)
+        stamps.extend(msgs[i].timestamp for i in range(num))
+
+
+if __name__ == "__main__":
+    rate = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    seconds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    work_dir = tempfile.mkdtemp(prefix="ccdiag_replay_")
+    path = os.path.join(work_dir, "bench" + can_trace.TRACE_EXT)
+    try:
+        write_trace(path, rate, seconds)
+        zcan = ZCANVirtualDriver()
+        cfg = ZCAN_CHANNEL_INIT_CONFIG()
+        cfg.can_type = ZCAN_TYPE_CAN
+        tx_chn = zcan.InitCAN(zcan.OpenDevice(ZCAN_VIRTUAL_DEVICE, 0, 0), 0, cfg)
+        rx_chn = zcan.InitCAN(zcan.OpenDevice(ZCAN_VIRTUAL_DEVICE, 0, 0), 0, cfg)
+        zcan.StartCAN(tx_chn)
+        zcan.StartCAN(rx_chn)
+
+        stamps, stop = [], threading.Event()
+        listener = threading.Thread(target=listen, args=(zcan, rx_chn, stamps, stop))
+        listener.start()
+        with can_trace.TraceReader(path) as reader:
+            replay = can_replay.TraceReplay(zcan, tx_chn, reader).start()
+            replay.wait()
+            replay.stop()
+        stop.set()
+        listener.join()
+
+        print("%d frames/s for %d s" % (rate, seconds))
+        for line in replay.stats.lines():
+            print(line)
+        period_us = 1000000 // rate
+        errors = sorted(abs((ts - stamps[0]) - i * period_us) / 1e3 for i, ts in enumerate(stamps))
+        print("receive side: %d frames, error p99 %.3f ms  max %.3f ms, last frame %+.3f ms" % (
+            len(stamps), errors[int(len(errors) * 0.99)], errors[-1],
+            ((stamps[-1] - stamps[0]) - (len(stamps) - 1) * period_us) / 1e3))
+    finally:
+        shutil.rmtree(work_dir)
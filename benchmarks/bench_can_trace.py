@@ -0,0 +1,71 @@
+# -*- coding:utf-8 -*-
+#  bench_can_trace.py
+#
+#  ~~~~~~~~~~~~
+#
+#  TraceRecorder throughput with ReceiveFD batches of 64 byte frames, against the frame rate
+#  of a fully loaded CAN FD bus (500k arbitration / 8M data, about 12k frames/s), then
+#  TraceReader time range queries and the ASC/BLF export of the trace
+#
+#  usage: python benchmarks/bench_can_trace.py [frames] [batch]
+#
+#  ~~~~~~~~~~~~
+#
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zlgcan import ZCAN_ReceiveFD_Data
+import can_trace
+
+BUS_FRAMES_PER_S = 12000
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    batch = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    work_dir = tempfile.mkdtemp(prefix="ccdiag_trace_")
+    path = os.path.join(work_dir, "bench" + can_trace.TRACE_EXT)
+
+    msgs = (ZCAN_ReceiveFD_Data * batch)()
+    for i in range(batch):
+        msgs[i].frame.can_id = 0x700 + i % 16
+        msgs[i].frame.len = 64
+        msgs[i].frame.brs = 1
+        for j in range(64):
+            msgs[i].frame.data[j] = (i + j) & 0xFF
+    try:
+        recorder = can_trace.TraceRecorder(path, fd=True)
+        t = time.perf_counter()
+        tap = 0.0
+        ts = 0
+        for first in range(0, n, batch):
+            for i in range(batch):
+                msgs[i].timestamp = ts + i * 83
+            ts += batch * 83
+            t_tap = time.perf_counter()
+            recorder.on_rx(msgs, batch)
+            tap += time.perf_counter() - t_tap
+        recorder.close()
+        elapsed = time.perf_counter() - t
+        frames = len(range(0, n, batch)) * batch
+        print("recorded %d frames in %.2f s, %.0f frames/s (bus %d/s), tap %.1f us/batch, %.1f MB" % (
+            frames, elapsed, frames / elapsed, BUS_FRAMES_PER_S, tap / (frames // batch) * 1e6,
+            os.path.getsize(path) / 1e6))
+
+        with can_trace.TraceReader(path) as reader:
+            t = time.perf_counter()
+            hits = sum(1 for f in reader.frames(10.0, 10.1))
+            print("query 100 ms at 10 s of %.1f s: %d frames in %.2f ms, %d frames in the trace" % (
+                reader.duration, hits, (time.perf_counter() - t) * 1e3, len(reader)))
+            for name, export in (("asc", can_trace.to_asc), ("blf", can_trace.to_blf)):
+                t = time.perf_counter()
+                export(reader, os.path.join(work_dir, "bench." + name), end=5.0)
+                print("%s export of 5 s: %.2f s, %.1f MB" % (name, time.perf_counter() - t,
+                                                             os.path.getsize(os.path.join(work_dir, "bench." + name)) / 1e6))
+    finally:
+        shutil.rmtree(work_dir)
@@ -0,0 +1,47 @@
+# -*- coding:utf-8 -*-
+#  bench_canfd_flash.py
+#
+#  ~~~~~~~~~~~~
+#
+#  Full flash of the simulated ESC over classic CAN (8 byte frames) and over CAN FD
+#  (64 byte frames, BRS): time, CAN frames sent/received and frames per TransferData block
+#
+#  usage: python benchmarks/bench_canfd_flash.py [sw.s19] [boot.s19]
+#
+#  ~~~~~~~~~~~~
+#
+import os
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+WORK_DIR = tempfile.mkdtemp(prefix="ccdiag_canfd_")
+os.environ.setdefault("CCDIAG_FLASH_RECORDS", os.path.join(WORK_DIR, "records"))
+os.environ.setdefault("CCDIAG_FLASH_CACHE", os.path.join(WORK_DIR, "cache"))
+
+from ccdiag_engine import CCDiagEngine
+
+
+def flash(label, device, sw, boot, fd):
+    engine = CCDiagEngine(os.path.join(ROOT, "dev_info.json"), os.path.join(ROOT, "DTCList.json"))
+    try:
+        if fd:
+            engine.set_canfd("ESC")
+        engine.open_device(device, 0)
+        engine.open_channel(0)
+        report = engine.flash(sw, boot, resume=False).result()
+    finally:
+        engine.close()
+    blocks = sum(len(timing.blocks) for _, timing in report.transfers)
+    print("%-8s ok:%-5s %7.2f s  tx %7d  rx %6d  %6.1f tx frames/block" % (
+        label, report.ok, report.elapsed, report.counters.get("tx_frames", 0), report.counters.get("rx_frames", 0),
+        float(report.counters.get("tx_frames", 0)) / max(1, blocks)))
+    return report
+
+
+if __name__ == "__main__":
+    sw = sys.argv[1] if len(sys.argv) > 1 else os.path.join(ROOT, "LEARAD00012.s19")
+    boot = sys.argv[2] if len(sys.argv) > 2 else os.path.join(ROOT, "LEDRAA00003.s19")
+    flash("classic", "ZCAN-VIRTUAL", sw, boot, False)
+    flash("can fd", "ZCAN-VIRTUAL-FD", sw, boot, True)
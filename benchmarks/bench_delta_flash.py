@@ -0,0 +1,65 @@
+# -*- coding:utf-8 -*-
+#  bench_delta_flash.py
+#
+#  ~~~~~~~~~~~~
+#
+#  Delta flashing against the simulated ESC: baseline flash, same image again, then an image
+#  where only the small application segment at 0xFFFF00 changed
+#
+#  usage: python benchmarks/bench_delta_flash.py [sw.s19] [boot.s19]
+#
+#  ~~~~~~~~~~~~
+#
+import os
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+WORK_DIR = tempfile.mkdtemp(prefix="ccdiag_delta_")
+os.environ.setdefault("CCDIAG_FLASH_RECORDS", os.path.join(WORK_DIR, "records"))
+os.environ.setdefault("CCDIAG_FLASH_CACHE", os.path.join(WORK_DIR, "cache"))
+
+from ccdiag_engine import CCDiagEngine
+
+
+def patch_last_record(src, dst, value):
+    """
+    copy of src with the data of its last S1/S2/S3 record replaced by value, checksum recomputed
+    """
+    with open(src, "r") as fd:
+        lines = fd.read().splitlines()
+    for i in range(len(lines) - 1, -1, -1):
+        if lines[i][:2] in ("S1", "S2", "S3"):
+            break
+    rec = lines[i]
+    addr_len = {"S1": 2, "S2": 3, "S3": 4}[rec[:2]]
+    raw = bytearray.fromhex(rec[2:-2])
+    raw[1 + addr_len:] = value[:len(raw) - 1 - addr_len].ljust(len(raw) - 1 - addr_len, b"\0")
+    lines[i] = rec[:2] + raw.hex().upper() + "%02X" % (~sum(raw) & 0xFF)
+    with open(dst, "w") as fd:
+        fd.write("\n".join(lines) + "\n")
+    return dst
+
+
+def flash(engine, label, sw, boot):
+    report = engine.flash(sw, boot, delta=True).result()
+    print("%-10s ok:%-5s %8.2f s  %8d bytes  %s" % (label, report.ok, report.elapsed, report.bytes,
+                                                   report.error or ", ".join(report.skipped)))
+    return report
+
+
+if __name__ == "__main__":
+    sw = sys.argv[1] if len(sys.argv) > 1 else os.path.join(ROOT, "LEARAD00012.s19")
+    boot = sys.argv[2] if len(sys.argv) > 2 else os.path.join(ROOT, "LEDRAA00003.s19")
+    sw_patched = patch_last_record(sw, os.path.join(WORK_DIR, "patched.s19"), b"\x12\x34\x56\x78")
+
+    engine = CCDiagEngine(os.path.join(ROOT, "dev_info.json"), os.path.join(ROOT, "DTCList.json"))
+    try:
+        engine.open_device("ZCAN-VIRTUAL", 0)
+        engine.open_channel(0)
+        flash(engine, "baseline", sw, boot)
+        flash(engine, "same", sw, boot)
+        flash(engine, "patched", sw_patched, boot)
+    finally:
+        engine.close()
@@ -0,0 +1,54 @@
+# -*- coding:utf-8 -*-
+#  bench_did_batch.py
+#
+#  ~~~~~~~~~~~~
+#
+#  Identification block of the simulated ESC (DIDList.json group "identification") read one
+#  read_data_by_identifier per DID versus did_registry.read_dids batches, with a response latency
+#
+#  usage: python benchmarks/bench_did_batch.py [rounds] [latency ms]
+#
+#  ~~~~~~~~~~~~
+#
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from ccdiag_engine import CCDiagEngine
+
+
+def one_by_one(client, dids):
+    return dict((did, client.read_data_by_identifier(did).service_data.values[did]) for did in dids)
+
+
+def run(label, fn, rounds):
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    print("%-12s %8.1f ms" % (label, (time.perf_counter() - t0) / rounds * 1e3))
+
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    engine = CCDiagEngine(os.path.join(ROOT, "dev_info.json"), os.path.join(ROOT, "DTCList.json"),
+                          did_list_path=os.path.join(ROOT, "DIDList.json"))
+    try:
+        engine.open_device("ZCAN-VIRTUAL", 0)
+        engine.open_channel(0)
+        engine.targets["ESC"].set_flow_control(0, 0)
+        for ecu in engine.simulator.ecus:
+            ecu.latency = latency / 1e3
+        dids = engine.did_registry.group("identification")
+        print("%d identification DIDs" % len(dids))
+        run("one by one", lambda: engine.submit(one_by_one, engine.udsclient, dids).result(), rounds)
+        run("batched", lambda: engine.read_identification().result(), rounds)
+        engine.simulator.ecus[0].max_dids = 8
+        result = engine.read_identification().result()
+        print("ECU limited to 8 DIDs: first read %d requests, learned max %d DIDs" % (result.requests, result.max_dids))
+        run("batched, 8", lambda: engine.read_identification().result(), rounds)
+    finally:
+        engine.close()
@@ -0,0 +1,89 @@
+# -*- coding:utf-8 -*-
+#  bench_flash_blocks.py
+#
+#  ~~~~~~~~~~~~
+#
+#  Host CPU time per TransferData block: memoryview walk vs. the old v = v[n:] loop
+#
+#  usage: python benchmarks/bench_flash_blocks.py [file.s19] [maxNumberOfBlockLength]
+#
+#  ~~~~~~~~~~~~
+#
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import srecord
+import uds_flash
+
+
+class BlockTimingClient(object):
+    """
+    stands in for udsoncan.Client, records the host time spent between two TransferData calls
+    """
+    class _Resp(object):
+        pass
+
+    def __init__(self, max_length):
+        self._max_length = max_length
+        self.block_times = []
+        self._last = None
+
+    def request_download(self, memory_location):
+        resp = self._Resp()
+        resp.service_data = self._Resp()
+        resp.service_data.max_length = self._max_length
+        self._last = time.perf_counter()
+        return resp
+
+    def transfer_data(self, sequence_number, data):
+        now = time.perf_counter()
+        self.block_times.append(now - self._last)
+        self._last = time.perf_counter()
+
+    def request_transfer_exit(self):
+        pass
+
+
+def legacy_download(client, data):
+    """
+    loop as it was in BtnSwFlash_Click, data as list of ints sliced on every block
+    """
+    v = list(data)
+    resp = client.request_download(memory_location=None)
+    _maxNumOfBlockLen = resp.service_data.max_length
+    _blockSequenceCounter = 1
+    while len(v) > _maxNumOfBlockLen:
+        client.transfer_data(sequence_number=_blockSequenceCounter, data=v[0:(_maxNumOfBlockLen-2)])
+        _blockSequenceCounter = (_blockSequenceCounter + 1) & 0xFF
+        v = v[(_maxNumOfBlockLen-2):]
+    client.transfer_data(sequence_number=_blockSequenceCounter, data=v)
+
+
+def report(name, times):
+    n = len(times)
+    tenth = max(n // 10, 1)
+    first = sum(times[:tenth]) / tenth
+    last = sum(times[-tenth:]) / tenth
+    print("%-10s blocks:%5d  total:%8.1f ms  first 10%%:%8.1f us/block  last 10%%:%8.1f us/block  ratio:%5.2f" % (
+        name, n, sum(times) * 1e3, first * 1e6, last * 1e6, first / last if last else 0.0))
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), "..", "LEDRAA00003.s19")
+    max_length = int(sys.argv[2], 0) if len(sys.argv) > 2 else 0x402
+
+    segments = srecord.load_segments(path)
+    largest = max(segments, key=lambda seg: seg.size)
+    print("%s: %d segments, largest %r, maxNumberOfBlockLength %d" % (
+        os.path.basename(path), len(segments), largest, max_length))
+
+    client = BlockTimingClient(max_length)
+    uds_flash.download_segment(client, None, largest.data)
+    report("memoryview", client.block_times)
+
+    client = BlockTimingClient(max_length)
+    legacy_download(client, largest.data)
+    report("legacy", client.block_times)
@@ -0,0 +1,49 @@
+# -*- coding:utf-8 -*-
+#  bench_isotp_tune.py
+#
+#  ~~~~~~~~~~~~
+#
+#  STmin/blocksize auto-tuning against the simulated ESC: DTC read and a 190 byte multi-DID read
+#  with the configured flow control (32 ms, 8) and after isotp_tune
+#
+#  usage: python benchmarks/bench_isotp_tune.py [rounds]
+#
+#  ~~~~~~~~~~~~
+#
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.environ.setdefault("CCDIAG_ISOTP_TUNE", os.path.join(tempfile.mkdtemp(prefix="ccdiag_tune_"), "isotp_tune.json"))
+
+from ccdiag_engine import CCDiagEngine
+import isotp_tune
+
+
+def measure(engine, label, rounds):
+    target = engine.targets["ESC"]
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        engine.read_dtc(0xFF).result()
+    dtc_ms = (time.perf_counter() - t0) / rounds * 1e3
+    rate = engine.submit(isotp_tune.probe, target, rounds).result()
+    print("%-8s stmin %-6s bs %-3d  read-dtc %7.1f ms  multi-DID %9.0f bytes/s" % (
+        label, isotp_tune.stmin_text(target.flow_control[0]), target.flow_control[1], dtc_ms, rate))
+
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    engine = CCDiagEngine(os.path.join(ROOT, "dev_info.json"), os.path.join(ROOT, "DTCList.json"))
+    try:
+        engine.open_device("ZCAN-VIRTUAL", 0)
+        engine.open_channel(0)
+        measure(engine, "default", rounds)
+        result = engine.tune_isotp().result()
+        for line in result.lines():
+            print(line)
+        measure(engine, "tuned", rounds)
+    finally:
+        engine.close()
@@ -0,0 +1,110 @@
+# -*- coding:utf-8 -*-
+#  bench_isotp_worker.py
+#
+#  ~~~~~~~~~~~~
+#
+#  IsoTpConnection worker: idle CPU and request latency, 0.1ms polling vs. event driven,
+#  against an ECU simulated in-process (loopback bus, no hardware)
+#
+#  usage: python benchmarks/bench_isotp_worker.py [requests] [idle seconds]
+#
+#  ~~~~~~~~~~~~
+#
+import collections
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import isotp
+from ccdiag_engine import IsoTpConnection, ESC_TX_ID, ESC_RX_ID_PHYS
+
+ISOTP_PARAMS = {'stmin': 0, 'blocksize': 8, 'tx_padding': 0}
+
+
+class LoopbackEcu(object):
+    """
+    answers 0x22 with a 40 bytes record (multi frame) and everything else with a positive echo
+    """
+    def __init__(self, deliver):
+        self._rx = collections.deque()
+        self._deliver = deliver
+        self._wakeup = threading.Event()
+        self._stop = False
+        self.layer = isotp.TransportLayer(rxfn=self._rcv, txfn=deliver,
+                                          address=isotp.Address(isotp.AddressingMode.Normal_11bits,
+                                                                txid=ESC_TX_ID, rxid=ESC_RX_ID_PHYS),
+                                          params=ISOTP_PARAMS)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _rcv(self):
+        return self._rx.popleft() if self._rx else None
+
+    def put(self, msg):
+        self._rx.append(msg)
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop:
+            self.layer.process()
+            while self.layer.available():
+                req = self.layer.recv()
+                if req[0] == 0x22:
+                    self.layer.send(bytearray([0x62]) + req[1:3] + bytearray(range(40)))
+                else:
+                    self.layer.send(bytearray([req[0] + 0x40]) + req[1:])
+                self.layer.process()
+            self._wakeup.wait(self.layer.sleep_time())
+            self._wakeup.clear()
+
+    def stop(self):
+        self._stop = True
+        self._wakeup.set()
+
+
+def run(event_driven, requests, idle):
+    tester_rx = collections.deque()
+    conn_box = []
+
+    def to_tester(msg):
+        tester_rx.append(msg)
+        conn_box[0].notify_rx()
+
+    ecu = LoopbackEcu(to_tester)
+    layer = isotp.TransportLayer(rxfn=lambda: tester_rx.popleft() if tester_rx else None, txfn=ecu.put,
+                                 address=isotp.Address(isotp.AddressingMode.Normal_11bits,
+                                                       txid=ESC_RX_ID_PHYS, rxid=ESC_TX_ID),
+                                 params=ISOTP_PARAMS)
+    conn = IsoTpConnection(isotp_layer=layer, event_driven=event_driven)
+    conn_box.append(conn)
+    conn.open()
+
+    cpu0 = time.process_time()
+    time.sleep(idle)
+    idle_cpu = (time.process_time() - cpu0) / idle
+
+    latencies = []
+    for i in range(requests):
+        req = b'\x22\xF1\x95' if i % 2 else b'\x3E\x00'
+        t0 = time.perf_counter()
+        conn.send(req)
+        conn.wait_frame(timeout=2)
+        latencies.append(time.perf_counter() - t0)
+
+    conn.close()
+    ecu.stop()
+    latencies.sort()
+    print("%-12s idle CPU:%6.1f %%  latency mean:%6.2f ms  p95:%6.2f ms  max:%6.2f ms" % (
+        "event" if event_driven else "poll 0.1ms", idle_cpu * 100,
+        sum(latencies) / len(latencies) * 1e3, latencies[int(len(latencies) * 0.95)] * 1e3, latencies[-1] * 1e3))
+
+
+if __name__ == "__main__":
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    idle = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+    run(False, requests, idle)
+    run(True, requests, idle)
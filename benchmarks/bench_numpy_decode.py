@@ -0,0 +1,68 @@
+# -*- coding:utf-8 -*-
+#  bench_numpy_decode.py
+#
+#  ~~~~~~~~~~~~
+#
+#  Decode of a full receive buffer: ctypes field access per frame, as in the zlgcan demo loop,
+#  against the zcan_numpy columns. Both results are compared frame by frame.
+#
+#  usage: python benchmarks/bench_numpy_decode.py [frames]
+#
+#  ~~~~~~~~~~~~
+#
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zlgcan import ZCAN_Receive_Data, ZCAN_ReceiveFD_Data
+import zcan_numpy
+
+
+def fill(msgs, fd):
+    rnd = random.Random(1)
+    for i, msg in enumerate(msgs):
+        msg.frame.eff = rnd.random() < 0.3
+        msg.frame.rtr = rnd.random() < 0.05
+        msg.frame.can_id = rnd.getrandbits(29 if msg.frame.eff else 11)
+        size = rnd.choice((0, 8, 12, 16, 20, 24, 32, 48, 64)) if fd else rnd.randint(0, 8)
+        if fd:
+            msg.frame.len = size
+            msg.frame.brs = rnd.random() < 0.5
+        else:
+            msg.frame.can_dlc = size
+        for j in range(size):
+            msg.frame.data[j] = rnd.getrandbits(8)
+        msg.timestamp = i * 125
+
+
+def ctypes_decode(msgs, fd):
+    frames = []
+    for i in range(len(msgs)):
+        f = msgs[i].frame
+        size = f.len if fd else f.can_dlc
+        frames.append((f.can_id, f.eff, f.rtr, size, msgs[i].timestamp, bytes(f.data[j] for j in range(size))))
+    return frames
+
+
+def bench(rcv_type, n, fd):
+    msgs = (rcv_type * n)()
+    fill(msgs, fd)
+    t = time.perf_counter()
+    expected = ctypes_decode(msgs, fd)
+    t_ctypes = time.perf_counter() - t
+    t = time.perf_counter()
+    cols = zcan_numpy.decode(msgs, n)
+    t_numpy = time.perf_counter() - t
+    ok = all(expected[i] == (cols.id[i], cols.eff[i], cols.rtr[i], cols.dlc[i], cols.timestamp[i], cols.payload(i))
+             for i in range(n))
+    print("%-20s %7d frames  ctypes %9.1f ms  numpy %7.2f ms  x%-7.0f same: %s" % (
+        rcv_type.__name__, n, t_ctypes * 1e3, t_numpy * 1e3, t_ctypes / t_numpy, ok))
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    bench(ZCAN_Receive_Data, n, False)
+    bench(ZCAN_ReceiveFD_Data, n, True)
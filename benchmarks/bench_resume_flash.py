@@ -0,0 +1,55 @@
+# -*- coding:utf-8 -*-
+#  bench_resume_flash.py
+#
+#  ~~~~~~~~~~~~
+#
+#  Recovery time of a failed ESC flash with the segment journal: a TransferData fault is injected
+#  in the simulated ESC, by default in the last application segment, then the flash is retried with
+#  resume and compared to a full flash. The flash driver is downloaded again by every resume
+#
+#  usage: python benchmarks/bench_resume_flash.py [sw.s19] [boot.s19] [fault after n TransferData]
+#
+#  ~~~~~~~~~~~~
+#
+import os
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.environ.setdefault("CCDIAG_FLASH_JOURNAL", tempfile.mkdtemp(prefix="ccdiag_journal_"))
+
+import ecu_sim
+import srecord
+from ccdiag_engine import CCDiagEngine
+
+
+def flash(engine, sw, boot, resume):
+    report = engine.flash(sw, boot, resume=resume).result()
+    print("%-12s ok:%-5s %8.2f s  %8d bytes  %s" % (
+        "resume" if report.skipped else ("full" if report.ok else "failed"), report.ok, report.elapsed,
+        report.bytes, report.error or ("skipped %d step(s)" % len(report.skipped))))
+    return report
+
+
+if __name__ == "__main__":
+    sw = sys.argv[1] if len(sys.argv) > 1 else os.path.join(ROOT, "LEARAD00012.s19")
+    boot = sys.argv[2] if len(sys.argv) > 2 else os.path.join(ROOT, "LEDRAA00003.s19")
+
+    engine = CCDiagEngine(os.path.join(ROOT, "dev_info.json"), os.path.join(ROOT, "DTCList.json"))
+    try:
+        engine.open_device("ZCAN-VIRTUAL", 0)
+        engine.open_channel(0)
+        full = flash(engine, sw, boot, resume=False)
+        blocks = sum(len(timing.blocks) for _, timing in full.transfers)
+        after = int(sys.argv[3]) if len(sys.argv) > 3 else blocks - 1
+
+        engine.simulator.ecu("ESC").inject_nrc(0x36, ecu_sim.NRC_GENERAL_PROGRAMMING_FAILURE, count=1, after=after)
+        failed = flash(engine, sw, boot, resume=False)
+        resumed = flash(engine, sw, boot, resume=True)
+        segment = max(srecord.load_segments(sw), key=lambda seg: seg.size)
+        print("verify: %s" % (engine.simulator.ecu("ESC").memory.get(segment.address) == segment.data))
+        print("recovery: failed run + resume %.2f s, failed run + full retry %.2f s" % (
+            failed.elapsed + resumed.elapsed, failed.elapsed + full.elapsed))
+    finally:
+        engine.close()
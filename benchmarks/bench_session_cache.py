@@ -0,0 +1,54 @@
+# -*- coding:utf-8 -*-
+#  bench_session_cache.py
+#
+#  ~~~~~~~~~~~~
+#
+#  Station cycle of the ESC buttons (read sw version, C11 config, INS calibration, EPB release/apply)
+#  against the simulated ESC with a response latency: session/security state dropped before every
+#  operation (0x10/0x27 each time) versus kept by uds_session.SessionClient
+#
+#  usage: python benchmarks/bench_session_cache.py [cycles] [latency ms]
+#
+#  ~~~~~~~~~~~~
+#
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from ccdiag_engine import CCDiagEngine
+
+
+def cycle(engine, cycles, cached):
+    client = engine.udsclient
+    ecu = engine.simulator.ecus[0]
+    requests = ecu.requests
+    t0 = time.perf_counter()
+    for _ in range(cycles):
+        for operation in (engine.read_sw_version, engine.c11_config, engine.ins_calibration,
+                          engine.release_epb, engine.apply_epb):
+            if not cached:
+                client.state.reset()
+            operation().result()
+    elapsed = time.perf_counter() - t0
+    print("%-10s %8.1f ms/cycle  %5.1f requests/cycle  %d exchanges skipped" % (
+        "cached" if cached else "uncached", elapsed / cycles * 1e3, float(ecu.requests - requests) / cycles,
+        client.state.skipped))
+
+
+if __name__ == "__main__":
+    cycles = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    engine = CCDiagEngine(os.path.join(ROOT, "dev_info.json"), os.path.join(ROOT, "DTCList.json"))
+    try:
+        engine.open_device("ZCAN-VIRTUAL", 0)
+        engine.open_channel(0)
+        for ecu in engine.simulator.ecus:
+            ecu.latency = latency / 1e3
+        cycle(engine, cycles, False)
+        engine.udsclient.state.skipped = 0
+        cycle(engine, cycles, True)
+    finally:
+        engine.close()
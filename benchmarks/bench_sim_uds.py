@@ -0,0 +1,115 @@
+# -*- coding:utf-8 -*-
+#  bench_sim_uds.py
+#
+#  ~~~~~~~~~~~~
+#
+#  Diagnostic suite runtime and flashing throughput against the simulated ECUs
+#  (ZCANVirtualDriver + ecu_sim), same ZCAN/isotp/udsoncan stack as CCDiag, no hardware
+#
+#  usage: python benchmarks/bench_sim_uds.py [file.s19] [suite rounds] [latency ms] [maxNumberOfBlockLength]
+#
+#  ~~~~~~~~~~~~
+#
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import isotp
+import udsoncan
+from udsoncan import MemoryLocation
+from udsoncan.client import Client
+
+import ecu_sim
+import srecord
+import uds_flash
+from zlgcan import *
+from zcan_isotp import ZCANDispatcher, ZCANRxQueue, ZCANTxRing
+from ccdiag_engine import IsoTpConnection, sec_algo, SECURITY_ALGO_PARAMS, ESC_TX_ID, ESC_RX_ID_PHYS
+
+ISOTP_PARAMS = {'stmin': 0, 'blocksize': 8, 'tx_padding': 0}
+
+
+class SimTester(object):
+    """
+    tester side wired like CCDiag: virtual channel, dispatcher, tx ring, IsoTpConnection, udsoncan client
+    """
+    def __init__(self, latency, max_block_length):
+        self.zcan = ZCANVirtualDriver()
+        dev = self.zcan.OpenDevice(ZCAN_VIRTUAL_DEVICE, 0, 0)
+        cfg = ZCAN_CHANNEL_INIT_CONFIG()
+        cfg.can_type = ZCAN_TYPE_CAN
+        self.chn = self.zcan.InitCAN(dev, 0, cfg)
+        self.zcan.StartCAN(self.chn)
+        self.sim = ecu_sim.start_simulator(0, 0, ecus=ecu_sim.default_ecus(
+            security_algo=sec_algo, security_algo_params=SECURITY_ALGO_PARAMS,
+            latency=latency, max_block_length=max_block_length))
+
+        self.ring = ZCANTxRing(self.zcan, self.chn)
+        self.pump = ZCANDispatcher(self.zcan, self.chn)
+        self.rx_queue = ZCANRxQueue(ESC_TX_ID)
+        layer = isotp.TransportLayer(rxfn=self.rx_queue.recv, txfn=self.ring.send,
+                                     address=isotp.Address(isotp.AddressingMode.Normal_11bits,
+                                                           txid=ESC_RX_ID_PHYS, rxid=ESC_TX_ID),
+                                     params=ISOTP_PARAMS)
+        self.conn = IsoTpConnection(isotp_layer=layer, event_driven=True, tx_flush=self.ring.flush)
+        self.rx_queue.on_rx = self.conn.notify_rx
+        self.pump.attach(self.rx_queue)
+        self.pump.start()
+        self.client = Client(self.conn, request_timeout=2)
+        self.client.config['security_algo'] = sec_algo
+        self.client.config['security_algo_params'] = SECURITY_ALGO_PARAMS
+        self.client.config['data_identifiers'] = {0xF195: udsoncan.DidCodec('B'), 0xF1A8: udsoncan.DidCodec('B')}
+        self.client.config['server_address_format'] = 32
+        self.client.config['server_memorysize_format'] = 32
+        self.client.open()
+
+    def close(self):
+        self.client.close()
+        self.pump.stop()
+        self.sim.stop()
+        self.zcan.ResetCAN(self.chn)
+
+
+def diag_suite(client):
+    client.change_session(1)
+    client.change_session(3)
+    client.unlock_security_access(1)
+    client.read_data_by_identifier(0xF195)
+    client.write_data_by_identifier(did=0xF1A8, value=0x0F)
+    client.start_routine(routine_id=0xF001)
+    client.get_dtc_by_status_mask(9)
+    client.clear_dtc(0xFFFFFF)
+    client.change_session(1)
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), "..", "LEDRAA00003.s19")
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    latency = float(sys.argv[3]) / 1000.0 if len(sys.argv) > 3 else 0.0
+    max_length = int(sys.argv[4], 0) if len(sys.argv) > 4 else 0x402
+
+    tester = SimTester(latency, max_length)
+    try:
+        t0 = time.perf_counter()
+        for i in range(rounds):
+            diag_suite(tester.client)
+        elapsed = time.perf_counter() - t0
+        print("diag suite   rounds:%4d  %8.1f ms/round" % (rounds, elapsed / rounds * 1e3))
+
+        segment = max(srecord.load_segments(path), key=lambda seg: seg.size)
+        tester.client.change_session(3)
+        tester.client.change_session(2)
+        tester.client.unlock_security_access(0x11)
+        tester.client.start_routine(ecu_sim.ROUTINE_CHECK_DRIVER)
+        t0 = time.perf_counter()
+        uds_flash.download_segment(tester.client, MemoryLocation(address=segment.address, memorysize=segment.size),
+                                   segment.data)
+        elapsed = time.perf_counter() - t0
+        written = tester.sim.ecu("ESC").memory.get(segment.address)
+        print("flash        %d bytes  %8.1f ms  %8.1f kB/s  verify:%s  tx calls:%d frames:%d" % (
+            segment.size, elapsed * 1e3, segment.size / elapsed / 1024, written == segment.data,
+            tester.ring.tx_calls, tester.ring.tx_frames))
+    finally:
+        tester.close()
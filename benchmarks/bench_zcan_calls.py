@@ -0,0 +1,133 @@
+# -*- coding:utf-8 -*-
+#  bench_zcan_calls.py
+#
+#  ~~~~~~~~~~~~
+#
+#  Per-call overhead of the ZCAN bindings: undeclared calls looked up on every call (legacy),
+#  prebuilt prototypes with an int handle (argtypes) and ZCAN, whose prototypes take the boxed
+#  channel handle. The declared argtypes cost a few hundred ns per call, the price of the checks.
+#  A stub zlgcan library is compiled with the system C compiler, so it runs on Linux.
+#
+#  usage: python benchmarks/bench_zcan_calls.py [calls]
+#
+#  ~~~~~~~~~~~~
+#
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zlgcan import *
+
+STUB_SOURCE = r"""
+#include <string.h>
+typedef struct { unsigned int id; unsigned char dlc, pad, res0, res1; unsigned char data[8]; } frame_t;
+typedef struct { frame_t frame; unsigned long long timestamp; } rx_t;
+typedef struct { frame_t frame; unsigned int transmit_type; } tx_t;
+
+void *ZCAN_OpenDevice(unsigned int t, unsigned int i, unsigned int r) { return (void *)0x1000; }
+unsigned int ZCAN_CloseDevice(void *h) { return 1; }
+unsigned int ZCAN_GetDeviceInf(void *h, void *info) { return 1; }
+unsigned int ZCAN_IsDeviceOnLine(void *h) { return 2; }
+void *ZCAN_InitCAN(void *h, unsigned int c, void *cfg) { return (void *)0x2000; }
+unsigned int ZCAN_StartCAN(void *c) { return 1; }
+unsigned int ZCAN_ResetCAN(void *c) { return 1; }
+unsigned int ZCAN_ClearBuffer(void *c) { return 1; }
+unsigned int ZCAN_ReadChannelErrInfo(void *c, void *e) { return 1; }
+unsigned int ZCAN_ReadChannelStatus(void *c, void *s) { return 1; }
+unsigned int ZCAN_GetReceiveNum(void *c, unsigned char t) { return 20; }
+unsigned int ZCAN_Transmit(void *c, tx_t *m, unsigned int n) { return n; }
+unsigned int ZCAN_Receive(void *c, rx_t *m, unsigned int n, int w) {
+    unsigned int i;
+    for (i = 0; i < n; i++) { m[i].frame.id = 0x73E; m[i].frame.dlc = 8; m[i].timestamp = i; }
+    return n;
+}
+unsigned int ZCAN_TransmitFD(void *c, void *m, unsigned int n) { return n; }
+unsigned int ZCAN_ReceiveFD(void *c, void *m, unsigned int n, int w) { return 0; }
+void *GetIProperty(void *h) { return 0; }
+unsigned int ReleaseIProperty(void *p) { return 1; }
+"""
+
+
+def build_stub(workdir):
+    src = os.path.join(workdir, "zlgcan_stub.c")
+    lib = os.path.join(workdir, "libzlgcan_stub.so")
+    with open(src, "w") as fd:
+        fd.write(STUB_SOURCE)
+    subprocess.check_call([os.environ.get("CC", "cc"), "-shared", "-fPIC", "-O2", "-o", lib, src])
+    return lib
+
+
+class LegacyZCAN(object):
+    """
+    method bodies as they were before the prototypes were declared
+    """
+    def __init__(self, lib_path):
+        self.__dll = cdll.LoadLibrary(lib_path)
+
+    def GetReceiveNum(self, chn_handle, can_type = ZCAN_TYPE_CAN):
+        return self.__dll.ZCAN_GetReceiveNum(chn_handle, can_type)
+
+    def Transmit(self, chn_handle, std_msg, len):
+        return self.__dll.ZCAN_Transmit(chn_handle, byref(std_msg), len)
+
+    def Receive(self, chn_handle, rcv_num, wait_time = c_int(-1)):
+        rcv_can_msgs = (ZCAN_Receive_Data * rcv_num)()
+        ret = self.__dll.ZCAN_Receive(chn_handle, byref(rcv_can_msgs), rcv_num, wait_time)
+        return rcv_can_msgs, ret
+
+
+class ArgtypesZCAN(object):
+    """
+    every hot call with full argtypes declared and the channel handle converted from an int on every call
+    """
+    def __init__(self, lib_path):
+        dll = cdll.LoadLibrary(lib_path)
+        self._GetReceiveNum = dll.ZCAN_GetReceiveNum
+        self._GetReceiveNum.argtypes = [c_size_t, c_ubyte]
+        self._Transmit = dll.ZCAN_Transmit
+        self._Transmit.argtypes = [c_size_t, POINTER(ZCAN_Transmit_Data), c_uint]
+        self._Receive = dll.ZCAN_Receive
+        self._Receive.argtypes = [c_size_t, POINTER(ZCAN_Receive_Data), c_uint, c_int]
+        for f in (self._GetReceiveNum, self._Transmit, self._Receive):
+            f.restype = c_uint
+
+    def GetReceiveNum(self, chn_handle, can_type = 0):
+        return self._GetReceiveNum(chn_handle, can_type)
+
+    def Transmit(self, chn_handle, std_msg, len):
+        return self._Transmit(chn_handle, std_msg, len)
+
+    def Receive(self, chn_handle, rcv_num, wait_time = -1):
+        rcv_can_msgs = (ZCAN_Receive_Data * rcv_num)()
+        ret = self._Receive(chn_handle, rcv_can_msgs, rcv_num, wait_time)
+        return rcv_can_msgs, ret
+
+
+if __name__ == "__main__":
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    workdir = tempfile.mkdtemp()
+    lib = build_stub(workdir)
+
+    legacy = LegacyZCAN(lib)
+    declared = ArgtypesZCAN(lib)
+    zcan = ZCAN(lib)
+    chn = zcan.InitCAN(zcan.OpenDevice(ZCAN_USBCANFD_200U, 0, 0), 0, ZCAN_CHANNEL_INIT_CONFIG())
+    tx_msgs = (ZCAN_Transmit_Data * 8)()
+    rx_msgs = (ZCAN_Receive_Data * 20)()
+
+    impls = (legacy, declared, zcan)
+    cases = [
+        ("GetReceiveNum",       [lambda impl=impl: impl.GetReceiveNum(chn) for impl in impls]),
+        ("Transmit x8",         [lambda impl=impl: impl.Transmit(chn, tx_msgs, 8) for impl in impls]),
+        ("Receive 20",          [lambda impl=impl: impl.Receive(chn, 20, 0) for impl in impls]),
+        ("Receive 20 prealloc", [None, None, lambda: zcan.Receive(chn, 20, 0, rx_msgs)]),
+    ]
+    print("ns/call             %10s %10s %10s" % ("legacy", "argtypes", "ZCAN"))
+    for name, calls_of_impl in cases:
+        row = [min(timeit.repeat(call, number=calls, repeat=3)) / calls * 1e9 if call else float("nan")
+               for call in calls_of_impl]
+        print("%-20s%10.0f %10.0f %10.0f" % ((name,) + tuple(row)))
@@ -0,0 +1,210 @@
+# -*- coding:utf-8 -*-
+#  can_periodic.py
+#
+#  ~~~~~~~~~~~~
+#
+#  Periodic CAN messages of one channel (TesterPresent 0x3E80, keep-alive, the vehicle state
+#  frames ECUs want before programming) served by one thread. Deadlines sit in a heap against
+#  time.monotonic, the next one is the previous deadline plus the period, so the runtime of the
+#  sends never moves the period. Messages due within the same tick go out in one Transmit call.
+#  hardware=True hands a message to the auto transmit objects of the device when it has them.
+#
+#  ~~~~~~~~~~~~
+#
+import heapq
+import itertools
+import threading
+import time
+
+from zlgcan import *
+
+PERIODIC_BATCH = 64
+# messages due within one tick of the earliest one are sent with it
+TICK_S         = 0.001
+# auto transmit objects of ZLG USBCANFD / PCIE-CANFD devices per channel
+AUTO_SEND_MAX  = 32
+
+
+class PeriodicMessage(object):
+    """
+    one periodic frame, returned by PeriodicScheduler.add(). sent counts the software sends,
+    missed the periods skipped because the host was late by more than one period
+    """
+    def __init__(self, can_id, data, period, eff=False, fd=False, brs=False):
+        self.can_id   = can_id
+        self.data     = bytes(data)
+        self.period   = period
+        self.eff      = eff
+        self.fd       = fd
+        self.brs      = brs
+        self.hw_index = None                # auto transmit object index when offloaded
+        self.sent     = 0
+        self.missed   = 0
+        self.active   = True
+
+    @property
+    def word(self):
+        return self.can_id | (0x80000000 if self.eff else 0)
+
+    def __repr__(self):
+        return "PeriodicMessage(0x%X, %s, %.3f s%s)" % (self.can_id, self.data.hex(), self.period,
+                                                        ", auto send %d" % self.hw_index if self.hw_index is not None else "")
+
+
+class PeriodicScheduler(object):
+    """
+    Sends every added PeriodicMessage from one thread until it is removed.
+    dev_handle/chn_index are needed for hardware=True, without auto transmit support
+    (virtual, SocketCAN, Linux backends) the message stays in software.
+    Taps (can_trace.TraceRecorder.on_tx) see the frames sent by the host as (msgs, num).
+    """
+    def __init__(self, zcan, chn_handle, dev_handle=None, chn_index=None):
+        self._zcan       = zcan
+        self._chn_handle = chn_handle
+        self._dev_handle = dev_handle
+        self._chn_index  = chn_index
+        self._heap       = []               # (deadline, seq, PeriodicMessage)
+        self._seq        = itertools.count()
+        self._cond       = threading.Condition()
+        self._hw_slots   = {}               # auto transmit index -> PeriodicMessage
+        self._msgs       = (ZCAN_Transmit_Data * PERIODIC_BATCH)()
+        self._fd_msgs    = (ZCAN_TransmitFD_Data * PERIODIC_BATCH)()
+        self._buf        = memoryview(self._msgs).cast('B')
+        self._fd_buf     = memoryview(self._fd_msgs).cast('B')
+        self._taps       = ()
+        self._thread     = None
+        self._terminated = False
+        self.tx_calls    = 0
+        self.tx_errors   = 0
+
+    def start(self):
+        self._terminated = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._terminated = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._hw_slots:
+            self._zcan.ClearAutoSend(self._dev_handle, self._chn_index)
+            self._hw_slots.clear()
+
+    def add_tap(self, tap):
+        self._taps = self._taps + (tap,)
+
+    def remove_tap(self, tap):
+        self._taps = tuple(t for t in self._taps if t is not tap)
+
+    def add(self, can_id, data, period, eff=False, fd=False, brs=False, hardware=False, delay=0.0):
+        """
+        send data on can_id every period seconds, the first time after delay
+        """
+        if period <= 0:
+            raise ValueError("period of 0x%X must be positive, not %r" % (can_id, period))
+        msg = PeriodicMessage(can_id, data, period, eff, fd, brs)
+        if hardware and self._offload(msg):
+            return msg
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), msg))
+            self._cond.notify()
+        return msg
+
+    def remove(self, msg):
+        msg.active = False
+        if msg.hw_index is not None:
+            self._set_auto_send(msg, enable=0)
+            self._zcan.ApplyAutoSend(self._dev_handle, self._chn_index)
+            del self._hw_slots[msg.hw_index]
+            msg.hw_index = None
+
+    def update(self, msg, data):
+        """
+        new payload from the next send on
+        """
+        msg.data = bytes(data)
+        if msg.hw_index is not None:
+            self._set_auto_send(msg)
+            self._zcan.ApplyAutoSend(self._dev_handle, self._chn_index)
+
+    @property
+    def messages(self):
+        with self._cond:
+            return [msg for _, _, msg in self._heap if msg.active] + list(self._hw_slots.values())
+
+    def _offload(self, msg):
+        if self._dev_handle is None or len(self._hw_slots) >= AUTO_SEND_MAX:
+            return False
+        msg.hw_index = min(set(range(AUTO_SEND_MAX)) - set(self._hw_slots))
+        if self._set_auto_send(msg) != ZCAN_STATUS_OK or \
+           self._zcan.ApplyAutoSend(self._dev_handle, self._chn_index) != ZCAN_STATUS_OK:
+            print("INFO: no auto transmit on this device, 0x%X is sent by the host" % msg.can_id)
+            msg.hw_index = None
+            return False
+        self._hw_slots[msg.hw_index] = msg
+        return True
+
+    def _set_auto_send(self, msg, enable=1):
+        obj = ZCANFD_AUTO_TRANSMIT_OBJ() if msg.fd else ZCAN_AUTO_TRANSMIT_OBJ()
+        obj.enable = enable
+        obj.index = msg.hw_index
+        obj.interval = max(1, int(round(msg.period * 1000)))
+        obj.obj.frame.can_id = msg.can_id
+        obj.obj.frame.eff = 1 if msg.eff else 0
+        if msg.fd:
+            obj.obj.frame.len = len(msg.data)
+            obj.obj.frame.brs = 1 if msg.brs else 0
+        else:
+            obj.obj.frame.can_dlc = len(msg.data)
+        memmove(obj.obj.frame.data, msg.data, len(msg.data))
+        return self._zcan.SetAutoSend(self._dev_handle, self._chn_index, obj)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._terminated:
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                if self._terminated:
+                    return
+                now = time.monotonic()
+                due = []
+                while self._heap and self._heap[0][0] <= now + TICK_S and len(due) < PERIODIC_BATCH:
+                    deadline, _, msg = heapq.heappop(self._heap)
+                    if not msg.active:
+                        continue
+                    due.append(msg)
+                    deadline += msg.period
+                    if deadline < now:
+                        late = int((now - deadline) / msg.period) + 1
+                        msg.missed += late
+                        deadline += late * msg.period
+                    heapq.heappush(self._heap, (deadline, next(self._seq), msg))
+            self._send(due)
+
+    def _send(self, due):
+        for fd, msgs, buf, record, transmit in ((False, self._msgs, self._buf, ZCAN_TRANSMIT_FORMAT, self._zcan.Transmit),
+                                                (True, self._fd_msgs, self._fd_buf, ZCAN_TRANSMITFD_FORMAT, self._zcan.TransmitFD)):
+            batch = [msg for msg in due if msg.fd == fd]
+            if not batch:
+                continue
+            for i, msg in enumerate(batch):
+                if fd:
+                    record.pack_into(buf, i * record.size, msg.word, len(msg.data), 1 if msg.brs else 0, msg.data, 0)
+                else:
+                    record.pack_into(buf, i * record.size, msg.word, len(msg.data), msg.data, 0)
+                msg.sent += 1
+            ret = transmit(self._chn_handle, msgs, len(batch))
+            self.tx_calls += 1
+            if ret > 0:
+                for tap in self._taps:
+                    tap(msgs, ret)
+            if ret != len(batch):
+                self.tx_errors += len(batch) - ret
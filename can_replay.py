@@ -0,0 +1,192 @@
+# -*- coding:utf-8 -*-
+#  can_replay.py
+#
+#  ~~~~~~~~~~~~
+#
+#  Replay of a can_trace recording onto an open channel, to reproduce field issues on the bench
+#  or against the virtual device. Frames are read lazily from the TraceReader and sent at their
+#  recorded offsets against one monotonic anchor, so sleep errors never add up (drift correction).
+#  Frames due within the same tick go out in one Transmit/TransmitFD call.
+#
+#  ~~~~~~~~~~~~
+#
+import array
+import random
+import threading
+import time
+
+from zlgcan import ZCAN_Transmit_Data, ZCAN_TransmitFD_Data, ZCAN_TRANSMIT_FORMAT, ZCAN_TRANSMITFD_FORMAT
+
+REPLAY_BATCH = 256
+# frames due within one tick of the first one are sent together
+TICK_S       = 0.0005
+# the last ms before a deadline is busy waited, time.sleep() overshoots by up to a ms
+SPIN_S       = 0.001
+# further behind than this (host stalled): move the anchor instead of sending the backlog in a burst
+MAX_LAG_S    = 0.05
+# jitter samples kept for the percentiles, a loop replay keeps a uniform sample of its frames
+JITTER_SAMPLES = 65536
+
+
+class ReplayStats(object):
+    """
+    jitter is the send time minus the scheduled time of a frame, in seconds. The mean and the max
+    cover every frame, jitter holds at most samples of them (reservoir sampling) for the percentiles
+    """
+    def __init__(self, samples=JITTER_SAMPLES):
+        self.frames       = 0
+        self.batches      = 0
+        self.tx_errors    = 0
+        self.resyncs      = 0
+        self.elapsed      = 0.0
+        self.jitter       = array.array('d')
+        self.jitter_count = 0
+        self.jitter_sum   = 0.0             # of the absolute values
+        self.jitter_max   = 0.0
+        self._samples     = samples
+        self._random      = random.Random()
+
+    def add_jitter(self, values):
+        for j in values:
+            self.jitter_count += 1
+            self.jitter_sum += abs(j)
+            self.jitter_max = max(self.jitter_max, abs(j))
+            if len(self.jitter) < self._samples:
+                self.jitter.append(j)
+            else:
+                i = self._random.randrange(self.jitter_count)
+                if i < self._samples:
+                    self.jitter[i] = j
+
+    def percentile(self, p):
+        if not self.jitter:
+            return 0.0
+        if p >= 100:
+            return self.jitter_max
+        values = sorted(abs(j) for j in self.jitter)
+        return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+    def lines(self):
+        yield "replayed %d frame(s) in %d Transmit call(s), %.2f s, %d send error(s), %d resync(s)" % (
+            self.frames, self.batches, self.elapsed, self.tx_errors, self.resyncs)
+        if self.jitter_count:
+            yield "jitter  mean %.3f ms  p99 %.3f ms  max %.3f ms" % (
+                self.jitter_sum / self.jitter_count * 1e3, self.percentile(99) * 1e3, self.jitter_max * 1e3)
+
+
+class TraceReplay(object):
+    """
+    Sends the frames of a can_trace.TraceReader on chn_handle from a thread.
+    start/end: seconds from the earliest frame of the trace, speed: 2.0 replays twice as fast,
+    rx/tx: replay the frames recorded as received / as sent, ids: only these arbitration ids.
+    Error frames are not replayed.
+    """
+    def __init__(self, zcan, chn_handle, reader, start=None, end=None, speed=1.0, loop=False, rx=True, tx=True, ids=None):
+        self._zcan       = zcan
+        self._chn_handle = chn_handle
+        self.reader      = reader
+        self.start_s     = start
+        self.end_s       = end
+        self.speed       = speed
+        self.loop        = loop
+        self.rx          = rx
+        self.tx          = tx
+        self.ids         = set(ids) if ids is not None else None
+        self.stats       = ReplayStats()
+        self._msgs       = (ZCAN_Transmit_Data * REPLAY_BATCH)()
+        self._fd_msgs    = (ZCAN_TransmitFD_Data * REPLAY_BATCH)()
+        self._buf        = memoryview(self._msgs).cast('B')
+        self._fd_buf     = memoryview(self._fd_msgs).cast('B')
+        self._thread     = None
+        self._terminated = False
+        self.done        = threading.Event()
+
+    def start(self):
+        self._terminated = False
+        self.done.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._terminated = True
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+    def _frames(self):
+        for f in self.reader.frames(self.start_s, self.end_s):
+            if f.err or (f.tx and not self.tx) or (not f.tx and not self.rx):
+                continue
+            if self.ids is not None and f.can_id not in self.ids:
+                continue
+            yield f
+
+    def _run(self):
+        t_start = time.perf_counter()
+        try:
+            while not self._terminated:
+                self._replay_once()
+                if not self.loop:
+                    break
+        finally:
+            self.stats.elapsed = time.perf_counter() - t_start
+            self.done.set()
+
+    def _replay_once(self):
+        frames = self._frames()
+        f = next(frames, None)
+        if f is None:
+            return
+        ts0 = f.timestamp
+        anchor = time.perf_counter()
+        scale = 1e-6 / self.speed
+        while f is not None and not self._terminated:
+            due = anchor + (f.timestamp - ts0) * scale
+            now = self._wait_until(due)
+            if now - due > MAX_LAG_S:
+                anchor += now - due
+                self.stats.resyncs += 1
+                due = now
+            batch, fd_batch = [], []
+            horizon = now + TICK_S
+            while f is not None and len(batch) < REPLAY_BATCH and len(fd_batch) < REPLAY_BATCH:
+                f_due = anchor + (f.timestamp - ts0) * scale
+                if f_due > horizon:
+                    break
+                (fd_batch if f.fd else batch).append((f, f_due))
+                f = next(frames, None)
+            self._send(batch, fd_batch)
+
+    def _wait_until(self, due):
+        while True:
+            now = time.perf_counter()
+            if now >= due or self._terminated:
+                return now
+            if due - now > SPIN_S:
+                time.sleep(due - now - SPIN_S)
+
+    def _send(self, batch, fd_batch):
+        for frames, msgs, buf, record, transmit in ((batch, self._msgs, self._buf, ZCAN_TRANSMIT_FORMAT, self._zcan.Transmit),
+                                                    (fd_batch, self._fd_msgs, self._fd_buf, ZCAN_TRANSMITFD_FORMAT, self._zcan.TransmitFD)):
+            if not frames:
+                continue
+            for i, (f, _) in enumerate(frames):
+                word = f.can_id | (0x40000000 if f.rtr else 0) | (0x80000000 if f.eff else 0)
+                if record is ZCAN_TRANSMITFD_FORMAT:
+                    record.pack_into(buf, i * record.size, word, len(f.data), (1 if f.brs else 0) | (2 if f.esi else 0), f.data, 0)
+                else:
+                    record.pack_into(buf, i * record.size, word, len(f.data), f.data, 0)
+            ret = transmit(self._chn_handle, msgs, len(frames))
+            sent = time.perf_counter()
+            # 0xFFFFFFFF (-1 as c_uint) on a driver error
+            if ret < 0 or ret > len(frames):
+                ret = 0
+            self.stats.batches += 1
+            self.stats.frames += ret
+            self.stats.tx_errors += len(frames) - ret
+            self.stats.add_jitter(sent - due for _, due in frames)
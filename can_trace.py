@@ -0,0 +1,433 @@
+# -*- coding:utf-8 -*-
+#  can_trace.py
+#
+#  ~~~~~~~~~~~~
+#
+#  Bus trace of an open channel: a TraceRecorder taps the ZCANDispatcher (received frames) and
+#  the ZCANTxRing(s) (sent frames) and appends them to a compact binary trace from its own
+#  writer thread, so disk writes never hold up the receive thread. TraceReader maps a trace
+#  and answers time range queries through a block index; to_asc()/to_blf() convert a trace
+#  for CANalyzer/CANoe and python-can.
+#
+#  layout, little endian:
+#    header   "CCTR" version:u16 flags:u16 record_size:u32 start_time:f64 (unix time), 12 reserved bytes
+#    records  ZCAN_Receive_Data (24 bytes) or ZCAN_ReceiveFD_Data (80 bytes) as the driver fills
+#             them, byte 6 holds the trace flags (TX, FD), timestamp in us of the device clock
+#    <trace>.idx  one entry per block of records: first_record:u64 count:u64 min_ts:u64 max_ts:u64
+#
+#  usage: python can_trace.py dump trace.cctr [--start s] [--end s]
+#         python can_trace.py asc trace.cctr trace.asc
+#         python can_trace.py blf trace.cctr trace.blf
+#
+#  ~~~~~~~~~~~~
+#
+import argparse
+import collections
+import datetime
+import mmap
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import zlib
+
+from zlgcan import (ZCAN_Receive_Data, ZCAN_ReceiveFD_Data, ZCAN_Transmit_Data, ZCAN_TransmitFD_Data,
+                    ZCAN_TRANSMIT_FORMAT, ZCAN_TRANSMITFD_FORMAT)
+
+TRACE_MAGIC     = b"CCTR"
+TRACE_VERSION   = 1
+TRACE_EXT       = ".cctr"
+INDEX_EXT       = ".idx"
+HEADER_FORMAT   = "<4sHHId12x"
+HEADER_SIZE     = struct.calcsize(HEADER_FORMAT)
+INDEX_FORMAT    = struct.Struct("<QQQQ")
+# records per index entry
+INDEX_BLOCK     = 4096
+WRITE_BUFFER    = 1 << 20
+
+TRACE_FLAG_FD   = 0x0001            # header flags: records are ZCAN_ReceiveFD_Data
+
+FRAME_TX        = 0x01              # record byte 6
+FRAME_FD        = 0x02
+FLAGS_OFFSET    = 6
+
+CAN_RECORD      = struct.Struct("<IBxBx8sQ")        # word, dlc, flags, data, timestamp
+CANFD_RECORD    = struct.Struct("<IBBBx64sQ")       # word, len, brs|esi, flags, data, timestamp
+assert CAN_RECORD.size == 24 and CANFD_RECORD.size == 80
+# bytes per element of the tapped driver arrays
+_MSG_SIZE       = {ZCAN_Receive_Data: CAN_RECORD.size, ZCAN_ReceiveFD_Data: CANFD_RECORD.size,
+                   ZCAN_Transmit_Data: ZCAN_TRANSMIT_FORMAT.size, ZCAN_TransmitFD_Data: ZCAN_TRANSMITFD_FORMAT.size}
+
+CAN_ID_MASK     = 0x1FFFFFFF
+
+TraceFrame = collections.namedtuple("TraceFrame", "timestamp can_id eff rtr err tx fd brs esi data")
+
+
+def _timestamp_us():
+    return int(time.monotonic() * 1000000)
+
+
+###############################################################################
+class TraceRecorder(object):
+    """
+    Appends the frames of on_rx(msgs, num) / on_tx(msgs, num) to path. The taps copy the filled
+    part of the driver array and return, the writer thread sets the flags byte, keeps the block
+    index and writes through a 1 MB buffer. Nothing is dropped: the queue is not bounded.
+    fd: records are ZCAN_ReceiveFD_Data, classic frames are widened to it.
+    Sent frames get a timestamp from the host clock, moved onto the device clock of the last receive.
+    """
+    def __init__(self, path, fd=False):
+        self.path        = path
+        self.fd          = fd
+        self.record      = CANFD_RECORD if fd else CAN_RECORD
+        self.frames      = 0
+        self.dropped     = 0
+        self._queue      = queue.Queue()
+        self._clock      = 0                # device us - host us
+        self._block      = [0, None, None]  # records, min_ts, max_ts of the open index block
+        self._fd         = open(path, "wb", buffering=WRITE_BUFFER)
+        self._fd.write(struct.pack(HEADER_FORMAT, TRACE_MAGIC, TRACE_VERSION, TRACE_FLAG_FD if fd else 0,
+                                   self.record.size, time.time()))
+        self._index      = open(path + INDEX_EXT, "wb")
+        self._thread     = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def attach(self, dispatcher, tx_rings=()):
+        dispatcher.add_tap(self.on_rx)
+        for ring in tx_rings:
+            ring.add_tap(self.on_tx)
+        return self
+
+    def detach(self, dispatcher, tx_rings=()):
+        dispatcher.remove_tap(self.on_rx)
+        for ring in tx_rings:
+            ring.remove_tap(self.on_tx)
+
+    def on_rx(self, msgs, num):
+        self._queue.put((msgs._type_, bytes(memoryview(msgs).cast('B')[:num * _MSG_SIZE[msgs._type_]])))
+        self._clock = msgs[num - 1].timestamp - _timestamp_us()
+
+    def on_tx(self, msgs, num):
+        self._queue.put((msgs._type_, bytes(memoryview(msgs).cast('B')[:num * _MSG_SIZE[msgs._type_]]),
+                         _timestamp_us() + self._clock))
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if self._block[0]:
+            self._write_index()
+        self._fd.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                records = self._records(*item)
+            except ValueError as e:
+                self.dropped += 1
+                print("ERROR: trace %s, %s" % (self.path, e))
+                continue
+            if records:
+                self._fd.write(records)
+                self._add_to_index(records)
+
+    def _records(self, msg_type, raw, tx_ts=None):
+        """
+        trace records of one tapped batch
+        """
+        if msg_type is ZCAN_Receive_Data:
+            if self.fd:
+                return b"".join(CANFD_RECORD.pack(word, dlc, 0, 0, data, ts)
+                                for word, dlc, _, data, ts in CAN_RECORD.iter_unpack(raw))
+            records = bytearray(raw)
+            n = len(records) // CAN_RECORD.size
+            records[5::CAN_RECORD.size] = bytes(n)
+            records[FLAGS_OFFSET::CAN_RECORD.size] = bytes(n)
+            records[7::CAN_RECORD.size] = bytes(n)
+            return records
+        if msg_type is ZCAN_ReceiveFD_Data:
+            if not self.fd:
+                raise ValueError("CAN FD frames in a classic CAN trace")
+            records = bytearray(raw)
+            n = len(records) // CANFD_RECORD.size
+            records[FLAGS_OFFSET::CANFD_RECORD.size] = bytes((FRAME_FD,)) * n
+            records[7::CANFD_RECORD.size] = bytes(n)
+            return records
+        if msg_type is ZCAN_Transmit_Data:
+            if self.fd:
+                return b"".join(CANFD_RECORD.pack(word, dlc, 0, FRAME_TX, data, tx_ts)
+                                for word, dlc, data, _ in ZCAN_TRANSMIT_FORMAT.iter_unpack(raw))
+            return b"".join(CAN_RECORD.pack(word, dlc, FRAME_TX, data, tx_ts) for word, dlc, data, _ in ZCAN_TRANSMIT_FORMAT.iter_unpack(raw))
+        if msg_type is ZCAN_TransmitFD_Data:
+            if not self.fd:
+                raise ValueError("CAN FD frames in a classic CAN trace")
+            return b"".join(CANFD_RECORD.pack(word, size, flags, FRAME_TX | FRAME_FD, data, tx_ts)
+                            for word, size, flags, data, _ in ZCAN_TRANSMITFD_FORMAT.iter_unpack(raw))
+        raise ValueError("cannot trace %r" % (msg_type,))
+
+    def _add_to_index(self, records):
+        words = self.record.size // 8
+        stamps = memoryview(records).cast('B').cast('Q')[words - 1::words]
+        block = self._block
+        lo, hi = min(stamps), max(stamps)
+        block[0] += len(stamps)
+        block[1] = lo if block[1] is None else min(block[1], lo)
+        block[2] = hi if block[2] is None else max(block[2], hi)
+        if block[0] >= INDEX_BLOCK:
+            self._write_index()
+
+    def _write_index(self):
+        count, lo, hi = self._block
+        self._index.write(INDEX_FORMAT.pack(self.frames, count, lo, hi))
+        self.frames += count
+        self._block = [0, None, None]
+
+
+###############################################################################
+class TraceReader(object):
+    """
+    mapped trace. frames(start, end) yields the TraceFrame(s) between start and end seconds
+    from the earliest frame, only the index blocks overlapping the range are decoded.
+    A missing or short index (trace not closed) is completed by scanning the records it lacks.
+    start_ts is the lowest timestamp of the index: a sent frame (host clock) may be recorded
+    before a received one with an earlier device timestamp.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as fd:
+            header = fd.read(HEADER_SIZE)
+            if len(header) < HEADER_SIZE:
+                raise ValueError("%s: truncated trace header" % path)
+            magic, version, flags, record_size, self.start_time = struct.unpack(HEADER_FORMAT, header)
+            if magic != TRACE_MAGIC or version != TRACE_VERSION:
+                raise ValueError("%s: not a version %d CAN trace" % (path, TRACE_VERSION))
+            self.fd = bool(flags & TRACE_FLAG_FD)
+            self.record = CANFD_RECORD if self.fd else CAN_RECORD
+            if record_size != self.record.size:
+                raise ValueError("%s: record size %d" % (path, record_size))
+            self.count = (os.fstat(fd.fileno()).st_size - HEADER_SIZE) // record_size
+            self._mmap = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) if self.count else None
+        self.blocks = self._load_index()
+        self.start_ts = min(b[2] for b in self.blocks) if self.blocks else 0
+
+    def _load_index(self):
+        blocks = []
+        try:
+            with open(self.path + INDEX_EXT, "rb") as fd:
+                blocks = [entry for entry in INDEX_FORMAT.iter_unpack(fd.read(os.fstat(fd.fileno()).st_size // INDEX_FORMAT.size * INDEX_FORMAT.size))]
+        except OSError:
+            pass
+        blocks = [b for b in blocks if b[0] + b[1] <= self.count]
+        covered = blocks[-1][0] + blocks[-1][1] if blocks else 0
+        for first in range(covered, self.count, INDEX_BLOCK):
+            stamps = [self._timestamp(i) for i in range(first, min(first + INDEX_BLOCK, self.count))]
+            blocks.append((first, len(stamps), min(stamps), max(stamps)))
+        return blocks
+
+    def _timestamp(self, i):
+        return struct.unpack_from("<Q", self._mmap, HEADER_SIZE + (i + 1) * self.record.size - 8)[0]
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def duration(self):
+        return (max(b[3] for b in self.blocks) - self.start_ts) / 1e6 if self.blocks else 0.0
+
+    def frames(self, start=None, end=None):
+        lo = self.start_ts + int(start * 1e6) if start is not None else 0
+        hi = self.start_ts + int(end * 1e6) if end is not None else 1 << 64
+        unpack = self.record.unpack_from
+        for first, count, min_ts, max_ts in self.blocks:
+            if max_ts < lo or min_ts > hi:
+                continue
+            for i in range(first, first + count):
+                fields = unpack(self._mmap, HEADER_SIZE + i * self.record.size)
+                if lo <= fields[-1] <= hi:
+                    yield self._frame(fields)
+
+    def _frame(self, fields):
+        if self.fd:
+            word, size, fd_flags, flags, data, ts = fields
+        else:
+            word, size, flags, data, ts = fields
+            fd_flags = 0
+        return TraceFrame(ts, word & CAN_ID_MASK, bool(word >> 31), bool(word >> 30 & 1), bool(word >> 29 & 1),
+                          bool(flags & FRAME_TX), bool(flags & FRAME_FD), bool(fd_flags & 1), bool(fd_flags & 2),
+                          data[:size])
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+###############################################################################
+### Vector ASC / BLF export
+###############################################################################
+FD_LEN_TO_DLC = dict([(n, n) for n in range(9)] + [(12, 9), (16, 10), (20, 11), (24, 12), (32, 13), (48, 14), (64, 15)])
+
+
+def _fd_dlc(size):
+    return FD_LEN_TO_DLC.get(size) or next(dlc for n, dlc in sorted(FD_LEN_TO_DLC.items()) if n >= size)
+
+
+def _asc_date(t):
+    d = datetime.datetime.fromtimestamp(t)
+    return "%s.%03d %s %d" % (d.strftime("%a %b %d %I:%M:%S"), d.microsecond // 1000, d.strftime("%p").lower(), d.year)
+
+
+def to_asc(reader, out_path, channel=1, start=None, end=None):
+    """
+    write the frames of reader as Vector ASC, times in seconds from the earliest frame
+    """
+    with open(out_path, "w") as out:
+        date = _asc_date(reader.start_time)
+        out.write("date %s\nbase hex  timestamps absolute\ninternal events logged\n// version 9.0.0\n" % date)
+        out.write("Begin Triggerblock %s\n%9.6f Start of measurement\n" % (date, 0.0))
+        for f in reader.frames(start, end):
+            t = (f.timestamp - reader.start_ts) / 1e6
+            can_id = "%X%s" % (f.can_id, "x" if f.eff else "")
+            direction = "Tx" if f.tx else "Rx"
+            if f.err:
+                out.write("%9.6f %d  ErrorFrame\n" % (t, channel))
+            elif f.fd:
+                out.write("%9.6f CANFD %3d %-4s %8s %32s %d %d %x %2d %s %8d %4d %8X %8d %8d %8d %8d %8d\n" % (
+                    t, channel, direction, can_id, "", f.brs, f.esi, _fd_dlc(len(f.data)), len(f.data),
+                    " ".join("%02X" % b for b in f.data), 0, 0, 0x1000, 0, 0, 0, 0, 0))
+            elif f.rtr:
+                out.write("%9.6f %d  %-15s %-4s r\n" % (t, channel, can_id, direction))
+            else:
+                out.write("%9.6f %d  %-15s %-4s d %x %s\n" % (
+                    t, channel, can_id, direction, len(f.data), " ".join("%02X" % b for b in f.data)))
+        out.write("End TriggerBlock\n")
+
+
+BLF_FILE_HEADER      = struct.Struct("<4sLBBBBBBBBQQLL8H8H")
+BLF_FILE_HEADER_SIZE = 144
+BLF_OBJ_HEADER       = struct.Struct("<4sHHLL")
+BLF_OBJ_HEADER_V1    = struct.Struct("<LHHQ")
+BLF_LOG_CONTAINER    = struct.Struct("<H6xL4x")
+BLF_CAN_MSG          = struct.Struct("<HBBL8s")
+BLF_CAN_FD_MSG       = struct.Struct("<HBBLLBBB5x64s")
+BLF_CAN_MESSAGE      = 1
+BLF_LOG_CONTAINER_T  = 10
+BLF_CAN_FD_MESSAGE   = 100
+BLF_TIME_ONE_NANS    = 0x00000002
+BLF_ZLIB_DEFLATE     = 2
+BLF_CONTAINER_SIZE   = 128 * 1024
+BLF_CAN_EXT          = 0x80000000
+BLF_DIR_TX           = 0x01
+BLF_REMOTE           = 0x80
+BLF_FD_EDL, BLF_FD_BRS, BLF_FD_ESI = 0x01, 0x02, 0x04
+
+
+def _systemtime(t):
+    d = datetime.datetime.fromtimestamp(t)
+    return (d.year, d.month, d.isoweekday() % 7, d.day, d.hour, d.minute, d.second, d.microsecond // 1000)
+
+
+def to_blf(reader, out_path, channel=1, start=None, end=None):
+    """
+    write the frames of reader as Vector BLF in zlib compressed log containers.
+    Error frames have no BLF object here, they are left out
+    """
+    objects = [0]
+    uncompressed = [BLF_FILE_HEADER_SIZE]
+    last_ts = [reader.start_ts]
+    buf = bytearray()
+
+    def flush(out, final=False):
+        while len(buf) >= BLF_CONTAINER_SIZE or (final and buf):
+            data = bytes(buf[:BLF_CONTAINER_SIZE])
+            del buf[:BLF_CONTAINER_SIZE]
+            packed = zlib.compress(data, 6)
+            size = BLF_OBJ_HEADER.size + BLF_LOG_CONTAINER.size + len(packed)
+            out.write(BLF_OBJ_HEADER.pack(b"LOBJ", BLF_OBJ_HEADER.size, 1, size, BLF_LOG_CONTAINER_T))
+            out.write(BLF_LOG_CONTAINER.pack(BLF_ZLIB_DEFLATE, len(data)))
+            out.write(packed)
+            out.write(b"\0" * (size % 4))
+            uncompressed[0] += BLF_OBJ_HEADER.size + BLF_LOG_CONTAINER.size + len(data)
+
+    with open(out_path, "wb") as out:
+        out.write(b"\0" * BLF_FILE_HEADER_SIZE)
+        for f in reader.frames(start, end):
+            if f.err:
+                continue
+            arbitration_id = f.can_id | (BLF_CAN_EXT if f.eff else 0)
+            flags = (BLF_DIR_TX if f.tx else 0) | (BLF_REMOTE if f.rtr else 0)
+            if f.fd:
+                fd_flags = BLF_FD_EDL | (BLF_FD_BRS if f.brs else 0) | (BLF_FD_ESI if f.esi else 0)
+                obj_type, data = BLF_CAN_FD_MESSAGE, BLF_CAN_FD_MSG.pack(channel, flags, _fd_dlc(len(f.data)), arbitration_id,
+                                                                         0, 0, fd_flags, len(f.data), f.data)
+            else:
+                obj_type, data = BLF_CAN_MESSAGE, BLF_CAN_MSG.pack(channel, flags, len(f.data), arbitration_id, f.data)
+            header_size = BLF_OBJ_HEADER.size + BLF_OBJ_HEADER_V1.size
+            buf += BLF_OBJ_HEADER.pack(b"LOBJ", header_size, 1, header_size + len(data), obj_type)
+            buf += BLF_OBJ_HEADER_V1.pack(BLF_TIME_ONE_NANS, 0, 0, max(f.timestamp - reader.start_ts, 0) * 1000)
+            buf += data
+            buf += b"\0" * (len(data) % 4)
+            objects[0] += 1
+            last_ts[0] = max(last_ts[0], f.timestamp)
+            if len(buf) >= BLF_CONTAINER_SIZE:
+                flush(out)
+        flush(out, True)
+        file_size = out.tell()
+        out.seek(0)
+        stop_time = reader.start_time + (last_ts[0] - reader.start_ts) / 1e6
+        out.write(BLF_FILE_HEADER.pack(b"LOGG", BLF_FILE_HEADER_SIZE, 5, 0, 0, 0, 2, 6, 8, 1,
+                                       file_size, uncompressed[0], objects[0], 0,
+                                       *(_systemtime(reader.start_time) + _systemtime(stop_time))))
+    return objects[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="inspect or convert a CAN trace")
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+    for name in ("dump", "asc", "blf"):
+        p = sub.add_parser(name)
+        p.add_argument("trace")
+        if name != "dump":
+            p.add_argument("out")
+        p.add_argument("--start", type=float, default=None, help="seconds from the earliest frame")
+        p.add_argument("--end", type=float, default=None, help="seconds from the earliest frame")
+        p.add_argument("--channel", type=int, default=1, help="channel number written to ASC/BLF")
+    args = parser.parse_args(argv)
+    with TraceReader(args.trace) as reader:
+        if args.command == "asc":
+            to_asc(reader, args.out, args.channel, args.start, args.end)
+        elif args.command == "blf":
+            to_blf(reader, args.out, args.channel, args.start, args.end)
+        else:
+            print("%s: %d frame(s), %.3f s, %s" % (args.trace, len(reader), reader.duration, "CAN FD" if reader.fd else "CAN"))
+            for f in reader.frames(args.start, args.end):
+                print("%12.6f %s %9s%s %2d  %s" % ((f.timestamp - reader.start_ts) / 1e6, "Tx" if f.tx else "Rx",
+                                                  "%X" % f.can_id, "x" if f.eff else " ", len(f.data),
+                                                  " ".join("%02X" % b for b in f.data)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
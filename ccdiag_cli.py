@@ -0,0 +1,186 @@
+# -*- coding:utf-8 -*-
+#  ccdiag_cli.py
+#
+#  ~~~~~~~~~~~~
+#
+#  Command line front end of CCDiagEngine, no tkinter needed
+#
+#  usage: python ccdiag_cli.py [--device USBCANFD-200U] [--channel 0] [--baudrate 500K] <command> ...
+#         python ccdiag_cli.py --device ZCAN-VIRTUAL read-dtc        (simulated ECUs)
+#
+#  ~~~~~~~~~~~~
+#
+import argparse
+import sys
+
+from flash_timing import TransferTiming
+from ccdiag_engine import CCDiagEngine, CCDiagError
+
+
+def cmd_info(engine, args):
+    info = engine.device_info()
+    if info is not None:
+        print(info)
+
+def cmd_read_dtc(engine, args):
+    dtcs = engine.read_dtc(args.mask).result()
+    for dtc in dtcs:
+        print("%06X  %02X  %s" % (dtc.id, dtc.status.get_byte_as_int(), engine.describe_dtc(dtc.id)))
+    print("%d DTC(s)" % len(dtcs))
+
+def cmd_clear_dtc(engine, args):
+    print("clear DTC: %s" % ("ok" if engine.clear_dtc().result() else "failed"))
+
+def cmd_read_sw(engine, args):
+    print("sw version: %s" % (engine.read_sw_version().result(),))
+
+def print_dids(engine, result):
+    for did, value in result.values.items():
+        definition = engine.did_registry[did]
+        print("%04X  %-32s %s" % (did, definition.name, definition.text(value)))
+    for did in result.unsupported:
+        print("%04X  %-32s not supported" % (did, engine.did_registry[did].name))
+    print("%d DID(s) in %d request(s)" % (len(result.values), result.requests))
+
+def cmd_read_ident(engine, args):
+    print_dids(engine, engine.read_identification().result())
+
+def cmd_read_did(engine, args):
+    print_dids(engine, engine.read_dids(args.dids).result())
+
+def cmd_reset(engine, args):
+    engine.reset_ecu().result()
+
+def cmd_flash(engine, args):
+    timing = TransferTiming() if args.timing else None
+    report = engine.flash(args.sw, args.boot, pipeline=args.pipeline, timing=timing, resume=not args.no_resume,
+                          delta=args.delta).result()
+    if args.report:
+        report.dump(args.report)
+    if not report.ok:
+        raise CCDiagError("flash failed in %s" % report.error)
+    print("INFO: UDS Client Flash success!")
+    for line in report.lines():
+        print(line)
+    if timing is not None:
+        for line in timing.lines():
+            print(line)
+
+def cmd_replay(engine, args):
+    replay = engine.replay_trace(args.recording, start=args.start, end=args.end, speed=args.speed, loop=args.loop,
+                                 rx=not args.tx_only, tx=not args.rx_only)
+    try:
+        while not replay.wait(0.5):
+            pass
+    except KeyboardInterrupt:
+        pass
+    engine.stop_replay()
+    for line in replay.stats.lines():
+        print(line)
+
+def cmd_tune_isotp(engine, args):
+    if args.forget:
+        engine.forget_tuning(args.target)
+        print("INFO: tuned flow control of %s dropped" % args.target)
+        return
+    result = engine.tune_isotp(args.rounds).result()
+    for line in result.lines():
+        print(line)
+
+def cmd_diag_test(engine, args):
+    for line in engine.auto_diag_test().result():
+        sys.stdout.write(line)
+
+COMMANDS = {
+    "info"      : cmd_info,
+    "read-dtc"  : cmd_read_dtc,
+    "clear-dtc" : cmd_clear_dtc,
+    "read-sw"   : cmd_read_sw,
+    "read-ident": cmd_read_ident,
+    "read-did"  : cmd_read_did,
+    "reset"     : cmd_reset,
+    "flash"     : cmd_flash,
+    "diag-test" : cmd_diag_test,
+    "replay"    : cmd_replay,
+    "tune-isotp": cmd_tune_isotp,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="CCDiag command line")
+    parser.add_argument("--device", default="USBCANFD-200U", help="device name of dev_info.json, ZCAN-VIRTUAL for simulated ECUs")
+    parser.add_argument("--index", type=int, default=0, help="device index")
+    parser.add_argument("--channel", type=int, default=0, help="CAN channel")
+    parser.add_argument("--baudrate", default="500K")
+    parser.add_argument("--data-baudrate", default=None)
+    parser.add_argument("--listen-only", action="store_true")
+    parser.add_argument("--no-resistance", action="store_true")
+    parser.add_argument("--backend", default=None, help="dll, linux, socketcan or virtual, see zlgcan.open_backend")
+    parser.add_argument("--target", default="ESC", choices=sorted(CCDiagEngine.ADDRESSES))
+    parser.add_argument("--tester-present", type=float, default=None, metavar="SECONDS",
+                        help="send functional TesterPresent 3E 80 with this period during the command")
+    parser.add_argument("--trace", default=None, help="record the bus traffic of the command to this file, see can_trace.py")
+    parser.add_argument("--fd", action="append", default=[], metavar="TARGET", choices=sorted(CCDiagEngine.ADDRESSES),
+                        help="ISO-TP over CAN FD to this ECU on an FD channel, can be repeated")
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+    sub.add_parser("info")
+    p = sub.add_parser("read-dtc")
+    p.add_argument("--mask", type=lambda v: int(v, 0), default=9)
+    sub.add_parser("clear-dtc")
+    sub.add_parser("read-sw")
+    sub.add_parser("read-ident", help="identification DIDs of DIDList.json")
+    p = sub.add_parser("read-did")
+    p.add_argument("dids", nargs="+", type=lambda v: int(v, 16), help="DIDs of DIDList.json, hex")
+    sub.add_parser("reset")
+    p = sub.add_parser("flash")
+    p.add_argument("--sw", required=True, help="application .s19")
+    p.add_argument("--boot", required=True, help="flash driver .s19")
+    p.add_argument("--pipeline", action="store_true", help="encode the next TransferData requests while one is in flight")
+    p.add_argument("--timing", action="store_true", help="print the host-prep / bus / ECU-wait split of the blocks")
+    p.add_argument("--delta", action="store_true", help="skip the application segments unchanged since the last delta flash of this ECU")
+    p.add_argument("--no-resume", action="store_true", help="ignore the journal of a failed flash, start over")
+    p.add_argument("--report", default=None, help="write the per-phase timing report as JSON to this file")
+    sub.add_parser("diag-test")
+    p = sub.add_parser("tune-isotp", help="find the smallest STmin / largest blocksize the target answers reliably")
+    p.add_argument("--rounds", type=int, default=3, help="probe reads per step")
+    p.add_argument("--forget", action="store_true", help="drop the cached result, back to the configured flow control")
+    p = sub.add_parser("replay")
+    p.add_argument("recording", help="trace recorded with --trace, see can_trace.py")
+    p.add_argument("--start", type=float, default=None, help="seconds from the earliest frame")
+    p.add_argument("--end", type=float, default=None, help="seconds from the earliest frame")
+    p.add_argument("--speed", type=float, default=1.0)
+    p.add_argument("--loop", action="store_true", help="start over at the end, until Ctrl-C")
+    p.add_argument("--rx-only", action="store_true", help="only the frames recorded as received")
+    p.add_argument("--tx-only", action="store_true", help="only the frames recorded as sent")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    engine = CCDiagEngine(backend=args.backend)
+    try:
+        engine.open_device(args.device, args.index)
+        for name in args.fd:
+            engine.set_canfd(name)
+        engine.open_channel(args.channel, mode=1 if args.listen_only else 0, baudrate=args.baudrate,
+                            data_baudrate=args.data_baudrate, resistance=not args.no_resistance)
+        engine.set_target(args.target)
+        if args.trace:
+            engine.start_trace(args.trace)
+        if args.tester_present:
+            engine.tester_present(args.tester_present)
+        COMMANDS[args.command](engine, args)
+    except CCDiagError as e:
+        print("ERROR: %s" % e)
+        return 1
+    except Exception as e:
+        print("ERROR: %s failed: %r" % (args.command, e))
+        return 1
+    finally:
+        engine.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
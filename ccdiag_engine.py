@@ -0,0 +1,1041 @@
+# -*- coding:utf-8 -*-
+#  ccdiag_engine.py
+#
+#  ~~~~~~~~~~~~
+#
+#  CCDiag diagnostic core without GUI: device/channel management, ISO-TP connection,
+#  UDS client, security algorithm, flashing and DTC decoding.
+#  Every ECU operation runs on the engine worker thread and returns a concurrent.futures.Future.
+#
+#  ~~~~~~~~~~~~
+#
+import contextlib
+import datetime
+import json
+import queue
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from zlgcan import *
+import can_periodic
+import can_replay
+import can_trace
+import flash_delta
+import flash_journal
+import flash_package
+import did_registry
+import isotp_tune
+from flash_timing import FlashTimingReport, phase
+import ecu_sim
+from zcan_isotp import ZCANDispatcher, ZCANRxQueue, ZCANTxRing
+from uds_asyncio import AsyncZCANChannel, AsyncUdsClient
+from uds_session import SessionClient, EXTENDED_SESSION, S3_SERVER_S
+
+from udsoncan.configs import default_client_config
+from udsoncan.exceptions import TimeoutException
+import udsoncan
+from udsoncan.connections import BaseConnection
+from udsoncan import services, Response, MemoryLocation
+
+import isotp
+from isotp import CanMessage
+
+USBCANFD_TYPE    = (41, 42, 43)
+USBCAN_XE_U_TYPE = (20, 21, 31, 34)
+PCIE_CANFD_TYPE  = (38, 39, 40)
+USBCAN_I_II_TYPE = (3, 4)
+
+ESC_TX_ID = 0x73E
+ESC_RX_ID_PHYS = 0x736
+ESC_RX_ID_FUNC = 0x7DF
+
+EPS_TX_ID = 0x73D
+EPS_RX_ID_PHYS = 0x735
+
+EPS4wd_TX_ID = 0x7BD
+EPS4wd_RX_ID_PHYS = 0x7B5
+
+# DTCList.json is written by extract_DTCList_to_json.py with the Chinese Windows default encoding
+DTC_LIST_ENCODING = "gbk"
+
+SECURITY_ALGO_PARAMS = [0x4FE87269, 0x6BC361D8, 0x9B127D51, 0x5BA41903]
+
+# TesterPresent period started by the first extended session request, well inside S3 (5 s)
+KEEPALIVE_PERIOD = 2.0
+
+ISOTP_PARAMS = {
+    'stmin' : 32,                          # Will request the sender to wait 32ms between consecutive frame. 0-127ms or 100-900ns with values from 0xF1-0xF9
+    'blocksize' : 8,                       # Request the sender to send 8 consecutives frames before sending a new flow control message
+    'wftmax' : 0,                          # Number of wait frame allowed before triggering an error
+    'tx_data_length' : 8,                  # Link layer (CAN layer) works with 8 byte payload (CAN 2.0)
+    'tx_padding' : 0,                      # Will pad all transmitted CAN messages with byte 0x00. None means no padding
+    'rx_flowcontrol_timeout' : 1000,        # Triggers a timeout if a flow control is awaited for more than 1000 milliseconds
+    'rx_consecutive_frame_timeout' : 1000,  # Triggers a timeout if a consecutive frame is awaited for more than 1000 milliseconds
+    'squash_stmin_requirement' : False     # When sending, respect the stmin requirement of the receiver. If set to True, go as fast as possible.
+    }
+
+
+class CCDiagError(Exception):
+    """
+    device, channel or ECU operation failed
+    """
+    pass
+
+
+###############################################################################
+class IsoTpConnection(BaseConnection):
+
+    mtu = 4095
+
+    def __init__(self, isotp_layer, name=None, event_driven=False, tx_flush=None):
+        BaseConnection.__init__(self, name)
+        self.toIsoTPQueue = queue.Queue()
+        self.fromIsoTPQueue = queue.Queue()
+        self._read_thread = None
+        self.exit_requested = False
+        self.opened = False
+        self.isotp_layer = isotp_layer
+        # event_driven: worker sleeps until a payload is queued, notify_rx() is called
+        # or isotp_layer.sleep_time() elapsed, instead of polling every 0.1ms
+        self.event_driven = event_driven
+        self._wakeup = threading.Event()
+        # tx_flush: called after every isotp_layer.process() pass to send the CAN frames it produced
+        self.tx_flush = tx_flush
+        # tx_done_time: perf_counter() when the isotp layer finished sending the last payload
+        self.tx_done_time = None
+        self._tx_pending = False
+        # negative responses 0x78 (response pending) received, each one means a P2* wait
+        self.response_pending = 0
+
+        assert isinstance(self.isotp_layer, isotp.TransportLayer) , 'isotp_layer must be a valid isotp.TransportLayer '
+
+    def open(self):
+        self.exit_requested = False
+        self._read_thread = threading.Thread(None, target=self.rxthread_task)
+        self._read_thread.start()
+        self.opened = True
+        self.logger.info('Connection opened')
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def is_open(self):
+        return self.opened
+
+    def close(self):
+        self.empty_rxqueue()
+        self.empty_txqueue()
+        self.exit_requested=True
+        self._wakeup.set()
+        self._read_thread.join()
+        self.isotp_layer.reset()
+        self.opened = False
+        self.logger.info('Connection closed')
+
+    def specific_send(self, payload):
+        if self.mtu is not None:
+            if len(payload) > self.mtu:
+                self.logger.warning("Truncating payload to be set to a length of %d" % (self.mtu))
+                payload = payload[0:self.mtu]
+
+        self.toIsoTPQueue.put(bytearray(payload)) # isotp.protocol.TransportLayer uses byte array. udsoncan is strict on bytes format
+        self._wakeup.set()
+
+    def notify_rx(self):
+        """
+        wake the worker up, called by the CAN receive side when frames for isotp_layer arrived
+        """
+        self._wakeup.set()
+
+    def specific_wait_frame(self, timeout=2):
+        if not self.opened:
+            raise RuntimeError("Connection is not open")
+
+        timedout = False
+        frame = None
+        try:
+            frame = self.fromIsoTPQueue.get(block=True, timeout=timeout)
+        except queue.Empty:
+            timedout = True
+
+        if timedout:
+            raise TimeoutException("Did not receive frame IsoTP Transport layer in time (timeout=%s sec)" % timeout)
+
+        if self.mtu is not None:
+            if frame is not None and len(frame) > self.mtu:
+                self.logger.warning("Truncating received payload to a length of %d" % (self.mtu))
+                frame = frame[0:self.mtu]
+
+        return bytes(frame)	# isotp.protocol.TransportLayer uses bytearray. udsoncan is strict on bytes format
+
+    def empty_rxqueue(self):
+        while not self.fromIsoTPQueue.empty():
+            self.fromIsoTPQueue.get()
+
+    def empty_txqueue(self):
+        while not self.toIsoTPQueue.empty():
+            self.toIsoTPQueue.get()
+
+    def rxthread_task(self):
+        while not self.exit_requested:
+            try:
+                while not self.toIsoTPQueue.empty():
+                    self.isotp_layer.send(self.toIsoTPQueue.get())
+                    self._tx_pending = True
+
+                self.isotp_layer.process()
+                if self.tx_flush is not None:
+                    self.tx_flush()
+                if self._tx_pending and not self.isotp_layer.transmitting():
+                    self._tx_pending = False
+                    self.tx_done_time = time.perf_counter()
+
+                while self.isotp_layer.available():
+                    payload = self.isotp_layer.recv()
+                    if len(payload) == 3 and payload[0] == 0x7F and payload[2] == 0x78:
+                        self.response_pending += 1
+                    self.fromIsoTPQueue.put(payload)
+
+                if self.event_driven:
+                    # clear before the next pass so a wakeup raised meanwhile is not lost
+                    self._wakeup.wait(self.isotp_layer.sleep_time())
+                    self._wakeup.clear()
+                else:
+                    time.sleep(0.0001)
+
+            except Exception as e:
+                self.exit_requested = True
+                self.logger.error(str(e))
+                print("Error occurred while read CAN(FD) data!")
+
+
+###############################################################################
+def sec_algo(level, seed, params):
+    """
+    Builds the security key to unlock a security level.
+    """
+    temp_key = (seed[0]<<24) | (seed[1] << 16) | (seed[2] << 8) | (seed[3])
+    if level == 0x01:
+        output_key_temp = ((((temp_key >> 4) ^ temp_key) << 3) ^ temp_key) & 0xFFFFFFFF
+    elif level == 0x11:
+        _temp_y = ((temp_key<<24) & 0xFF000000) + ((temp_key<<8) & 0xFF0000) + ((temp_key>>8) & 0xFF00) + ((temp_key>>24) & 0xFF)
+        _temp_z = 0
+        _temp_sum = 0
+        for i in range(64):
+            _temp_y += ((((_temp_z<<4) ^ (_temp_z>>5)) + _temp_z) ^ (_temp_sum + params[_temp_sum&0x3])) & 0xFFFFFFFF
+            _temp_y = _temp_y & 0xFFFFFFFF
+            _temp_sum += 0x8F750A1D
+            _temp_sum = _temp_sum & 0xFFFFFFFF
+            _temp_z += ((((_temp_y<<4) ^ (_temp_y>>5)) + _temp_y) ^ (_temp_sum + params[(_temp_sum>>11)&0x3])) & 0xFFFFFFFF
+            _temp_z = _temp_z & 0xFFFFFFFF
+        output_key_temp = (((_temp_z<<24) & 0xFF000000) | ((_temp_z<<8) & 0xFF0000) | ((_temp_z>>8) & 0xFF00) | ((_temp_z>>24) & 0xFF))
+    else:
+        output_key_temp = temp_key
+
+    output_key = struct.pack('BBBB', (output_key_temp>>24)&0xFF, (output_key_temp>>16)&0xFF, (output_key_temp>>8)&0xFF, output_key_temp&0xFF)
+
+    return output_key
+
+
+def get_datetime_bytes():
+    """
+    get year/month/day and convert into bytes
+    """
+    now = datetime.datetime.now()
+    _year_high = int(str(now.year), 16) >> 8
+    _year_low = int(str(now.year), 16) & 0xFF
+    _month = int(str(now.month), 16)
+    _day = int(str(now.day), 16)
+    _hour = int(str(now.hour), 16)
+    _minute = int(str(now.minute), 16)
+    _second = int(str(now.second), 16)
+
+    return (_year_high, _year_low, _month, _day, _hour, _minute, _second)
+
+
+def client_config(registry=None):
+    """
+    udsoncan client config of the leap ECUs: security algorithm, DID codecs, 32 bits memory addresses.
+    registry: did_registry.DidRegistry of the DID codecs, DIDList.json next to this file by default
+    """
+    config = dict(default_client_config)
+    config['security_algo'] = sec_algo
+    config['security_algo_params'] = SECURITY_ALGO_PARAMS
+    config['data_identifiers'] = (registry or did_registry.load()).codecs()
+    config['server_address_format'] = 32
+    config['server_memorysize_format'] = 32
+    return config
+
+
+def start_channel(zcan, dev_handle, dev_info, chn_index, mode=0, baudrate="500K", data_baudrate=None, resistance=True):
+    """
+    configure, init and start one channel of an open device, dev_info is its dev_info.json entry.
+    mode 0 normal, 1 listen only. Returns the channel handle, raises CCDiagError
+    """
+    chn_info = dev_info["chn_info"]
+    dev_type = dev_info["dev_type"]
+    if chn_info["is_canfd"] and data_baudrate is None:
+        data_baudrate = list(chn_info["data_baudrate"])[0]
+
+    if chn_info["sf_res"]: #resistance enable
+        ip = zcan.GetIProperty(dev_handle)
+        zcan.SetValue(ip, str(chn_index) + "/initenal_resistance", '1' if resistance else '0')
+        zcan.ReleaseIProperty(ip)
+
+    #set usbcan-e-u baudrate
+    if dev_type in USBCAN_XE_U_TYPE:
+        ip = zcan.GetIProperty(dev_handle)
+        zcan.SetValue(ip, str(chn_index) + "/baud_rate", chn_info["baudrate"][baudrate])
+        zcan.ReleaseIProperty(ip)
+
+    #set pcie-canfd baudrates, the timing fields of the init config are not used
+    if dev_type in PCIE_CANFD_TYPE:
+        ip = zcan.GetIProperty(dev_handle)
+        zcan.SetValue(ip, str(chn_index) + "/canfd_abit_baud_rate", chn_info["baudrate"][baudrate])
+        zcan.SetValue(ip, str(chn_index) + "/canfd_dbit_baud_rate", chn_info["data_baudrate"][data_baudrate])
+        zcan.ReleaseIProperty(ip)
+
+    #set usbcanfd clock
+    if dev_type in USBCANFD_TYPE:
+        ip = zcan.GetIProperty(dev_handle)
+        zcan.SetValue(ip, str(chn_index) + "/clock", "60000000")
+        zcan.ReleaseIProperty(ip)
+
+    chn_cfg = ZCAN_CHANNEL_INIT_CONFIG()
+    chn_cfg.can_type = ZCAN_TYPE_CANFD if chn_info["is_canfd"] else ZCAN_TYPE_CAN
+    if chn_info["is_canfd"]:
+        chn_cfg.config.canfd.mode = mode
+        #pcie-canfd timings set above, the virtual device has none
+        if dev_type not in PCIE_CANFD_TYPE and dev_type != ZCAN_VIRTUAL_DEVICE.value:
+            chn_cfg.config.canfd.abit_timing = chn_info["baudrate"][baudrate]
+            chn_cfg.config.canfd.dbit_timing = chn_info["data_baudrate"][data_baudrate]
+    else:
+        chn_cfg.config.can.mode = mode
+        if dev_type in USBCAN_I_II_TYPE:
+            brt = chn_info["baudrate"][baudrate]
+            chn_cfg.config.can.timing0 = brt["timing0"]
+            chn_cfg.config.can.timing1 = brt["timing1"]
+            chn_cfg.config.can.acc_code = 0
+            chn_cfg.config.can.acc_mask = 0xFFFFFFFF
+
+    chn_handle = zcan.InitCAN(dev_handle, chn_index, chn_cfg)
+    if chn_handle == INVALID_CHANNEL_HANDLE:
+        raise CCDiagError("init channel %d failed" % chn_index)
+
+    if zcan.StartCAN(chn_handle) != ZCAN_STATUS_OK:
+        raise CCDiagError("start channel %d failed" % chn_index)
+    return chn_handle
+
+
+def _journal_done(journal, step):
+    return journal is not None and journal.is_done(step)
+
+
+def _journal_complete(journal, step):
+    if journal is not None:
+        journal.complete(step)
+
+
+def flash_leap_esc(client, image, report=None, journal=None, unchanged=(), **options):
+    """
+    flash a uds_flash.FlashImage or flash_package.FlashPackage with udsoncan client according to leap flash spec, leap and conti esc specific.
+    report: flash_timing.FlashTimingReport of the phases, options go to uds_flash.download_segment: pipeline, timing
+    journal: flash_journal.FlashJournal, the steps it holds as done are skipped, it is cleared once the flash completed
+    unchanged: "sw 0x..." steps already in the ECU (flash_delta.DeltaPlan), neither erased nor downloaded
+    """
+    _bootswmemaddr = image.boot_segments[0].address
+
+    ####pre programming step
+    with phase(report, "pre-programming"):
+        client.ensure(3)
+    with phase(report, "security access"):
+        client.ensure(3, 1)
+    with phase(report, "pre-programming"):
+        client.start_routine(routine_id = 0x0203)
+        client.control_dtc_setting(services.ControlDTCSetting.SettingType.off)
+        client.communication_control(0x3, 0x3)
+        client.change_session(2)
+    with phase(report, "security access"):
+        client.unlock_security_access(0x11)
+    with phase(report, "fingerprint"):
+        client.write_data_by_identifier(did = 0xF199, value = get_datetime_bytes())
+
+    #server programming step
+    #the flash driver is in ECU RAM, downloaded and checked on every resume too
+    for seg in image.boot_segments:
+        image.download(client, MemoryLocation(address=seg.address, memorysize=seg.size), seg, report=report, **options)
+
+    with phase(report, "checksum routine"):
+        client.start_routine(routine_id = 0x0202, data=struct.pack('>I', _bootswmemaddr))
+
+    for seg in image.sw_segments:
+        k = MemoryLocation(address=seg.address, memorysize=seg.size)
+        step = "sw 0x%08X" % k.address
+        if step in unchanged:
+            if report is not None:
+                report.skipped.append(step + " unchanged")
+            continue
+        if _journal_done(journal, step):
+            continue
+        #a partly written segment is erased again
+        erase = "erase 0x%08X" % k.address
+        if journal is None or journal.was_started(step) or not journal.is_done(erase):
+            _data = struct.pack('BBBBBBBB', 0x00, k.address >> 16, (k.address >> 8) & 0xFF, (k.address & 0xFF), 0x00, k.memorysize >> 16, (k.memorysize >> 8) & 0xFF, (k.memorysize & 0xFF))
+            with phase(report, "erase", segment="0x%08X" % k.address):
+                client.start_routine(routine_id = 0xFF00, data = _data)
+            _journal_complete(journal, erase)
+        if journal is not None:
+            journal.begin(step)
+        image.download(client, k, seg, report=report, **options)
+        _journal_complete(journal, step)
+
+    with phase(report, "check dependencies"):
+        client.start_routine(routine_id=0xFF00)
+    if journal is not None:
+        journal.clear()
+
+    #Post programming step
+    with phase(report, "reset"):
+        client.ecu_reset(3)
+    with phase(report, "post-programming"):
+        client.change_session(3)
+        client.communication_control(0x0, 0x3)
+        client.control_dtc_setting(services.ControlDTCSetting.SettingType.on)
+        client.change_session(1)
+    return True
+
+
+###############################################################################
+class DiagTarget(object):
+    """
+    ISO-TP layer, IsoTpConnection and UDS client of one ECU address. Its frames come from the
+    channel ZCANDispatcher through rx_queue and go out through its own ZCANTxRing.
+    isotp_errors counts the broken receptions (sequence errors, consecutive frame timeouts);
+    with tuned flow control (see isotp_tune) the first one falls back to the configured
+    STmin/blocksize and calls on_tune_fallback(name).
+    """
+    RX_ERRORS = (isotp.WrongSequenceNumberError, isotp.ConsecutiveFrameTimeoutError,
+                 isotp.UnexpectedConsecutiveFrameError, isotp.ReceptionInterruptedWithFirstFrameError,
+                 isotp.ReceptionInterruptedWithSingleFrameError)
+
+    def __init__(self, name, address, isotp_params, client_config):
+        self.name        = name
+        self.rx_queue    = ZCANRxQueue(address.rxid, extended=address.is_29bits)
+        self.tx_ring     = None
+        self.isotp_errors = 0
+        self.tuned       = False
+        self.on_tune_fallback = None
+        self._default_flow_control = (isotp_params['stmin'], isotp_params['blocksize'])
+        self.isotp_layer = isotp.TransportLayer(rxfn=self.rx_queue.recv, txfn=self.isotp_send,
+                                                address=address, error_handler=self.isotp_error,
+                                                params=isotp_params)
+        self.conn        = IsoTpConnection(isotp_layer=self.isotp_layer, event_driven=True, tx_flush=self.isotp_flush)
+        self.rx_queue.on_rx = self.conn.notify_rx
+        self.udsclient   = SessionClient(self.conn, config=dict(client_config), request_timeout= 2)
+
+    def set_fd(self, fd):
+        """
+        ISO-TP over CAN FD (64 byte frames, bit rate switch) or classic CAN (8 byte frames)
+        """
+        params = self.isotp_layer.params
+        params.set('can_fd', fd, validate=False)
+        params.set('bitrate_switch', fd, validate=False)
+        params.set('tx_data_length', 64 if fd else 8)
+        self.isotp_layer.load_params()
+
+    @property
+    def is_fd(self):
+        return self.isotp_layer.params.can_fd
+
+    @property
+    def flow_control(self):
+        """
+        (stmin, blocksize) sent to the ECU in our flow control frames
+        """
+        return self.isotp_layer.params.stmin, self.isotp_layer.params.blocksize
+
+    def set_flow_control(self, stmin, blocksize):
+        params = self.isotp_layer.params
+        params.set('stmin', stmin, validate=False)
+        params.set('blocksize', blocksize)
+
+    def reset_flow_control(self):
+        self.set_flow_control(*self._default_flow_control)
+        self.tuned = False
+
+    def isotp_error(self, error):
+        if not isinstance(error, self.RX_ERRORS):
+            return
+        self.isotp_errors += 1
+        if self.tuned:
+            print("INFO: %s %s, back to stmin %d blocksize %d" % ((self.name, type(error).__name__) + self._default_flow_control))
+            self.reset_flow_control()
+            if self.on_tune_fallback is not None:
+                self.on_tune_fallback(self.name)
+
+    def open(self, zcan, chn_handle):
+        self.tx_ring = ZCANTxRing(zcan, chn_handle, on_error=self.isotp_tx_error)
+        self.udsclient.state.reset()
+        self.udsclient.open()
+
+    def close(self):
+        self.udsclient.close()
+        self.tx_ring = None
+
+    def isotp_send(self, isotp_msg):
+        if self.tx_ring is not None:
+            self.tx_ring.send(isotp_msg)
+
+    def isotp_flush(self):
+        if self.tx_ring is not None:
+            self.tx_ring.flush()
+
+    def isotp_tx_error(self, failed_num):
+        print("ERROR: %s %d CAN frame(s) failed to send, %d in total" % (self.name, failed_num, self.tx_ring.tx_errors))
+
+    def counters(self):
+        """
+        CAN frame and retry counters since the channel was opened, for flash_timing.FlashTimingReport
+        """
+        return {
+            "tx_frames"        : self.tx_ring.tx_frames if self.tx_ring is not None else 0,
+            "tx_errors"        : self.tx_ring.tx_errors if self.tx_ring is not None else 0,
+            "rx_frames"        : self.rx_queue.rx_frames,
+            "response_pending" : self.conn.response_pending,
+            }
+
+
+###############################################################################
+class CCDiagEngine(object):
+    """
+    Diagnostic core shared by the GUI and the CLI.
+
+    open_device/open_channel/close_* are quick and synchronous, they raise CCDiagError.
+    ECU operations are queued on one worker thread (UDS is half duplex) and return a Future,
+    its result or exception is the outcome of the operation.
+
+    Every ECU address has its own DiagTarget, all fed by one ZCANDispatcher of the channel;
+    set_target() only selects the one used by the next operations.
+    The functional target shares the ESC response id and is attached only while it is used.
+    Targets named in fd_targets (set_canfd) talk ISO-TP over CAN FD when the channel is FD.
+    """
+    ADDRESSES = {
+        "ESC"      : isotp.Address(isotp.AddressingMode.Normal_11bits, txid=ESC_RX_ID_PHYS, rxid=ESC_TX_ID),
+        "ESC_FUNC" : isotp.Address(isotp.AddressingMode.Normal_11bits, txid=ESC_RX_ID_FUNC, rxid=ESC_TX_ID),
+        "EPS"      : isotp.Address(isotp.AddressingMode.Normal_11bits, txid=EPS_RX_ID_PHYS, rxid=EPS_TX_ID),
+        "EPS4wd"   : isotp.Address(isotp.AddressingMode.Normal_11bits, txid=EPS4wd_RX_ID_PHYS, rxid=EPS4wd_TX_ID),
+        }
+    ON_DEMAND_TARGETS = ("ESC_FUNC",)
+
+    def __init__(self, dev_info_path="./dev_info.json", dtc_list_path="./DTCList.json", backend=None,
+                 did_list_path="./DIDList.json"):
+        with open(dev_info_path, "r") as fd:
+            self.dev_info = json.load(fd)
+        with open(dtc_list_path, "r", encoding=DTC_LIST_ENCODING) as fd:
+            self.dtc_list = json.load(fd)
+        self.did_registry = did_registry.load(did_list_path)
+
+        self._hw_zcan     = open_backend(backend)
+        self._zcan        = self._hw_zcan
+        self._dev_handle  = INVALID_DEVICE_HANDLE
+        self._can_handle  = INVALID_CHANNEL_HANDLE
+        self._ecu_sim     = None
+        self._dispatcher  = None
+        self._trace       = None
+        self._replay      = None
+        self.periodic     = None
+        self._tester_present = None
+        self.keepalive    = True
+        self._executor    = ThreadPoolExecutor(max_workers=1)
+
+        self.cur_dev_info = None
+        self.dev_index    = 0
+        self.chn_index    = 0
+        self.is_open      = False
+        self.is_chn_open  = False
+        self.is_canfd     = False
+        self.res_support  = False
+
+        self.isotp_params = dict(ISOTP_PARAMS)
+        self.client_config = client_config(self.did_registry)
+        self.flash_records = flash_delta.FlashRecordStore()
+        self.isotp_tuning  = isotp_tune.IsoTpTuneStore()
+
+        self.targets = {}
+        for name, address in self.ADDRESSES.items():
+            self.targets[name] = DiagTarget(name, address, self.isotp_params, self.client_config)
+            self.targets[name].on_tune_fallback = self._drop_tuning
+        self._target = self.targets["ESC"]
+        self.fd_targets = set()
+        self._did_limits = {}               # target name -> DIDs per 0x22 request it accepts
+
+    @property
+    def udsclient(self):
+        return self._target.udsclient
+
+    @property
+    def conn(self):
+        return self._target.conn
+
+    @property
+    def isotp_layer(self):
+        return self._target.isotp_layer
+
+###############################################################################
+### Device and channel
+###############################################################################
+    @property
+    def is_virtual(self):
+        return self.cur_dev_info is not None and self.cur_dev_info["dev_type"] == ZCAN_VIRTUAL_DEVICE.value
+
+    @property
+    def simulator(self):
+        """
+        ecu_sim.EcuSimulator of the open virtual channel, None on real devices
+        """
+        return self._ecu_sim
+
+    def open_device(self, dev_name, dev_index=0):
+        if self.is_open:
+            self.close_device()
+        self.cur_dev_info = self.dev_info[dev_name]
+        #virtual device, simulated ECUs on an in-process bus
+        self._zcan = ZCANVirtualDriver() if self.is_virtual else self._hw_zcan
+
+        self._dev_handle = self._zcan.OpenDevice(self.cur_dev_info["dev_type"], dev_index, 0)
+        if self._dev_handle == INVALID_DEVICE_HANDLE:
+            raise CCDiagError("open device %s %d failed" % (dev_name, dev_index))
+        self.dev_index   = dev_index
+        self.is_canfd    = self.cur_dev_info["chn_info"]["is_canfd"]
+        self.res_support = self.cur_dev_info["chn_info"]["sf_res"]
+        self.is_open     = True
+
+    def close_device(self):
+        if not self.is_open:
+            return
+        if self.is_chn_open:
+            self.close_channel()
+        self._zcan.CloseDevice(self._dev_handle)
+        self._dev_handle = INVALID_DEVICE_HANDLE
+        self.is_open = False
+
+    def device_info(self):
+        return self._zcan.GetDeviceInf(self._dev_handle)
+
+    def open_channel(self, chn_index=0, mode=0, baudrate="500K", data_baudrate=None, resistance=True, uds=True):
+        """
+        mode 0 normal, 1 listen only. baudrate/data_baudrate are keys of dev_info.json
+        """
+        self._can_handle = start_channel(self._zcan, self._dev_handle, self.cur_dev_info, chn_index, mode,
+                                         baudrate, data_baudrate, resistance)
+        self.chn_index = chn_index
+        self.periodic = can_periodic.PeriodicScheduler(self._zcan, self._can_handle, self._dev_handle, chn_index).start()
+
+        if self.is_virtual:
+            ecus = ecu_sim.default_ecus(security_algo=sec_algo, security_algo_params=SECURITY_ALGO_PARAMS)
+            for ecu in ecus:
+                ecu.fd = self.is_canfd and ecu.name in self.fd_targets
+            self._ecu_sim = ecu_sim.start_simulator(self.dev_index, chn_index, ecus=ecus)
+
+        #start receive thread
+        if uds:
+            self._dispatcher = ZCANDispatcher(self._zcan, self._can_handle, fd=self.is_canfd)
+            for name, target in self.targets.items():
+                target.set_fd(self.is_canfd and name in self.fd_targets)
+                self._apply_tuning(target)
+                target.open(self._zcan, self._can_handle)
+                if name not in self.ON_DEMAND_TARGETS:
+                    self._dispatcher.attach(target.rx_queue)
+            self._dispatcher.start()
+            if self.fd_targets and not self.is_canfd:
+                print("INFO: %s stay on classic CAN, the channel is not CAN FD" % ", ".join(sorted(self.fd_targets)))
+        self.is_chn_open = True
+
+    def close_channel(self):
+        if not self.is_chn_open:
+            return
+        self.stop_trace()
+        self.stop_replay()
+        self.periodic.stop()
+        self.periodic = None
+        self._tester_present = None
+        for target in self.targets.values():
+            target.udsclient.state.kept_alive = False
+        if self._dispatcher is not None:
+            self._dispatcher.stop()
+            self._dispatcher = None
+            for target in self.targets.values():
+                target.close()
+        if self._ecu_sim is not None:
+            self._ecu_sim.stop()
+            self._ecu_sim = None
+        self._zcan.ResetCAN(self._can_handle)
+        self._can_handle = INVALID_CHANNEL_HANDLE
+        self.is_chn_open = False
+
+    def set_canfd(self, name, enable=True):
+        """
+        ISO-TP over CAN FD for the ECU name, taken over by the next open_channel.
+        Only for ECUs known to be FD capable, FD frames are error frames to a classic CAN node.
+        Functional requests (ESC_FUNC) stay on classic CAN unless named here themselves
+        """
+        if name not in self.targets:
+            raise CCDiagError("unknown target %s" % name)
+        if enable:
+            self.fd_targets.add(name)
+        else:
+            self.fd_targets.discard(name)
+
+    def _tune_key(self, target):
+        #classic CAN and CAN FD flow control are tuned apart
+        return target.name + (" fd" if target.is_fd else "")
+
+    def _apply_tuning(self, target):
+        entry = self.isotp_tuning.load(self._tune_key(target))
+        if entry is None:
+            target.reset_flow_control()
+            return
+        target.set_flow_control(entry["stmin"], entry["blocksize"])
+        target.tuned = True
+
+    def _drop_tuning(self, name):
+        self.isotp_tuning.forget(self._tune_key(self.targets[name]))
+
+    def forget_tuning(self, name):
+        """
+        drop the cached flow control of the ECU name (on its current CAN or CAN FD link),
+        back to the configured STmin/blocksize
+        """
+        if name not in self.targets:
+            raise CCDiagError("unknown target %s" % name)
+        self._drop_tuning(name)
+        self.targets[name].reset_flow_control()
+
+    def tune_isotp(self, rounds=isotp_tune.PROBE_ROUNDS):
+        """
+        probe the current target from the configured STmin/blocksize to STmin 0 / blocksize 0 and
+        keep the fastest flow control it answers without errors, cached for the next sessions.
+        Future of the isotp_tune.TuneResult
+        """
+        return self.submit(self._tune_isotp, self._target, rounds)
+
+    def _tune_isotp(self, target, rounds):
+        target.reset_flow_control()
+        try:
+            result = isotp_tune.tune(target, rounds)
+        except isotp_tune.TuneError as e:
+            raise CCDiagError("%s tuning failed with stmin %d blocksize %d: %s" % ((target.name,) + target.flow_control + (e,)))
+        self.isotp_tuning.save(self._tune_key(target), result)
+        target.tuned = True
+        return result
+
+    def close(self):
+        self.close_device()
+        self._executor.shutdown()
+
+    def start_trace(self, path):
+        """
+        record the frames received and sent on the open channel to path, see can_trace
+        """
+        if self._dispatcher is None:
+            raise CCDiagError("open the channel with uds=True to record a trace")
+        self.stop_trace()
+        self._trace = can_trace.TraceRecorder(path, fd=self.is_canfd)
+        self._trace.attach(self._dispatcher, [target.tx_ring for target in self.targets.values()] + [self.periodic])
+        return self._trace
+
+    def stop_trace(self):
+        if self._trace is None:
+            return
+        self._trace.detach(self._dispatcher, [target.tx_ring for target in self.targets.values() if target.tx_ring is not None] + [self.periodic])
+        self._trace.close()
+        print("INFO: %d frame(s) recorded to %s" % (self._trace.frames, self._trace.path))
+        self._trace = None
+
+    def tester_present(self, period=2.0, hardware=True):
+        """
+        functional TesterPresent with suppressed response (3E 80) every period seconds from
+        the periodic scheduler, on the device auto transmit objects when it has them; period None stops it
+        """
+        if self._tester_present is not None:
+            self.periodic.remove(self._tester_present)
+            self._tester_present = None
+        if period is not None:
+            padding = self.isotp_params.get('tx_padding') or 0
+            self._tester_present = self.periodic.add(ESC_RX_ID_FUNC, bytes([0x02, 0x3E, 0x80]).ljust(8, bytes([padding])),
+                                                     period, hardware=hardware)
+        #functional: every ECU on the channel stays in its session
+        for target in self.targets.values():
+            target.udsclient.state.kept_alive = period is not None and period < S3_SERVER_S
+        return self._tester_present
+
+    def replay_trace(self, path, **options):
+        """
+        send the frames of a can_trace recording on the open channel, options go to can_replay.TraceReplay:
+        start, end, speed, loop, rx, tx, ids. Returns the running TraceReplay
+        """
+        if not self.is_chn_open:
+            raise CCDiagError("open a channel to replay a trace")
+        self.stop_replay()
+        self._replay = can_replay.TraceReplay(self._zcan, self._can_handle, can_trace.TraceReader(path), **options)
+        return self._replay.start()
+
+    def stop_replay(self):
+        if self._replay is None:
+            return
+        self._replay.stop()
+        self._replay.reader.close()
+        self._replay = None
+
+    def async_channel(self, loop=None):
+        """
+        AsyncZCANChannel on the open channel, for asyncio clients; the channel must be opened with uds=False
+        """
+        if not self.is_chn_open or self._dispatcher is not None:
+            raise CCDiagError("open the channel with uds=False for asyncio clients")
+        return AsyncZCANChannel(self._zcan, self._can_handle, loop)
+
+    def async_client(self, channel, target, isotp_params=None):
+        """
+        AsyncUdsClient to target ("ESC", "EPS", "EPS4wd") on channel, configured like udsclient
+        """
+        conn = channel.connection(self.ADDRESSES[target], isotp_params)
+        return AsyncUdsClient(conn, request_timeout=2, config=self.client_config)
+
+    def set_target(self, name):
+        """
+        select the ECU of the next operations: "ESC", "ESC_FUNC", "EPS" or "EPS4wd"
+        """
+        self._target = self.targets[name]
+
+    @contextlib.contextmanager
+    def attached(self, name):
+        """
+        target name is fed by the dispatcher inside the with block, for on demand targets
+        """
+        target = self.targets[name]
+        on_demand = name in self.ON_DEMAND_TARGETS and self._dispatcher is not None
+        if on_demand:
+            self._dispatcher.attach(target.rx_queue)
+        try:
+            yield target
+        finally:
+            if on_demand:
+                self._dispatcher.detach(target.rx_queue)
+
+###############################################################################
+### ECU operations, run on the worker thread
+###############################################################################
+    def submit(self, fn, *args, **kwargs):
+        """
+        run fn(*args, **kwargs) on the worker thread after the operations already queued
+        """
+        return self._executor.submit(fn, *args, **kwargs)
+
+    def describe_dtc(self, dtc_id):
+        return self.dtc_list.get(hex(dtc_id), "unknow DTC")
+
+    def read_dtc(self, status_mask=9):
+        """
+        Future of the udsoncan Dtc list
+        """
+        return self.submit(self._read_dtc, self.udsclient, status_mask)
+
+    def _read_dtc(self, client, status_mask):
+        response = client.get_dtc_by_status_mask(status_mask)
+        return response.service_data.dtcs
+
+    def clear_dtc(self):
+        client = self.udsclient
+        return self.submit(lambda: client.clear_dtc(0xFFFFFF).positive)
+
+    def _extended(self, client, fn, *args, **kwargs):
+        """
+        fn in the extended session with security level 1, see uds_session.SessionClient.in_session.
+        Starts the TesterPresent keeping the session alive if it is not running
+        """
+        if self.keepalive and self._tester_present is None and self.periodic is not None:
+            self.tester_present(KEEPALIVE_PERIOD)
+        return client.in_session(EXTENDED_SESSION, 1, fn, *args, **kwargs)
+
+    def read_sw_version(self):
+        return self.submit(self._read_sw_version, self.udsclient)
+
+    def _read_sw_version(self, client):
+        response = self._extended(client, client.read_data_by_identifier, 0xF195)
+        return response.service_data.values[0xF195]
+
+    def read_dids(self, dids):
+        """
+        read dids (defined in the DID list) with as few 0x22 requests as the target allows,
+        see did_registry.read_dids. Future of the DidReadResult
+        """
+        return self.submit(self._read_dids, self._target, list(dids))
+
+    def read_identification(self):
+        """
+        every DID of the "identification" group of the DID list, Future of the DidReadResult
+        """
+        return self.read_dids(self.did_registry.group("identification"))
+
+    def _read_dids(self, target, dids):
+        result = did_registry.read_dids(target.udsclient, self.did_registry, dids,
+                                        max_dids=self._did_limits.get(target.name))
+        if result.max_dids is not None:
+            self._did_limits[target.name] = result.max_dids
+        return result
+
+    def reset_ecu(self):
+        return self.submit(self.udsclient.ecu_reset, 1)
+
+    def ins_calibration(self):
+        return self.submit(self._ins_calibration, self.udsclient)
+
+    def _ins_calibration(self, client):
+        resp_1 = self._extended(client, client.start_routine, routine_id = 0xF001)
+        resp_2 = self._extended(client, client.start_routine, routine_id = 0xF002)
+        return resp_1.positive and resp_2.positive
+
+    def c11_config(self):
+        return self.submit(self._c11_config, self.udsclient)
+
+    def _c11_config(self, client):
+        return self._extended(client, client.write_data_by_identifier, did = 0xF1A8, value = 0x0F).positive
+
+    def release_epb(self):
+        return self.submit(self._epb_routine, self.udsclient, 0xF102)
+
+    def apply_epb(self):
+        return self.submit(self._epb_routine, self.udsclient, 0xF105)
+
+    def _epb_routine(self, client, routine_id):
+        return self._extended(client, client.start_routine, routine_id = routine_id)
+
+    def flash(self, sw_path, boot_path, pipeline=False, timing=None, resume=True, delta=False):
+        """
+        flash boot and application .s19 according to leap flash spec, leap and conti esc specific.
+        pipeline/timing: see uds_flash.download_segment. resume: continue after the last completed
+        segment of a failed flash of the same files, see flash_journal. delta: skip the application
+        segments unchanged since the last delta flash of this ECU, see flash_delta.
+        Future of the flash_timing.FlashTimingReport, also when the flash failed: check its ok/error
+        """
+        return self.submit(self._flash, self._target, sw_path, boot_path, pipeline, timing, resume, delta)
+
+    def _flash(self, target, sw_path, boot_path, pipeline, timing, resume, delta):
+        report = FlashTimingReport(target.name, counters=target.counters).start()
+        try:
+            with report.phase("parse"):
+                package = flash_package.load_package(sw_path, boot_path)
+            with package:
+                with report.phase("identify"):
+                    ecu_id = flash_delta.read_ecu_id(target.udsclient)
+                journal = flash_journal.open_journal(package, target.name, ecu_id, resume=resume)
+                report.skipped = journal.skipped
+                delta_plan = None
+                if delta:
+                    delta_plan = flash_delta.plan(target.udsclient, package, target.name, self.flash_records, report)
+                    if delta_plan.reason is not None:
+                        print("INFO: full flash, %s" % delta_plan.reason)
+                flash_leap_esc(target.udsclient, package, report=report, journal=journal, pipeline=pipeline, timing=timing,
+                               unchanged=delta_plan.unchanged if delta_plan is not None else ())
+                if delta_plan is not None:
+                    flash_delta.commit(target.udsclient, delta_plan, target.name, self.flash_records, report)
+            report.finish()
+        except Exception as e:
+            report.finish(False, "%s: %s" % (report.phases[-1].name if report.phases else "flash", e))
+        return report
+
+    def cali_eps4wd(self):
+        """
+        SAS zero point calibration of the 4wd EPS over CCP, Future of the list of log lines
+        """
+        return self.submit(self._ccp_eps4wd, b'\x02\x02\x00\x00\x22\xC3\x00\x00', b'\x03\x03\x01\x01\x22\xC3\x00\x00',
+                           ('CCP设定标定参数地址', 'CCP标定写参数'))
+
+    def decali_eps4wd(self):
+        return self.submit(self._ccp_eps4wd, b'\x02\x02\x00\x00\x88\x0B\xE0\x00', b'\x03\x03\x01\x00\x00\x00\x00\x00',
+                           ('CCP设定解标参数地址', 'CCP解标写参数'))
+
+    def _ccp_eps4wd(self, set_mta, download, texts):
+        log = []
+        conn = self.targets["EPS4wd"].conn
+        try:
+            conn.send(struct.pack("BBBBBBBB", 0x01, 0x01, 0x39, 0x00, 0x00, 0x00, 0x00, 0x00))
+            payload_rcv = conn.wait_frame(timeout=1)
+            log.append('CCP连接成功!' if payload_rcv == b'\xFF\x00\x01\x00\x00\x00\x00\x00' else 'CCP连接失败!')
+            conn.send(set_mta)
+            payload_rcv = conn.wait_frame(timeout=1)
+            log.append(texts[0] + ('成功!' if payload_rcv == b'\xFF\x00\x02\x00\x00\x00\x00\x00' else '失败!'))
+            conn.send(download)
+            payload_rcv = conn.wait_frame(timeout=1)
+            log.append(texts[1] + ('成功!' if payload_rcv == b'\xFF\x00\x03\x00\x00\x00\x00\x00' else '失败!'))
+            log.append('标定成功!')
+        except Exception:
+            log.append('标定失败!')
+        return log
+
+    def auto_diag_test(self):
+        """
+        service 0x10 test, physical then functional addressing, Future of the report lines
+        """
+        return self.submit(self._auto_diag_test)
+
+    def _auto_diag_test(self):
+        log = self._diag_test_serv10(self.targets["ESC"], mode=1)
+        with self.attached("ESC_FUNC") as target:
+            log += self._diag_test_serv10(target, mode=0)
+        return log
+
+    def _request_code(self, conn, payload):
+        try:
+            conn.send(payload)
+            return Response.from_payload(conn.wait_frame(timeout=1)).code
+        except Exception:
+            return None
+
+    def _diag_test_serv10(self, target, mode):
+        log = []
+        if mode == 1:
+            _modetext = "物理寻址"
+        else:
+            _modetext = "功能寻址"
+
+        resp = target.udsclient.change_session(1)
+        _pass = "Pass" if resp.positive else "Fail"
+        log.append("%s下，10服务正响应测试，得到正响应。测试结果：%s\n" % (_modetext,_pass))
+
+        code = self._request_code(target.conn, services.DiagnosticSessionControl.make_request(0x07).get_payload())
+        _pass = "Pass" if code == Response.Code.SubFunctionNotSupported else "Fail"
+        log.append("%s下，10服务子功能不支持测试，得到NRC12返信。测试结果：%s\n" % (_modetext,_pass))
+
+        code = self._request_code(target.conn, b'\x10\x01\x77\x88\x99')
+        _pass = "Pass" if code == Response.Code.IncorrectMessageLengthOrInvalidFormat else "Fail"
+        log.append("%s下，10服务格式或长度不正确测试，得到NRC13返信。测试结果：%s\n" % (_modetext,_pass))
+
+        log.append("%s下，10服务前置条件不满足测试，得到NRC22返信。测试结果： No Test\n"% (_modetext))
+
+        code = self._request_code(target.conn, b'\x10\x02')
+        _pass = "Pass" if code == Response.Code.SubFunctionNotSupportedInActiveSession else "Fail"
+        log.append("%s下，10服务当前会话下子功能不支持测试，得到NRC$7E返信。测试结果：%s\n" % (_modetext,_pass))
+
+        self._request_code(target.conn, b'\x10\x02')
+        log.append("%s下，10服务NRC优先级测试。测试结果：No Test\n"% (_modetext))
+
+        try:
+            resp1 = target.udsclient.change_session(3)
+            resp2 = target.udsclient.change_session(1)
+            _pass = "Pass" if resp1.positive and resp2.positive else "Fail"
+        except Exception:
+            _pass = "Fail"
+        log.append("%s下，10服务会话切换测试。测试结果：%s\n" % (_modetext,_pass))
+
+        log.append("%s下，时间超时后会话维持情况测试。测试结果： No Test\n"% (_modetext))
+        log.append("%s下，KL15on-off-on会话维持情况测试。测试结果： No Test\n"% (_modetext))
+        log.append("%s下，硬件复位后会话维持情况测试。测试结果： No Test\n"% (_modetext))
+        return log
@@ -0,0 +1,198 @@
+# -*- coding:utf-8 -*-
+#  did_registry.py
+#
+#  ~~~~~~~~~~~~
+#
+#  Data identifiers of the ECUs, defined in DIDList.json:
+#      "0xF190": {"name": "VIN", "format": "16B", "encoding": "ascii", "group": "identification"}
+#  format is a struct format, compiled once into the udsoncan codec of the DID; encoding (ascii, bcd)
+#  is only used to display the value. read_dids() packs as many DIDs into one 0x22 request as the
+#  response length allows and splits a batch the ECU rejects as too long, so a whole group
+#  (identification block) is read in one or two round trips instead of one per DID.
+#
+#  ~~~~~~~~~~~~
+#
+import collections
+import json
+import os
+import struct
+
+from udsoncan import DidCodec, Request, services
+from udsoncan.exceptions import NegativeResponseException
+
+from uds_session import client_p2_timeout
+
+DEFAULT_DID_LIST = os.path.join(os.path.dirname(os.path.abspath(__file__)), "DIDList.json")
+
+# largest 0x22 response of one ISO-TP message on classic CAN
+MAX_RESPONSE_LENGTH = 4095
+
+# incorrectMessageLengthOrInvalidFormat, responseTooLong: too many DIDs in one request
+LENGTH_NRCS       = (0x13, 0x14)
+NRC_OUT_OF_RANGE  = 0x31
+
+_registries = {}
+
+
+class StructCodec(DidCodec):
+    """
+    udsoncan DidCodec with its pack string compiled once
+    """
+    def __init__(self, fmt):
+        DidCodec.__init__(self, fmt)
+        self._struct = struct.Struct(">" + fmt)
+
+    def encode(self, *did_value):
+        # udsoncan unpacks a tuple value for DidCodec itself only, a subclass gets it as one argument
+        if len(did_value) == 1 and isinstance(did_value[0], (tuple, list)):
+            did_value = did_value[0]
+        return self._struct.pack(*did_value)
+
+    def decode(self, did_payload):
+        return self._struct.unpack(did_payload)
+
+    def __len__(self):
+        return self._struct.size
+
+    def __deepcopy__(self, memo):
+        # udsoncan deep copies the DID config of every request, the codec is immutable
+        return self
+
+
+class DidDefinition(object):
+    def __init__(self, did, name, fmt, encoding=None, group=None):
+        self.did      = did
+        self.name     = name
+        self.codec    = StructCodec(fmt)
+        self.length   = len(self.codec)
+        self.encoding = encoding
+        self.group    = group
+
+    def text(self, value):
+        """
+        value as returned by the codec, for display
+        """
+        raw = bytes(value)
+        if self.encoding == "ascii":
+            return raw.decode("ascii", "replace").strip("\x00 ")
+        if self.encoding == "bcd":
+            return raw.hex()
+        return " ".join("%02X" % b for b in raw) if len(raw) > 1 else "0x%02X" % raw[0]
+
+
+class DidRegistry(object):
+    """
+    DidDefinition of every DID of a DIDList.json, by DID and in file order
+    """
+    def __init__(self, definitions):
+        self.definitions = collections.OrderedDict((d.did, d) for d in definitions)
+
+    def __getitem__(self, did):
+        try:
+            return self.definitions[did]
+        except KeyError:
+            raise KeyError("DID 0x%04X is not defined in the DID list" % did)
+
+    def __contains__(self, did):
+        return did in self.definitions
+
+    def __len__(self):
+        return len(self.definitions)
+
+    def group(self, name):
+        return [d.did for d in self.definitions.values() if d.group == name]
+
+    def codecs(self):
+        """
+        the data_identifiers of the udsoncan client config
+        """
+        return dict((did, d.codec) for did, d in self.definitions.items())
+
+
+def load(path=None):
+    """
+    DidRegistry of a DID list file, read once per path
+    """
+    path = os.path.abspath(path or DEFAULT_DID_LIST)
+    if path not in _registries:
+        with open(path, "r") as fd:
+            entries = json.load(fd, object_pairs_hook=collections.OrderedDict)
+        _registries[path] = DidRegistry(DidDefinition(int(did, 16), e["name"], e["format"], e.get("encoding"), e.get("group"))
+                                        for did, e in entries.items())
+    return _registries[path]
+
+
+class DidReadResult(object):
+    """
+    values: DID -> decoded value, unsupported: DIDs the ECU does not have,
+    requests: 0x22 requests sent, max_dids: DIDs per request the ECU accepted, None if not limited
+    """
+    def __init__(self, max_dids=None):
+        self.values      = collections.OrderedDict()
+        self.unsupported = []
+        self.requests    = 0
+        self.max_dids    = max_dids
+
+
+def _batches(registry, dids, max_response, max_dids):
+    batch, size = [], 1
+    for did in dids:
+        length = 2 + registry[did].length
+        if batch and (size + length > max_response or (max_dids is not None and len(batch) >= max_dids)):
+            yield batch
+            batch, size = [], 1
+        batch.append(did)
+        size += length
+    if batch:
+        yield batch
+
+
+def read_dids(client, registry, dids, max_response=MAX_RESPONSE_LENGTH, max_dids=None):
+    """
+    DidReadResult of dids read with as few 0x22 requests as possible. A batch answered with
+    NRC 0x13/0x14 is split in half and max_dids lowered for the rest, one answered 0x31 is split
+    until the unsupported DIDs are found. Other negative responses are raised
+    """
+    result = DidReadResult(max_dids)
+    pending = collections.deque(_batches(registry, dids, max_response, max_dids))
+    with client_p2_timeout(client):
+        while pending:
+            batch = pending.popleft()
+            request = Request(services.ReadDataByIdentifier, data=b"".join(struct.pack(">H", did) for did in batch))
+            result.requests += 1
+            try:
+                response = client.send_request(request)
+            except NegativeResponseException as e:
+                code = e.response.code
+                if len(batch) == 1 and code == NRC_OUT_OF_RANGE:
+                    result.unsupported.append(batch[0])
+                elif len(batch) > 1 and code in LENGTH_NRCS:
+                    result.max_dids = len(batch) // 2
+                    rest = batch + [did for b in pending for did in b]
+                    pending = collections.deque(_batches(registry, rest, max_response, result.max_dids))
+                elif len(batch) > 1 and code == NRC_OUT_OF_RANGE:
+                    pending.extendleft([batch[len(batch) // 2:], batch[:len(batch) // 2]])
+                else:
+                    raise
+                continue
+            _parse(registry, bytes(response.data), batch, result)
+    result.values = collections.OrderedDict((did, result.values[did]) for did in dids if did in result.values)
+    return result
+
+
+def _parse(registry, data, batch, result):
+    """
+    DIDs the ECU left out of a positive response are unsupported (ISO 14229-1 0x22)
+    """
+    pos = 0
+    while pos + 2 <= len(data):
+        did = struct.unpack_from(">H", data, pos)[0]
+        if did not in batch:
+            raise ValueError("DID 0x%04X in the response was not requested" % did)
+        definition = registry[did]
+        payload = data[pos + 2:pos + 2 + definition.length]
+        if len(payload) < definition.length:
+            raise ValueError("DID 0x%04X: %d byte(s), %d expected" % (did, len(payload), definition.length))
+        result.values[did] = definition.codec.decode(payload)
+        pos += 2 + definition.length
+    result.unsupported.extend(did for did in batch if did not in result.values)
@@ -0,0 +1,527 @@
+# -*- coding:utf-8 -*-
+#  ecu_sim.py
+#
+#  ~~~~~~~~~~~~
+#
+#  UDS server simulator for ESC/EPS/EPS4wd on a zlgcan virtual bus
+#
+#  ~~~~~~~~~~~~
+#
+import collections
+import heapq
+import os
+import struct
+import threading
+import time
+
+import isotp
+from isotp import CanMessage
+
+from zlgcan import virtual_bus, virtual_bus_name
+
+FUNC_RX_ID = 0x7DF
+
+ISOTP_PARAMS = {
+    'stmin' : 0,
+    'blocksize' : 8,
+    'tx_padding' : 0,
+    'rx_flowcontrol_timeout' : 1000,
+    'rx_consecutive_frame_timeout' : 1000,
+    }
+
+#Negative response codes
+NRC_SERVICE_NOT_SUPPORTED                  = 0x11
+NRC_SUBFUNCTION_NOT_SUPPORTED              = 0x12
+NRC_INCORRECT_MESSAGE_LENGTH               = 0x13
+NRC_CONDITIONS_NOT_CORRECT                 = 0x22
+NRC_REQUEST_SEQUENCE_ERROR                 = 0x24
+NRC_REQUEST_OUT_OF_RANGE                   = 0x31
+NRC_SECURITY_ACCESS_DENIED                 = 0x33
+NRC_INVALID_KEY                            = 0x35
+NRC_UPLOAD_DOWNLOAD_NOT_ACCEPTED           = 0x70
+NRC_GENERAL_PROGRAMMING_FAILURE            = 0x72
+NRC_WRONG_BLOCK_SEQUENCE_COUNTER           = 0x73
+NRC_RESPONSE_PENDING                       = 0x78
+NRC_SUBFUNCTION_NOT_SUPPORTED_IN_SESSION   = 0x7E
+NRC_SERVICE_NOT_SUPPORTED_IN_SESSION       = 0x7F
+
+# checksum of the downloaded flash driver, downloads are written to flash after it
+ROUTINE_CHECK_DRIVER = 0x0202
+
+DEFAULT_SESSION     = 0x01
+PROGRAMMING_SESSION = 0x02
+EXTENDED_SESSION    = 0x03
+
+# frame layouts of ZCAN_CAN_FRAME / ZCAN_CANFD_FRAME as carried by the virtual bus
+_CAN_FRAME_FORMAT   = struct.Struct('<IB3x8s')
+_CANFD_FRAME_FORMAT = struct.Struct('<IBB2x64s')
+
+
+class SimulatedEcu(object):
+    """
+    UDS server of one ECU: session, security, DIDs, DTCs, routines and a download memory.
+    handle() turns a request into the list of (delay, response) to send.
+    Downloads go to ram (the flash driver) until routine 0x0202 checked it, then to memory (flash),
+    ram is lost by a reset or a session change.
+
+    latency is the time before each final response, max_block_length goes to RequestDownload,
+    s3: seconds without request after which a non default session ends (S3server),
+    max_dids: DIDs per 0x22 request, more are answered with NRC 0x13,
+    fd: the ECU talks ISO-TP over CAN FD (64 byte frames, BRS),
+    inject_nrc() makes the next requests of a service fail (0x78 is sent before the real response).
+    """
+    def __init__(self, name, txid, rxid, dids=None, dtcs=None, routines=None,
+                 security_algo=None, security_algo_params=None, latency=0.0, max_block_length=0x402, fd=False, s3=5.0, max_dids=None):
+        self.name                 = name
+        self.txid                 = txid
+        self.rxid                 = rxid
+        self.dids                 = dict(dids or {})
+        self.dtcs                 = dict(dtcs or {})        # dtc id -> status byte
+        self.routines             = dict(routines or {})    # routine id -> status record or callable(data)
+        self.security_algo        = security_algo
+        self.security_algo_params = security_algo_params
+        self.latency              = latency
+        self.max_block_length     = max_block_length
+        self.fd                   = fd
+        self.s3                   = s3
+        self.max_dids             = max_dids
+        self.last_request         = 0.0
+        self.memory               = {}                      # download address -> bytearray
+        self.ram                  = {}
+        self.requests             = 0
+        self.responses            = 0
+        self._nrc                 = {}                      # service -> [nrc, count, after]
+        self._lock                = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.session   = DEFAULT_SESSION
+        self.unlocked  = 0
+        self._seed     = None
+        self._download = None
+        self.ram       = {}
+        self.driver_ok = False
+
+    def inject_nrc(self, service, nrc, count=1, after=0):
+        """
+        answer the next count requests of service with nrc, count None for all of them.
+        after: requests of service answered normally first, e.g. a fault in the middle of a TransferData sequence
+        """
+        with self._lock:
+            self._nrc[service] = [nrc, count, after]
+
+    def clear_nrc(self, service=None):
+        with self._lock:
+            if service is None:
+                self._nrc.clear()
+            else:
+                self._nrc.pop(service, None)
+
+    def _take_nrc(self, service):
+        with self._lock:
+            entry = self._nrc.get(service)
+            if entry is None:
+                return None
+            if entry[2] > 0:
+                entry[2] -= 1
+                return None
+            if entry[1] is not None:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del self._nrc[service]
+            return entry[0]
+
+    def handle(self, req, functional=False):
+        if not req:
+            return []
+        self.requests += 1
+        now = time.monotonic()
+        if self.session != DEFAULT_SESSION and self.s3 is not None and now - self.last_request > self.s3:
+            self.reset()
+        self.last_request = now
+        sid = req[0]
+        nrc = self._take_nrc(sid)
+        responses = []
+        if nrc == NRC_RESPONSE_PENDING:
+            responses.append((0.0, bytes([0x7F, sid, NRC_RESPONSE_PENDING])))
+        elif nrc is not None:
+            return [(self.latency, bytes([0x7F, sid, nrc]))]
+
+        handler = self.SERVICES.get(sid)
+        if handler is None:
+            resp = None if functional else self._negative(sid, NRC_SERVICE_NOT_SUPPORTED)
+        else:
+            resp = handler(self, req)
+        # suppressPosRspMsgIndicationBit on services with sub function
+        if resp is not None and resp[0] != 0x7F and sid in self.SUBFUNCTION_SERVICES and len(req) > 1 and req[1] & 0x80:
+            resp = None
+        if resp is None:
+            return responses
+        self.responses += 1
+        responses.append((self.latency, resp))
+        return responses
+
+    @staticmethod
+    def _negative(sid, nrc):
+        return bytes([0x7F, sid, nrc])
+
+    def _session_control(self, req):
+        if len(req) != 2:
+            return self._negative(0x10, NRC_INCORRECT_MESSAGE_LENGTH)
+        session = req[1] & 0x7F
+        if session not in (DEFAULT_SESSION, PROGRAMMING_SESSION, EXTENDED_SESSION):
+            return self._negative(0x10, NRC_SUBFUNCTION_NOT_SUPPORTED)
+        if session == PROGRAMMING_SESSION and self.session == DEFAULT_SESSION:
+            return self._negative(0x10, NRC_SUBFUNCTION_NOT_SUPPORTED_IN_SESSION)
+        self.session = session
+        self.unlocked = 0
+        self._seed = None
+        self._download = None
+        self.ram = {}
+        self.driver_ok = False
+        # P2 50ms, P2* 5000ms
+        return bytes([0x50, session, 0x00, 0x32, 0x01, 0xF4])
+
+    def _ecu_reset(self, req):
+        if len(req) != 2:
+            return self._negative(0x11, NRC_INCORRECT_MESSAGE_LENGTH)
+        if req[1] & 0x7F not in (1, 2, 3):
+            return self._negative(0x11, NRC_SUBFUNCTION_NOT_SUPPORTED)
+        self.reset()
+        return bytes([0x51, req[1] & 0x7F])
+
+    def _security_access(self, req):
+        if len(req) < 2:
+            return self._negative(0x27, NRC_INCORRECT_MESSAGE_LENGTH)
+        if self.session == DEFAULT_SESSION:
+            return self._negative(0x27, NRC_SERVICE_NOT_SUPPORTED_IN_SESSION)
+        level = req[1] & 0x7F
+        if level & 1:
+            if len(req) != 2:
+                return self._negative(0x27, NRC_INCORRECT_MESSAGE_LENGTH)
+            if self.unlocked == level:
+                return bytes([0x67, level, 0, 0, 0, 0])
+            self._seed = (level, os.urandom(4))
+            return bytes([0x67, level]) + self._seed[1]
+        if self._seed is None or self._seed[0] != level - 1:
+            return self._negative(0x27, NRC_REQUEST_SEQUENCE_ERROR)
+        seed_level, seed = self._seed
+        self._seed = None
+        if self.security_algo is not None:
+            key = self.security_algo(seed_level, seed, self.security_algo_params)
+            if bytes(key) != bytes(req[2:]):
+                return self._negative(0x27, NRC_INVALID_KEY)
+        self.unlocked = seed_level
+        return bytes([0x67, level])
+
+    def _communication_control(self, req):
+        if len(req) != 3:
+            return self._negative(0x28, NRC_INCORRECT_MESSAGE_LENGTH)
+        return bytes([0x68, req[1] & 0x7F])
+
+    def _tester_present(self, req):
+        if len(req) != 2:
+            return self._negative(0x3E, NRC_INCORRECT_MESSAGE_LENGTH)
+        return bytes([0x7E, req[1] & 0x7F])
+
+    def _control_dtc_setting(self, req):
+        if len(req) < 2:
+            return self._negative(0x85, NRC_INCORRECT_MESSAGE_LENGTH)
+        return bytes([0xC5, req[1] & 0x7F])
+
+    def _read_data_by_identifier(self, req):
+        if len(req) < 3 or len(req) % 2 == 0:
+            return self._negative(0x22, NRC_INCORRECT_MESSAGE_LENGTH)
+        if self.max_dids is not None and len(req) // 2 > self.max_dids:
+            return self._negative(0x22, NRC_INCORRECT_MESSAGE_LENGTH)
+        resp = bytearray([0x62])
+        for i in range(1, len(req), 2):
+            did = (req[i] << 8) | req[i + 1]
+            if did not in self.dids:
+                return self._negative(0x22, NRC_REQUEST_OUT_OF_RANGE)
+            resp += req[i:i + 2] + bytes(self.dids[did])
+        return bytes(resp)
+
+    def _write_data_by_identifier(self, req):
+        if len(req) < 4:
+            return self._negative(0x2E, NRC_INCORRECT_MESSAGE_LENGTH)
+        if self.session == DEFAULT_SESSION:
+            return self._negative(0x2E, NRC_SERVICE_NOT_SUPPORTED_IN_SESSION)
+        if not self.unlocked:
+            return self._negative(0x2E, NRC_SECURITY_ACCESS_DENIED)
+        did = (req[1] << 8) | req[2]
+        self.dids[did] = bytes(req[3:])
+        return bytes([0x6E, req[1], req[2]])
+
+    def _routine_control(self, req):
+        if len(req) < 4:
+            return self._negative(0x31, NRC_INCORRECT_MESSAGE_LENGTH)
+        subfn = req[1] & 0x7F
+        if subfn not in (1, 2, 3):
+            return self._negative(0x31, NRC_SUBFUNCTION_NOT_SUPPORTED)
+        if self.session == DEFAULT_SESSION:
+            return self._negative(0x31, NRC_SERVICE_NOT_SUPPORTED_IN_SESSION)
+        rid = (req[2] << 8) | req[3]
+        result = self.routines.get(rid, b'\x00')
+        if callable(result):
+            result = result(bytes(req[4:]))
+            if isinstance(result, int):
+                return self._negative(0x31, result)
+        if rid == ROUTINE_CHECK_DRIVER and subfn == 1:
+            self.driver_ok = True
+        return bytes([0x71, subfn, req[2], req[3]]) + bytes(result)
+
+    def _read_dtc_information(self, req):
+        if len(req) < 2:
+            return self._negative(0x19, NRC_INCORRECT_MESSAGE_LENGTH)
+        subfn = req[1] & 0x7F
+        if subfn in (0x01, 0x02):
+            if len(req) != 3:
+                return self._negative(0x19, NRC_INCORRECT_MESSAGE_LENGTH)
+            mask = req[2]
+            dtcs = [(dtc, status) for dtc, status in sorted(self.dtcs.items()) if status & mask]
+            if subfn == 0x01:
+                return struct.pack('>BBBBH', 0x59, 0x01, 0xFF, 0x01, len(dtcs))
+        elif subfn == 0x0A:
+            dtcs = sorted(self.dtcs.items())
+        else:
+            return self._negative(0x19, NRC_SUBFUNCTION_NOT_SUPPORTED)
+        resp = bytearray([0x59, subfn, 0xFF])
+        for dtc, status in dtcs:
+            resp += struct.pack('>I', dtc)[1:] + bytes([status])
+        return bytes(resp)
+
+    def _clear_diagnostic_information(self, req):
+        if len(req) != 4:
+            return self._negative(0x14, NRC_INCORRECT_MESSAGE_LENGTH)
+        group = (req[1] << 16) | (req[2] << 8) | req[3]
+        if group == 0xFFFFFF:
+            self.dtcs.clear()
+        elif group in self.dtcs:
+            del self.dtcs[group]
+        else:
+            return self._negative(0x14, NRC_REQUEST_OUT_OF_RANGE)
+        return bytes([0x54])
+
+    def _request_download(self, req):
+        if len(req) < 3:
+            return self._negative(0x34, NRC_INCORRECT_MESSAGE_LENGTH)
+        size_len = req[2] >> 4
+        addr_len = req[2] & 0x0F
+        if len(req) != 3 + addr_len + size_len or not addr_len or not size_len:
+            return self._negative(0x34, NRC_INCORRECT_MESSAGE_LENGTH)
+        if self.session != PROGRAMMING_SESSION:
+            return self._negative(0x34, NRC_CONDITIONS_NOT_CORRECT)
+        if not self.unlocked:
+            return self._negative(0x34, NRC_SECURITY_ACCESS_DENIED)
+        address = int.from_bytes(bytes(req[3:3 + addr_len]), 'big')
+        size = int.from_bytes(bytes(req[3 + addr_len:]), 'big')
+        self._download = {'address' : address, 'size' : size, 'seq' : 1, 'data' : bytearray()}
+        return bytes([0x74, 0x20]) + struct.pack('>H', self.max_block_length)
+
+    def _transfer_data(self, req):
+        if len(req) < 2:
+            return self._negative(0x36, NRC_INCORRECT_MESSAGE_LENGTH)
+        download = self._download
+        if download is None:
+            return self._negative(0x36, NRC_REQUEST_SEQUENCE_ERROR)
+        if len(req) > self.max_block_length:
+            return self._negative(0x36, NRC_INCORRECT_MESSAGE_LENGTH)
+        seq = req[1]
+        if seq == (download['seq'] - 1) & 0xFF and download['data']:
+            # repeated block, already written
+            return bytes([0x76, seq])
+        if seq != download['seq']:
+            return self._negative(0x36, NRC_WRONG_BLOCK_SEQUENCE_COUNTER)
+        if len(download['data']) + len(req) - 2 > download['size']:
+            return self._negative(0x36, NRC_UPLOAD_DOWNLOAD_NOT_ACCEPTED)
+        download['data'] += req[2:]
+        download['seq'] = (seq + 1) & 0xFF
+        return bytes([0x76, seq])
+
+    def _request_transfer_exit(self, req):
+        download = self._download
+        if download is None:
+            return self._negative(0x37, NRC_REQUEST_SEQUENCE_ERROR)
+        self._download = None
+        (self.memory if self.driver_ok else self.ram)[download['address']] = download['data']
+        return bytes([0x77])
+
+    SERVICES = {
+        0x10 : _session_control,
+        0x11 : _ecu_reset,
+        0x14 : _clear_diagnostic_information,
+        0x19 : _read_dtc_information,
+        0x22 : _read_data_by_identifier,
+        0x27 : _security_access,
+        0x28 : _communication_control,
+        0x2E : _write_data_by_identifier,
+        0x31 : _routine_control,
+        0x34 : _request_download,
+        0x36 : _transfer_data,
+        0x37 : _request_transfer_exit,
+        0x3E : _tester_present,
+        0x85 : _control_dtc_setting,
+        }
+    SUBFUNCTION_SERVICES = (0x10, 0x11, 0x19, 0x27, 0x28, 0x31, 0x3E, 0x85)
+
+
+def default_ecus(**options):
+    """
+    ESC, EPS and EPS4wd as seen by CCDiag, options are passed to every SimulatedEcu
+    """
+    dids = {
+        0xF187 : b'LEAP000187',
+        0xF188 : b'LEARAD0001',
+        0xF18A : b'CONTI',
+        0xF18B : b'\x26\x10\x18',
+        0xF18C : b'SN00000000000001',
+        0xF190 : b'LSDYNA0000000001',
+        0xF191 : b'HW00000191',
+        0xF192 : b'MK100IPB01',
+        0xF193 : b'\x01\x00',
+        0xF194 : b'LEARAD0001',
+        0xF195 : b'\x03',
+        0xF197 : b'ESC IPB ',
+        0xF198 : b'0000000000',
+        0xF199 : b'\x20\x26\x10\x18\x00\x00\x00',
+        0xF19D : b'\x20\x26\x10\x18',
+        0xF1A8 : b'\x0F',
+        }
+    dtcs = {0xC07300 : 0x09, 0x512316 : 0x08}
+    return [SimulatedEcu("ESC", 0x73E, 0x736, dids=dids, dtcs=dtcs, **options),
+            SimulatedEcu("EPS", 0x73D, 0x735, dids=dids, **options),
+            SimulatedEcu("EPS4wd", 0x7BD, 0x7B5, dids=dids, **options)]
+
+
+class EcuSimulator(object):
+    """
+    Node of a zlgcan VirtualCANBus running the ISO-TP layers of the simulated ECUs in one thread.
+    Each ECU answers on its physical rxid and on the functional id 0x7DF.
+    fd=True runs every ECU over CAN FD, else the ECUs with fd set.
+    """
+    def __init__(self, bus, ecus=None, isotp_params=None, fd=False):
+        self.bus       = bus
+        self.ecus      = ecus if ecus is not None else default_ecus()
+        self.fd        = fd
+        params = dict(ISOTP_PARAMS)
+        params.update(isotp_params or {})
+        fd_params = dict(params, tx_data_length=64, can_fd=True, bitrate_switch=True)
+        self._routes   = {}                 # can id -> [(ecu, rx queue, layer, functional)]
+        self._layers   = []
+        self._tx       = []
+        self._pending  = []                 # heap of (due, order, layer, payload)
+        self._order    = 0
+        self._wakeup   = threading.Event()
+        self._thread   = None
+        self._terminated = False
+        for ecu in self.ecus:
+            for rxid, functional in ((ecu.rxid, False), (FUNC_RX_ID, True)):
+                rx = collections.deque()
+                layer = isotp.TransportLayer(rxfn=_deque_rxfn(rx), txfn=self._tx.append,
+                                             address=isotp.Address(isotp.AddressingMode.Normal_11bits,
+                                                                   txid=ecu.txid, rxid=rxid),
+                                             params=fd_params if fd or ecu.fd else params)
+                self._routes.setdefault(rxid, []).append(rx)
+                self._layers.append((ecu, layer, functional))
+
+    def ecu(self, name):
+        for ecu in self.ecus:
+            if ecu.name == name:
+                return ecu
+        return None
+
+    def start(self):
+        self._terminated = False
+        self.bus.attach(self)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.bus.detach(self)
+        self._terminated = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def deliver(self, frames, is_fd, timestamp):
+        fmt = _CANFD_FRAME_FORMAT if is_fd else _CAN_FRAME_FORMAT
+        woken = False
+        for frame in frames:
+            can_id, dlc, *rest = fmt.unpack(frame)
+            queues = self._routes.get(can_id & 0x1FFFFFFF)
+            if queues is None or can_id & 0x60000000:
+                continue
+            msg = CanMessage(arbitration_id=can_id & 0x1FFFFFFF, dlc=dlc, data=rest[-1][:dlc],
+                             extended_id=bool(can_id >> 31), is_fd=is_fd)
+            for rx in queues:
+                rx.append(msg)
+            woken = True
+        if woken:
+            self._wakeup.set()
+
+    def _flush(self):
+        if not self._tx:
+            return
+        frames, fd_frames = [], []
+        for msg in self._tx:
+            can_id = msg.arbitration_id | (0x80000000 if msg.is_extended_id else 0)
+            if msg.is_fd:
+                flags = 1 if msg.bitrate_switch else 0
+                fd_frames.append(_CANFD_FRAME_FORMAT.pack(can_id, len(msg.data), flags, bytes(msg.data)))
+            else:
+                frames.append(_CAN_FRAME_FORMAT.pack(can_id, len(msg.data), bytes(msg.data)))
+        del self._tx[:]
+        if frames:
+            self.bus.send(self, frames, False)
+        if fd_frames:
+            self.bus.send(self, fd_frames, True)
+
+    def _run(self):
+        while not self._terminated:
+            for ecu, layer, functional in self._layers:
+                layer.process()
+                while layer.available():
+                    req = layer.recv()
+                    now = time.monotonic()
+                    for delay, resp in ecu.handle(req, functional):
+                        self._order += 1
+                        heapq.heappush(self._pending, (now + delay, self._order, layer, resp))
+
+            now = time.monotonic()
+            while self._pending and self._pending[0][0] <= now:
+                due, order, layer, resp = heapq.heappop(self._pending)
+                layer.send(resp)
+                layer.process()
+            self._flush()
+
+            timeout = min(layer.sleep_time() for ecu, layer, functional in self._layers)
+            if self._pending:
+                timeout = min(timeout, max(self._pending[0][0] - time.monotonic(), 0))
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+
+def _deque_rxfn(queue):
+    def rxfn():
+        try:
+            return queue.popleft()
+        except IndexError:
+            return None
+    return rxfn
+
+
+def start_simulator(device_index=0, can_index=0, **options):
+    """
+    EcuSimulator on the virtual bus of that ZCANVirtualDriver channel, already started
+    """
+    return EcuSimulator(virtual_bus(virtual_bus_name(device_index, can_index)), **options).start()
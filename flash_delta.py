@@ -0,0 +1,137 @@
+# -*- coding:utf-8 -*-
+#  flash_delta.py
+#
+#  ~~~~~~~~~~~~
+#
+#  Delta flashing: a record of the image last flashed on every ECU, keyed by its VIN (0xF190),
+#  holds the sha256 of each segment and the software version (0xF195) read after that flash.
+#  Before the next flash the ECU version is read back and compared to the record (reconcile);
+#  when it matches, application segments whose hash did not change are not erased nor downloaded.
+#  Flash driver segments are always downloaded, the ECU keeps them in RAM only.
+#
+#  ~~~~~~~~~~~~
+#
+import hashlib
+import json
+import os
+import re
+
+from flash_timing import phase
+from uds_session import client_p2_timeout
+
+# record directory when none is given, CCDIAG_FLASH_RECORDS overrides it
+DEFAULT_RECORD_DIR = os.path.join(os.path.expanduser("~"), ".ccdiag", "flash_records")
+RECORD_EXT         = ".json"
+
+SERIAL_DID     = 0xF18C
+VIN_DID        = 0xF190
+SW_VERSION_DID = 0xF195
+
+
+def segment_hashes(image):
+    """
+    {"boot 0x00620000": sha256 hex, "sw 0x00620000": ...}, "sw ..." are the step names of flash_journal
+    """
+    hashes = {}
+    for kind, segments in (("boot", image.boot_segments), ("sw", image.sw_segments)):
+        for seg in segments:
+            hashes["%s 0x%08X" % (kind, seg.address)] = hashlib.sha256(seg.data).hexdigest()
+    return hashes
+
+
+def read_identity(client, default_after=True):
+    """
+    (VIN string, software version list) of the ECU, read in the extended session, back to default
+    after unless default_after is False (the flash goes on in the extended session)
+    """
+    client.ensure(3, 1)
+    with client_p2_timeout(client):
+        values = client.read_data_by_identifier([VIN_DID, SW_VERSION_DID]).service_data.values
+    if default_after:
+        client.change_session(1)
+    vin = bytes(values[VIN_DID]).decode("ascii", "replace").strip("\x00 ")
+    return vin, list(values[SW_VERSION_DID])
+
+
+def read_ecu_id(client):
+    """
+    identity of the ECU for flash_journal: its serial number (0xF18C), the VIN when the serial is
+    blank. Read in the extended session like read_identity, left there for the flash
+    """
+    client.ensure(3, 1)
+    with client_p2_timeout(client):
+        values = client.read_data_by_identifier([SERIAL_DID, VIN_DID]).service_data.values
+    for did in (SERIAL_DID, VIN_DID):
+        text = bytes(values[did]).decode("ascii", "replace").strip("\x00\xff ")
+        if text:
+            return text
+    raise ValueError("ECU has neither a serial number nor a VIN")
+
+
+class FlashRecordStore(object):
+    """
+    one JSON file per VIN and ECU name: {"vin", "name", "sw_version", "segments"}
+    """
+    def __init__(self, record_dir=None):
+        self.record_dir = record_dir or os.environ.get("CCDIAG_FLASH_RECORDS", DEFAULT_RECORD_DIR)
+
+    def path(self, vin, name):
+        return os.path.join(self.record_dir, "%s_%s%s" % (re.sub(r"[^\w.-]", "_", vin), re.sub(r"[^\w.-]", "_", name), RECORD_EXT))
+
+    def load(self, vin, name):
+        try:
+            with open(self.path(vin, name), "r") as fd:
+                return json.load(fd)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, vin, name, sw_version, hashes):
+        os.makedirs(self.record_dir, exist_ok=True)
+        path = self.path(vin, name)
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, "w") as fd:
+            json.dump({"vin": vin, "name": name, "sw_version": sw_version, "segments": hashes}, fd, indent=4)
+        os.replace(tmp_path, path)
+
+    def forget(self, vin, name):
+        if os.path.exists(self.path(vin, name)):
+            os.remove(self.path(vin, name))
+
+
+class DeltaPlan(object):
+    """
+    what to flash on one ECU: unchanged holds the "sw 0x..." steps to skip, reason says why a full flash is needed
+    """
+    def __init__(self, vin, hashes, unchanged=(), reason=None):
+        self.vin       = vin
+        self.hashes    = hashes
+        self.unchanged = set(unchanged)
+        self.reason    = reason
+
+
+def plan(client, image, name, store, report=None):
+    """
+    reconcile the ECU against its record and return the DeltaPlan of image.
+    The record is dropped: until commit() the ECU content is unknown
+    """
+    hashes = segment_hashes(image)
+    with phase(report, "reconcile"):
+        vin, sw_version = read_identity(client, default_after=False)
+    record = store.load(vin, name)
+    store.forget(vin, name)
+    if record is None:
+        return DeltaPlan(vin, hashes, reason="no record for %s" % vin)
+    if record.get("sw_version") != sw_version:
+        return DeltaPlan(vin, hashes, reason="ECU version %s, record %s" % (sw_version, record.get("sw_version")))
+    previous = record.get("segments", {})
+    unchanged = [step for step, digest in hashes.items() if step.startswith("sw ") and previous.get(step) == digest]
+    return DeltaPlan(vin, hashes, unchanged)
+
+
+def commit(client, delta_plan, name, store, report=None):
+    """
+    after a complete flash: read the new ECU version back and record the image as its baseline
+    """
+    with phase(report, "record"):
+        vin, sw_version = read_identity(client)
+    store.save(vin, name, sw_version, delta_plan.hashes)
@@ -0,0 +1,110 @@
+# -*- coding:utf-8 -*-
+#  flash_journal.py
+#
+#  ~~~~~~~~~~~~
+#
+#  Segment level checkpoints of a flash run, so a failed ESC flash resumes at the first step
+#  that did not complete instead of rewriting every segment. One small JSON file per ECU, found by
+#  its identity (serial number or VIN, flash_delta.read_ecu_id) so another ECU put on the same
+#  channel starts over. It holds the image it was written for, rewritten atomically after every
+#  step, removed when the flash completed.
+#
+#  steps: "erase 0x00620000" routine 0xFF00 erased the area of the application segment
+#         "sw 0x00620000"    application segment downloaded
+#  an application segment whose download started but did not complete is erased again on resume.
+#  The flash driver (boot segments) lives in ECU RAM and the checksum routine 0x0202 activates it,
+#  both are not journaled and run again on every resume
+#
+#  ~~~~~~~~~~~~
+#
+import json
+import os
+import re
+
+import flash_package
+
+# journal directory when none is given, CCDIAG_FLASH_JOURNAL overrides it
+DEFAULT_JOURNAL_DIR = os.path.join(os.path.expanduser("~"), ".ccdiag", "flash_journal")
+JOURNAL_EXT         = ".journal"
+
+
+def image_key(image):
+    """
+    key of a FlashPackage or uds_flash.FlashImage, the sha256 of its source files
+    """
+    key = getattr(image, "key", None)
+    if key is None:
+        key = flash_package.package_key(flash_package.file_sha256(image.sw_path),
+                                        flash_package.file_sha256(image.boot_path))
+    return key
+
+
+class FlashJournal(object):
+    """
+    done and started steps of one flash run of image (key) on ECU ecu_id, persisted in path
+    """
+    def __init__(self, path, key, ecu_id):
+        self.path    = path
+        self.key     = key
+        self.ecu_id  = ecu_id
+        self.done    = []
+        self.started = []
+        self.skipped = []                   # steps skipped by this run
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as fd:
+                    state = json.load(fd)
+                if state.get("key") == key and state.get("ecu_id") == ecu_id:
+                    self.done = list(state.get("done", []))
+                    self.started = list(state.get("started", []))
+            except (ValueError, OSError) as e:
+                print("INFO: ignore flash journal %s, %s" % (path, e))
+
+    @property
+    def resuming(self):
+        return bool(self.done)
+
+    def is_done(self, step):
+        if step in self.done:
+            self.skipped.append(step)
+            return True
+        return False
+
+    def was_started(self, step):
+        return step in self.started
+
+    def begin(self, step):
+        if step not in self.started:
+            self.started.append(step)
+            self._save()
+
+    def complete(self, step):
+        if step not in self.done:
+            self.done.append(step)
+            self._save()
+
+    def clear(self):
+        self.done = []
+        self.started = []
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _save(self):
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmp_path, "w") as fd:
+            json.dump({"key": self.key, "ecu_id": self.ecu_id, "done": self.done, "started": self.started}, fd, indent=4)
+        os.replace(tmp_path, self.path)
+
+
+def open_journal(image, name, ecu_id, journal_dir=None, resume=True):
+    """
+    FlashJournal of image on the ECU name ("ESC") with identity ecu_id, resume=False starts over.
+    The journal of another image on that ECU is not resumed
+    """
+    journal_dir = journal_dir or os.environ.get("CCDIAG_FLASH_JOURNAL", DEFAULT_JOURNAL_DIR)
+    os.makedirs(journal_dir, exist_ok=True)
+    path = os.path.join(journal_dir, "%s_%s%s" % (re.sub(r"[^\w.-]", "_", name), re.sub(r"[^\w.-]", "_", ecu_id), JOURNAL_EXT))
+    journal = FlashJournal(path, image_key(image), ecu_id)
+    if not resume:
+        journal.clear()
+    return journal
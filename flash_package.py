@@ -0,0 +1,225 @@
+# -*- coding:utf-8 -*-
+#  flash_package.py
+#
+#  ~~~~~~~~~~~~
+#
+#  Compiled flash package: application and flash driver .s19 parsed once into a segment table
+#  (address, size, offset, CRC32) followed by one contiguous binary blob. Flash runs mmap the
+#  package and stream TransferData blocks straight out of it. Packages are cached on disk under
+#  the sha256 of their source files, repeated EOL runs never parse S-records again.
+#
+#  layout, little endian:
+#    header   "CCFP" version:u16 boot_count:u16 sw_count:u16 reserved:u16 sw_sha256:32s boot_sha256:32s
+#    table    boot segments then sw segments, address:u32 size:u32 offset:u32 crc32:u32
+#    blob     segment data, offsets are from the start of the file
+#
+#  usage: python flash_package.py --sw LEARAD00012.s19 --boot LEDRAA00003.s19 [--cache-dir dir]
+#
+#  ~~~~~~~~~~~~
+#
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+import srecord
+import uds_flash
+
+PACKAGE_MAGIC   = b"CCFP"
+PACKAGE_VERSION = 1
+PACKAGE_EXT     = ".ccfp"
+HEADER_FORMAT   = "<4sHHHH32s32s"
+SEGMENT_FORMAT  = "<IIII"
+HEADER_SIZE     = struct.calcsize(HEADER_FORMAT)
+SEGMENT_SIZE    = struct.calcsize(SEGMENT_FORMAT)
+# segment data starts on this alignment inside the blob
+BLOB_ALIGN      = 16
+
+# cache directory when none is given, CCDIAG_FLASH_CACHE overrides it
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".ccdiag", "flash_cache")
+HASH_CHUNK        = 1 << 20
+
+
+class FlashPackageError(ValueError):
+    """
+    raised on a malformed package or a segment whose CRC32 does not match
+    """
+
+
+class PackageSegment(srecord.Segment):
+    """
+    segment of a package, data is a read only memoryview on the mapped file
+    """
+    __slots__ = ('crc',)
+
+    def __init__(self, address, data, crc):
+        srecord.Segment.__init__(self, address, data)
+        self.crc = crc
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as fd:
+        for chunk in iter(lambda: fd.read(HASH_CHUNK), b""):
+            sha.update(chunk)
+    return sha.digest()
+
+
+def package_key(sw_sha256, boot_sha256):
+    """
+    hex key of a .s19 pair, names the cached package and the flash journals of that pair
+    """
+    return hashlib.sha256(sw_sha256 + boot_sha256).hexdigest()
+
+
+def _align(n):
+    return (n + BLOB_ALIGN - 1) & ~(BLOB_ALIGN - 1)
+
+
+def build_package(sw_path, boot_path, out_path, sw_sha256=None, boot_sha256=None):
+    """
+    parse both .s19 files and write the package to out_path, atomically
+    """
+    boot_segments = srecord.load_segments(boot_path)
+    sw_segments = srecord.load_segments(sw_path)
+    segments = boot_segments + sw_segments
+
+    table = []
+    offset = _align(HEADER_SIZE + SEGMENT_SIZE * len(segments))
+    for seg in segments:
+        table.append(struct.pack(SEGMENT_FORMAT, seg.address, seg.size, offset, zlib.crc32(seg.data) & 0xFFFFFFFF))
+        offset = _align(offset + seg.size)
+
+    tmp_path = "%s.%d.tmp" % (out_path, os.getpid())
+    with open(tmp_path, "wb") as fd:
+        fd.write(struct.pack(HEADER_FORMAT, PACKAGE_MAGIC, PACKAGE_VERSION, len(boot_segments), len(sw_segments), 0,
+                             sw_sha256 or file_sha256(sw_path), boot_sha256 or file_sha256(boot_path)))
+        fd.write(b"".join(table))
+        for seg in segments:
+            fd.write(b"\0" * (_align(fd.tell()) - fd.tell()))
+            fd.write(seg.data)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+class FlashPackage(object):
+    """
+    mapped package, same interface as uds_flash.FlashImage for flash_leap_esc().
+    Blocks are cut from the mapping on the fly, so many readers of one package share the page cache.
+    """
+    def __init__(self, path, verify=True, sw_path=None, boot_path=None):
+        self.path      = path
+        self.sw_path   = sw_path or path
+        self.boot_path = boot_path or path
+        with open(path, "rb") as fd:
+            self._mmap = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._view = memoryview(self._mmap)
+            self._parse()
+            if verify:
+                self.verify()
+        except Exception:
+            self.close()
+            raise
+
+    def _parse(self):
+        if len(self._mmap) < HEADER_SIZE:
+            raise FlashPackageError("%s: truncated header" % self.path)
+        magic, version, boot_count, sw_count, _, self.sw_sha256, self.boot_sha256 = \
+            struct.unpack_from(HEADER_FORMAT, self._mmap, 0)
+        if magic != PACKAGE_MAGIC or version != PACKAGE_VERSION:
+            raise FlashPackageError("%s: not a version %d flash package" % (self.path, PACKAGE_VERSION))
+        segments = []
+        for i in range(boot_count + sw_count):
+            address, size, offset, crc = struct.unpack_from(SEGMENT_FORMAT, self._mmap, HEADER_SIZE + i * SEGMENT_SIZE)
+            if offset + size > len(self._mmap):
+                raise FlashPackageError("%s: segment 0x%08X is out of the file" % (self.path, address))
+            segments.append(PackageSegment(address, self._view[offset:offset + size], crc))
+        self.boot_segments = segments[:boot_count]
+        self.sw_segments = segments[boot_count:]
+
+    def verify(self):
+        for seg in self.boot_segments + self.sw_segments:
+            if zlib.crc32(seg.data) & 0xFFFFFFFF != seg.crc:
+                raise FlashPackageError("%s: CRC32 mismatch in segment 0x%08X" % (self.path, seg.address))
+
+    @property
+    def size(self):
+        """
+        bytes downloaded to one ECU
+        """
+        return sum(seg.size for seg in self.sw_segments) + sum(seg.size for seg in self.boot_segments)
+
+    @property
+    def key(self):
+        return package_key(self.sw_sha256, self.boot_sha256)
+
+    def download(self, udsclient, memory_location, segment, **options):
+        uds_flash.download_segment(udsclient, memory_location, segment.data, **options)
+
+    def close(self):
+        if self._mmap is None:
+            return
+        for seg in getattr(self, "boot_segments", []) + getattr(self, "sw_segments", []):
+            seg.data.release()
+        self.boot_segments = self.sw_segments = []
+        if getattr(self, "_view", None) is not None:
+            self._view.release()
+            self._view = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            # blocks of a failed transfer are still referenced by its traceback, the map goes with them
+            pass
+        self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def cache_path(sw_path, boot_path, cache_dir=None):
+    """
+    package file of these sources in the cache, keyed by the sha256 of both files
+    """
+    cache_dir = cache_dir or os.environ.get("CCDIAG_FLASH_CACHE", DEFAULT_CACHE_DIR)
+    return os.path.join(cache_dir, package_key(file_sha256(sw_path), file_sha256(boot_path)) + PACKAGE_EXT)
+
+
+def load_package(sw_path, boot_path, cache_dir=None, verify=True):
+    """
+    FlashPackage of the .s19 pair, built and cached on the first call only
+    """
+    path = cache_path(sw_path, boot_path, cache_dir)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        build_package(sw_path, boot_path, path)
+    try:
+        return FlashPackage(path, verify, sw_path, boot_path)
+    except FlashPackageError as e:
+        print("INFO: rebuild flash package, %s" % e)
+        build_package(sw_path, boot_path, path)
+        return FlashPackage(path, verify, sw_path, boot_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="build or check the cached flash package of a .s19 pair")
+    parser.add_argument("--sw", required=True, help="application .s19")
+    parser.add_argument("--boot", required=True, help="flash driver .s19")
+    parser.add_argument("--cache-dir", default=None)
+    args = parser.parse_args(argv)
+    with load_package(args.sw, args.boot, args.cache_dir) as package:
+        print(package.path)
+        for kind, segments in (("boot", package.boot_segments), ("sw", package.sw_segments)):
+            for seg in segments:
+                print("%-4s 0x%08X %8d  crc32 %08X" % (kind, seg.address, seg.size, seg.crc))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
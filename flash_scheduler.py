@@ -0,0 +1,307 @@
+# -*- coding:utf-8 -*-
+#  flash_scheduler.py
+#
+#  ~~~~~~~~~~~~
+#
+#  End of line flashing: N channels across one or more devices (PCIE-CANFD-400U, USBCAN-8E-U, ...)
+#  flash N vehicles in parallel, one worker thread per channel, one shared mapped FlashPackage
+#
+#  usage: python flash_scheduler.py --sw LEARAD00012.s19 --boot LEDRAA00003.s19
+#                                   --channel PCIE-CANFD-400U:0:0 --channel PCIE-CANFD-400U:0:1 ...
+#         python flash_scheduler.py --sw ... --boot ... --channel ZCAN-VIRTUAL:0:0-7   (simulated ECUs)
+#
+#  ~~~~~~~~~~~~
+#
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from zlgcan import *
+import ecu_sim
+import flash_delta
+import flash_journal
+import flash_package
+from flash_timing import FlashTimingReport
+from zcan_isotp import ZCANDispatcher
+from ccdiag_engine import (CCDiagEngine, CCDiagError, DiagTarget, ISOTP_PARAMS, SECURITY_ALGO_PARAMS,
+                           client_config, flash_leap_esc, sec_algo, start_channel)
+
+
+def parse_channels(text):
+    """
+    "DEVICE:index:channel" or "DEVICE:index:first-last" -> list of (device, index, channel)
+    """
+    dev_name, dev_index, chns = text.rsplit(":", 2)
+    first, _, last = chns.partition("-")
+    return [(dev_name, int(dev_index), chn) for chn in range(int(first), int(last or first) + 1)]
+
+
+class ChannelResult(object):
+    """
+    outcome of one channel: start/elapsed in seconds from the start of the run, bytes downloaded
+    """
+    __slots__ = ('dev_name', 'dev_index', 'chn_index', 'ok', 'error', 'start', 'elapsed', 'bytes', 'timing')
+
+    def __init__(self, dev_name, dev_index, chn_index):
+        self.dev_name  = dev_name
+        self.dev_index = dev_index
+        self.chn_index = chn_index
+        self.ok        = False
+        self.error     = None
+        self.start     = 0.0
+        self.elapsed   = 0.0
+        self.bytes     = 0
+        self.timing    = None               # flash_timing.FlashTimingReport
+
+    @property
+    def throughput(self):
+        """
+        bytes/s of this channel
+        """
+        return self.bytes / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class FlashReport(object):
+    """
+    per channel results and aggregate throughput of one parallel flashing run
+    """
+    def __init__(self, image, results, wall_time):
+        self.image     = image
+        self.results   = results
+        self.wall_time = wall_time
+
+    @property
+    def passed(self):
+        return sum(1 for r in self.results if r.ok)
+
+    @property
+    def total_bytes(self):
+        return sum(r.bytes for r in self.results)
+
+    @property
+    def throughput(self):
+        """
+        bytes/s downloaded by all channels together
+        """
+        return self.total_bytes / self.wall_time if self.wall_time > 0 else 0.0
+
+    def lines(self):
+        yield "%-18s %3s %3s  %-6s %9s %9s %10s  %s" % ("device", "idx", "chn", "result", "start s", "time s", "kB/s", "error")
+        for r in self.results:
+            yield "%-18s %3d %3d  %-6s %9.2f %9.2f %10.1f  %s" % (
+                r.dev_name, r.dev_index, r.chn_index, "OK" if r.ok else "FAIL", r.start, r.elapsed,
+                r.throughput / 1024, "" if r.error is None else r.error)
+        yield "%d/%d channel(s) flashed, %d bytes each, %.2f s, aggregate %.1f kB/s" % (
+            self.passed, len(self.results), self.image.size, self.wall_time, self.throughput / 1024)
+
+    def to_dict(self):
+        return {
+            "image"       : {"sw": self.image.sw_path, "boot": self.image.boot_path, "bytes": self.image.size},
+            "wall_time"   : self.wall_time,
+            "total_bytes" : self.total_bytes,
+            "throughput"  : self.throughput,
+            "channels"    : [{"device": r.dev_name, "index": r.dev_index, "channel": r.chn_index, "ok": r.ok,
+                              "error": r.error, "start": r.start, "elapsed": r.elapsed, "bytes": r.bytes,
+                              "timing": r.timing.to_dict() if r.timing is not None else None}
+                             for r in self.results],
+            }
+
+
+class _Station(object):
+    """
+    one opened channel: dispatcher, DiagTarget of the flashed ECU, simulator on virtual devices
+    """
+    def __init__(self, dev_name, dev_index, chn_index):
+        self.dev_name   = dev_name
+        self.dev_index  = dev_index
+        self.chn_index  = chn_index
+        self.zcan       = None
+        self.chn_handle = INVALID_CHANNEL_HANDLE
+        self.dispatcher = None
+        self.target     = None
+        self.sim        = None
+
+    def close(self):
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+            self.dispatcher = None
+            self.target.close()
+        if self.sim is not None:
+            self.sim.stop()
+            self.sim = None
+        if self.chn_handle != INVALID_CHANNEL_HANDLE:
+            self.zcan.ResetCAN(self.chn_handle)
+            self.chn_handle = INVALID_CHANNEL_HANDLE
+
+
+class FlashScheduler(object):
+    """
+    Opens every channel of channels, a list of (device name, device index, channel), each device once,
+    and flashes the ECU behind all of them at the same time with one worker thread per channel.
+    open()/close() raise CCDiagError, a failing channel does not stop the others, it is reported.
+    fd=True flashes over ISO-TP on CAN FD on the channels that are FD, classic CAN on the others.
+    """
+    def __init__(self, channels, dev_info_path="./dev_info.json", backend=None, baudrate="500K",
+                 data_baudrate=None, resistance=True, target="ESC", isotp_params=None, fd=False):
+        with open(dev_info_path, "r") as f:
+            self.dev_info = json.load(f)
+        self.channels      = list(channels)
+        self.backend       = backend
+        self.baudrate      = baudrate
+        self.data_baudrate = data_baudrate
+        self.resistance    = resistance
+        self.target        = target
+        self.fd            = fd
+        self.isotp_params  = dict(isotp_params or ISOTP_PARAMS)
+        self.client_config = client_config()
+        # N channels share one host: keep the client P2 (1 s) instead of the 50 ms the ECU announces
+        self.client_config['use_server_timing'] = False
+        self.flash_records = flash_delta.FlashRecordStore()
+        self._hw_zcan      = None
+        self._virtual_zcan = None
+        self._devices      = {}             # (dev_name, dev_index) -> (zcan, dev_handle)
+        self._stations     = []
+
+    def _device(self, dev_name, dev_index):
+        key = (dev_name, dev_index)
+        if key not in self._devices:
+            dev_info = self.dev_info[dev_name]
+            if dev_info["dev_type"] == ZCAN_VIRTUAL_DEVICE.value:
+                if self._virtual_zcan is None:
+                    self._virtual_zcan = ZCANVirtualDriver()
+                zcan = self._virtual_zcan
+            else:
+                if self._hw_zcan is None:
+                    self._hw_zcan = open_backend(self.backend)
+                zcan = self._hw_zcan
+            dev_handle = zcan.OpenDevice(dev_info["dev_type"], dev_index, 0)
+            if dev_handle == INVALID_DEVICE_HANDLE:
+                raise CCDiagError("open device %s %d failed" % (dev_name, dev_index))
+            self._devices[key] = (zcan, dev_handle)
+        return self._devices[key]
+
+    def open(self):
+        try:
+            for dev_name, dev_index, chn_index in self.channels:
+                zcan, dev_handle = self._device(dev_name, dev_index)
+                dev_info = self.dev_info[dev_name]
+                if chn_index >= dev_info["chn_num"]:
+                    raise CCDiagError("%s has no channel %d" % (dev_name, chn_index))
+                station = _Station(dev_name, dev_index, chn_index)
+                station.zcan = zcan
+                station.chn_handle = start_channel(zcan, dev_handle, dev_info, chn_index, 0, self.baudrate,
+                                                   self.data_baudrate, self.resistance)
+                self._stations.append(station)
+                is_canfd = dev_info["chn_info"]["is_canfd"]
+                if dev_info["dev_type"] == ZCAN_VIRTUAL_DEVICE.value:
+                    ecus = ecu_sim.default_ecus(security_algo=sec_algo, security_algo_params=SECURITY_ALGO_PARAMS)
+                    for ecu in ecus:
+                        ecu.fd = self.fd and is_canfd and ecu.name == self.target
+                        # one unit per channel, each with its own serial number (flash journal)
+                        ecu.dids[0xF18C] = ("SN%06d%08d" % (dev_index, chn_index + 1)).encode("ascii")
+                    station.sim = ecu_sim.start_simulator(dev_index, chn_index, ecus=ecus)
+                station.target = DiagTarget(self.target, CCDiagEngine.ADDRESSES[self.target],
+                                            self.isotp_params, self.client_config)
+                station.target.set_fd(self.fd and is_canfd)
+                station.target.open(zcan, station.chn_handle)
+                station.dispatcher = ZCANDispatcher(zcan, station.chn_handle, fd=is_canfd)
+                station.dispatcher.attach(station.target.rx_queue)
+                station.dispatcher.start()
+        except Exception:
+            self.close()
+            raise
+        return self
+
+    def close(self):
+        for station in self._stations:
+            station.close()
+        self._stations = []
+        for zcan, dev_handle in self._devices.values():
+            zcan.CloseDevice(dev_handle)
+        self._devices = {}
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def run(self, image, flash=flash_leap_esc, resume=True, delta=False, **options):
+        """
+        flash(udsclient, image, report=..., journal=..., unchanged=..., **options) on every channel at once,
+        FlashReport when all of them are done, every channel result has the flash_timing.FlashTimingReport
+        of its phases. Each ECU has its flash_journal, resume=False starts every channel over.
+        delta: reconcile every ECU with its flash_delta record, skip its unchanged application segments
+        """
+        results = [ChannelResult(s.dev_name, s.dev_index, s.chn_index) for s in self._stations]
+        t0 = time.perf_counter()
+
+        def worker(station, result):
+            result.start = time.perf_counter() - t0
+            name = "%s/%d/%d" % (station.dev_name, station.dev_index, station.chn_index)
+            result.timing = FlashTimingReport(name, counters=station.target.counters).start()
+            try:
+                with result.timing.phase("identify"):
+                    ecu_id = flash_delta.read_ecu_id(station.target.udsclient)
+                journal = flash_journal.open_journal(image, station.target.name, ecu_id, resume=resume)
+                result.timing.skipped = journal.skipped
+                delta_plan = None
+                if delta:
+                    delta_plan = flash_delta.plan(station.target.udsclient, image, name, self.flash_records, result.timing)
+                flash(station.target.udsclient, image, report=result.timing, journal=journal,
+                      unchanged=delta_plan.unchanged if delta_plan is not None else (), **options)
+                if delta_plan is not None:
+                    flash_delta.commit(station.target.udsclient, delta_plan, name, self.flash_records, result.timing)
+                result.ok = True
+                result.bytes = image.size
+                result.timing.finish()
+            except Exception as e:
+                result.error = repr(e)
+                result.timing.finish(False, "%s: %s" % (result.timing.phases[-1].name if result.timing.phases else "flash", e))
+            result.elapsed = time.perf_counter() - t0 - result.start
+
+        with ThreadPoolExecutor(max_workers=max(len(self._stations), 1)) as executor:
+            for f in [executor.submit(worker, s, r) for s, r in zip(self._stations, results)]:
+                f.result()
+        return FlashReport(image, results, time.perf_counter() - t0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="parallel end of line flashing")
+    parser.add_argument("--sw", required=True, help="application .s19")
+    parser.add_argument("--boot", required=True, help="flash driver .s19")
+    parser.add_argument("--channel", action="append", required=True, type=parse_channels,
+                        help="DEVICE:index:channel or DEVICE:index:first-last, repeat for more channels")
+    parser.add_argument("--baudrate", default="500K")
+    parser.add_argument("--data-baudrate", default=None)
+    parser.add_argument("--no-resistance", action="store_true")
+    parser.add_argument("--backend", default=None, help="dll, linux, socketcan or virtual, see zlgcan.open_backend")
+    parser.add_argument("--pipeline", action="store_true", help="pipelined TransferData, see uds_flash.download_segment")
+    parser.add_argument("--delta", action="store_true", help="skip the application segments unchanged since the last delta flash")
+    parser.add_argument("--fd", action="store_true", help="ISO-TP over CAN FD on the CAN FD channels")
+    parser.add_argument("--no-resume", action="store_true", help="ignore the flash journals, flash every segment")
+    parser.add_argument("--cache-dir", default=None, help="flash package cache, see flash_package.load_package")
+    parser.add_argument("--json", default=None, help="write the report to this file")
+    args = parser.parse_args(argv)
+
+    scheduler = FlashScheduler([c for chns in args.channel for c in chns], backend=args.backend,
+                               baudrate=args.baudrate, data_baudrate=args.data_baudrate,
+                               resistance=not args.no_resistance, fd=args.fd)
+    with flash_package.load_package(args.sw, args.boot, args.cache_dir) as image:
+        try:
+            with scheduler:
+                report = scheduler.run(image, resume=not args.no_resume, delta=args.delta, pipeline=args.pipeline)
+        except CCDiagError as e:
+            print("ERROR: %s" % e)
+            return 1
+        for line in report.lines():
+            print(line)
+        if args.json:
+            with open(args.json, "w") as fd:
+                json.dump(report.to_dict(), fd, indent=4)
+    return 0 if report.passed == len(report.results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
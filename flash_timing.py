@@ -0,0 +1,190 @@
+# -*- coding:utf-8 -*-
+#  flash_timing.py
+#
+#  ~~~~~~~~~~~~
+#
+#  Per-phase timing of one ECU flash run: parse, pre-programming, security access, every
+#  RequestDownload / TransferData / TransferExit, checksum routine, reset, with bytes/s,
+#  CAN frame counts and retries. Emitted as JSON and as a summary table.
+#
+#  ~~~~~~~~~~~~
+#
+import contextlib
+import json
+import time
+
+
+class TransferTiming(object):
+    """
+    per block seconds of TransferData downloads:
+    prep     host time to cut and encode the request (off the critical path when pipelined)
+    stall    time the sender waited for a prepared request, 0 when the pipeline keeps up
+    bus      request sent until the isotp layer finished transmitting it
+    ecu_wait end of transmission until the response was received
+    bus is only measured on connections with tx_done_time (IsoTpConnection), else it is in ecu_wait
+    """
+    FIELDS = ('prep', 'stall', 'bus', 'ecu_wait')
+
+    def __init__(self):
+        self.blocks = []
+
+    def add(self, prep, stall, bus, ecu_wait):
+        self.blocks.append((prep, stall, bus, ecu_wait))
+
+    def totals(self):
+        return dict(zip(self.FIELDS, (sum(col) for col in zip(*self.blocks)) if self.blocks else (0.0,) * 4))
+
+    def lines(self):
+        n = max(len(self.blocks), 1)
+        totals = self.totals()
+        yield "%d TransferData block(s)" % len(self.blocks)
+        for name in self.FIELDS:
+            yield "  %-9s %10.1f ms  %8.1f us/block" % (name, totals[name] * 1e3, totals[name] / n * 1e6)
+
+
+class FlashPhase(object):
+    """
+    one timed step, start is in seconds from the start of the run
+    """
+    __slots__ = ('name', 'segment', 'start', 'elapsed', 'bytes', 'ok')
+
+    def __init__(self, name, segment, start, nbytes):
+        self.name    = name
+        self.segment = segment
+        self.start   = start
+        self.elapsed = 0.0
+        self.bytes   = nbytes
+        self.ok      = False
+
+    def to_dict(self):
+        return {"name": self.name, "segment": self.segment, "start": self.start, "elapsed": self.elapsed,
+                "bytes": self.bytes, "ok": self.ok}
+
+
+@contextlib.contextmanager
+def _no_phase():
+    yield None
+
+
+def phase(report, name, nbytes=0, segment=None):
+    """
+    report.phase(...) or a context doing nothing when report is None
+    """
+    if report is None:
+        return _no_phase()
+    return report.phase(name, nbytes, segment)
+
+
+class FlashTimingReport(object):
+    """
+    Phases of one flash run in order. counters() is called at start() and finish(), the report
+    keeps the difference (CAN frames sent/received, send errors, 0x78 response pending), see
+    DiagTarget.counters. Every downloaded segment has a TransferTiming of its blocks.
+    """
+    def __init__(self, name="", counters=None):
+        self.name      = name
+        self.phases    = []
+        self.transfers = []                 # (segment, TransferTiming)
+        self.skipped   = []                 # flash_journal steps done by a previous run
+        self.counters  = {}
+        self.ok        = False
+        self.error     = None
+        self.elapsed   = 0.0
+        self._counters = counters
+        self._start    = None
+        self._t0       = time.perf_counter()
+
+    def start(self):
+        self._t0 = time.perf_counter()
+        self._start = self._counters() if self._counters is not None else {}
+        return self
+
+    def finish(self, ok=True, error=None):
+        self.elapsed = time.perf_counter() - self._t0
+        self.ok = ok
+        self.error = error
+        if self._counters is not None:
+            end = self._counters()
+            self.counters = dict((k, end[k] - self._start.get(k, 0)) for k in end)
+
+    @contextlib.contextmanager
+    def phase(self, name, nbytes=0, segment=None):
+        p = FlashPhase(name, segment, time.perf_counter() - self._t0, nbytes)
+        self.phases.append(p)
+        try:
+            yield p
+            p.ok = True
+        finally:
+            p.elapsed = time.perf_counter() - self._t0 - p.start
+
+    def transfer(self, segment):
+        """
+        new TransferTiming for the blocks of segment ("0x00620000")
+        """
+        timing = TransferTiming()
+        self.transfers.append((segment, timing))
+        return timing
+
+    @property
+    def bytes(self):
+        return sum(p.bytes for p in self.phases if p.name == "TransferData" and p.ok)
+
+    @property
+    def throughput(self):
+        return self.bytes / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        """
+        phases grouped by name in first seen order: [(name, count, seconds, bytes)]
+        """
+        groups = {}
+        order = []
+        for p in self.phases:
+            if p.name not in groups:
+                groups[p.name] = [0, 0.0, 0]
+                order.append(p.name)
+            g = groups[p.name]
+            g[0] += 1
+            g[1] += p.elapsed
+            g[2] += p.bytes
+        return [(name,) + tuple(groups[name]) for name in order]
+
+    def to_dict(self):
+        return {
+            "name"       : self.name,
+            "ok"         : self.ok,
+            "error"      : self.error,
+            "elapsed"    : self.elapsed,
+            "bytes"      : self.bytes,
+            "throughput" : self.throughput,
+            "counters"   : self.counters,
+            "skipped"    : list(self.skipped),
+            "phases"     : [p.to_dict() for p in self.phases],
+            "transfers"  : [{"segment": segment, "blocks": len(timing.blocks), "totals": timing.totals(),
+                             "block_max": max((sum(b) - b[0] for b in timing.blocks), default=0.0)}
+                            for segment, timing in self.transfers],
+            }
+
+    def dump(self, path):
+        with open(path, "w") as fd:
+            json.dump(self.to_dict(), fd, indent=4)
+
+    def lines(self):
+        total = self.elapsed or 1.0
+        yield "%s flash %s in %.2f s, %d bytes, %.1f kB/s" % (
+            self.name, "OK" if self.ok else "FAIL (%s)" % self.error, self.elapsed, self.bytes, self.throughput / 1024)
+        if self.skipped:
+            yield "resumed, skipped: %s" % ", ".join(self.skipped)
+        yield "%-20s %5s %10s %6s %10s %10s" % ("phase", "count", "time ms", "%", "bytes", "kB/s")
+        for name, count, seconds, nbytes in self.summary():
+            yield "%-20s %5d %10.1f %6.1f %10s %10s" % (
+                name, count, seconds * 1e3, seconds / total * 100, nbytes or "",
+                "%.1f" % (nbytes / seconds / 1024) if nbytes and seconds > 0 else "")
+        if self.transfers:
+            yield "%-20s %6s %10s %10s %10s %10s" % ("segment", "blocks", "prep ms", "stall ms", "bus ms", "ecu ms")
+            for segment, timing in self.transfers:
+                t = timing.totals()
+                yield "%-20s %6d %10.1f %10.1f %10.1f %10.1f" % (
+                    segment, len(timing.blocks), t['prep'] * 1e3, t['stall'] * 1e3, t['bus'] * 1e3, t['ecu_wait'] * 1e3)
+        if self.counters:
+            yield "  ".join("%s:%d" % (k, v) for k, v in sorted(self.counters.items()))
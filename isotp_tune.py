@@ -0,0 +1,172 @@
+# -*- coding:utf-8 -*-
+#  isotp_tune.py
+#
+#  ~~~~~~~~~~~~
+#
+#  STmin/blocksize auto-tuning of the flow control CCDiag sends to an ECU. The STmin and blocksize
+#  of ISOTP_PARAMS throttle every multi-frame response of the ECU (DTC reads, large 0x22 reads).
+#  tune() times a long multi-DID read with STmin stepped down, then blocksize stepped up, until a
+#  step loses or corrupts responses, and keeps the fastest step that passed (STmin=0/BS=0 when
+#  the ECU and the host keep up). The result is cached per ECU name in one JSON file and applied
+#  when the channel is opened.
+#
+#  ~~~~~~~~~~~~
+#
+import json
+import os
+import time
+
+from udsoncan import Request, services
+
+from uds_session import client_p2_timeout
+
+# cache file when none is given, CCDIAG_ISOTP_TUNE overrides it
+DEFAULT_TUNE_PATH = os.path.join(os.path.expanduser("~"), ".ccdiag", "isotp_tune.json")
+
+# tried in this order, each only after the previous one passed. 0xF1-0xF9 are 100-900 us
+STMIN_STEPS     = (20, 10, 5, 2, 1, 0xF5, 0)
+BLOCKSIZE_STEPS = (16, 32, 0)
+# probe: VIN read this many times in one 0x22 request, 19 bytes each
+PROBE_DID       = 0xF190
+PROBE_COPIES    = 10
+PROBE_ROUNDS    = 3
+
+
+def stmin_text(stmin):
+    if 0xF1 <= stmin <= 0xF9:
+        return "%dus" % ((stmin - 0xF0) * 100)
+    return "%dms" % stmin
+
+
+class IsoTpTuneStore(object):
+    """
+    one JSON file {ECU name: {"stmin", "blocksize", "baseline", "throughput"}}
+    """
+    def __init__(self, path=None):
+        self.path = path or os.environ.get("CCDIAG_ISOTP_TUNE", DEFAULT_TUNE_PATH)
+
+    def _load_all(self):
+        try:
+            with open(self.path, "r") as fd:
+                return json.load(fd)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_all(self, entries):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmp_path, "w") as fd:
+            json.dump(entries, fd, indent=4, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def load(self, name):
+        return self._load_all().get(name)
+
+    def save(self, name, result):
+        entries = self._load_all()
+        entries[name] = {"stmin": result.stmin, "blocksize": result.blocksize,
+                         "baseline": result.baseline, "throughput": result.throughput}
+        self._save_all(entries)
+
+    def forget(self, name):
+        entries = self._load_all()
+        if entries.pop(name, None) is not None:
+            self._save_all(entries)
+
+
+class TuneResult(object):
+    """
+    stmin/blocksize kept, baseline/throughput in response bytes per second with the flow control
+    before tuning and with the one kept. steps: (stmin, blocksize, bytes/s or None, error) tried
+    """
+    def __init__(self, name, stmin, blocksize, baseline):
+        self.name       = name
+        self.stmin      = stmin
+        self.blocksize  = blocksize
+        self.baseline   = baseline
+        self.throughput = baseline
+        self.steps      = []
+
+    @property
+    def gain(self):
+        return self.throughput / self.baseline if self.baseline else 0.0
+
+    def lines(self):
+        yield "%-8s %8s %4s %12s  %s" % ("step", "stmin", "bs", "bytes/s", "")
+        for i, (stmin, blocksize, rate, error) in enumerate(self.steps):
+            yield "%-8d %8s %4d %12s  %s" % (i, stmin_text(stmin), blocksize,
+                                            "%.0f" % rate if rate is not None else "-", error or "ok")
+        yield "%s: stmin %s, blocksize %d, %.0f -> %.0f bytes/s (x%.1f)" % (
+            self.name, stmin_text(self.stmin), self.blocksize, self.baseline, self.throughput, self.gain)
+
+
+class TuneError(Exception):
+    pass
+
+
+def probe(target, rounds=PROBE_ROUNDS, did=PROBE_DID, copies=PROBE_COPIES):
+    """
+    response bytes per second of rounds multi-DID reads with the current flow control of target.
+    Raises TuneError on a timeout, a negative or incomplete response or an ISO-TP receive error
+    """
+    client = target.udsclient
+    request = Request(services.ReadDataByIdentifier, data=bytes([did >> 8, did & 0xFF]) * copies)
+    errors = target.isotp_errors
+    elapsed, received = 0.0, 0
+    with client_p2_timeout(client):
+        for _ in range(rounds):
+            t0 = time.perf_counter()
+            try:
+                response = client.send_request(request)
+            except Exception as e:
+                raise TuneError("%s: %s" % (type(e).__name__, e))
+            elapsed += time.perf_counter() - t0
+            data = bytes(response.data)
+            if not response.positive or len(data) % copies != 0 or \
+               data != data[:len(data) // copies] * copies or data[:2] != request.data[:2]:
+                raise TuneError("incomplete response")
+            if target.isotp_errors != errors:
+                raise TuneError("%d ISO-TP receive error(s)" % (target.isotp_errors - errors))
+            received += len(data) + 1
+    return received / elapsed
+
+
+def tune(target, rounds=PROBE_ROUNDS, stmin_steps=STMIN_STEPS, blocksize_steps=BLOCKSIZE_STEPS):
+    """
+    TuneResult of target, left with the smallest STmin / largest blocksize that passed.
+    The flow control in place when called is the baseline, raises TuneError if that one fails
+    """
+    stmin, blocksize = target.flow_control
+    result = TuneResult(target.name, stmin, blocksize, probe(target, rounds))
+    result.steps.append((stmin, blocksize, result.baseline, None))
+
+    def attempt(stmin, blocksize):
+        target.set_flow_control(stmin, blocksize)
+        try:
+            rate = probe(target, rounds)
+        except TuneError as e:
+            result.steps.append((stmin, blocksize, None, str(e)))
+            target.set_flow_control(result.stmin, result.blocksize)
+            return False
+        result.steps.append((stmin, blocksize, rate, None))
+        # a step no faster than the one kept (host bound, noise) is passed over, the next is still tried
+        if rate > result.throughput:
+            result.stmin, result.blocksize, result.throughput = stmin, blocksize, rate
+        return True
+
+    # stmin 0xF1-0xF9 (us) sorts after the ms values it is smaller than
+    faster = [s for s in stmin_steps if _stmin_us(s) < _stmin_us(stmin)]
+    for s in faster:
+        if not attempt(s, result.blocksize):
+            break
+    if result.blocksize != 0:
+        larger = [b for b in blocksize_steps if b == 0 or b > result.blocksize]
+        for b in larger:
+            if not attempt(result.stmin, b):
+                break
+    target.set_flow_control(result.stmin, result.blocksize)
+    return result
+
+
+def _stmin_us(stmin):
+    return (stmin - 0xF0) * 100 if 0xF1 <= stmin <= 0xF9 else stmin * 1000
@@ -0,0 +1,99 @@
+# -*- coding:utf-8 -*-
+#  srecord.py
+#
+#  ~~~~~~~~~~~~
+#
+#  Motorola S-record (.s19/.s28/.s37) reader used by the flash download
+#
+#  ~~~~~~~~~~~~
+#
+
+# record type -> number of address bytes, only data records are listed
+DATA_RECORD_ADDR_LEN = {'1': 2, '2': 3, '3': 4}
+# records carrying no payload for the ECU: header, count and start address
+SKIPPED_RECORD_TYPES = ('0', '5', '6', '7', '8', '9')
+
+
+class SRecordError(ValueError):
+    """
+    raised on malformed records or checksum mismatch, carries file line number
+    """
+    def __init__(self, lineno, message):
+        ValueError.__init__(self, "line %d: %s" % (lineno, message))
+        self.lineno = lineno
+
+
+class Segment(object):
+    """
+    contiguous memory area of an image, data is a bytearray of the binary content
+    """
+    __slots__ = ('address', 'data')
+
+    def __init__(self, address, data=None):
+        self.address = address
+        self.data = bytearray() if data is None else data
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    @property
+    def end(self):
+        return self.address + len(self.data)
+
+    def __repr__(self):
+        return "Segment(address=0x%08X, size=%d)" % (self.address, len(self.data))
+
+
+def iter_records(fd):
+    """
+    yield (lineno, address, payload) for every S1/S2/S3 record of an open text file,
+    payload is a memoryview on the decoded record, checksums are verified
+    """
+    for lineno, line in enumerate(fd, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if line[0] != 'S' or len(line) < 4:
+            raise SRecordError(lineno, "not an S-record")
+
+        rtype = line[1]
+        addr_len = DATA_RECORD_ADDR_LEN.get(rtype)
+        if addr_len is None:
+            if rtype in SKIPPED_RECORD_TYPES:
+                continue
+            raise SRecordError(lineno, "unknown record type S%s" % rtype)
+
+        try:
+            raw = bytes.fromhex(line[2:])
+        except ValueError:
+            raise SRecordError(lineno, "invalid hex digits")
+        if len(raw) != raw[0] + 1 or raw[0] < addr_len + 1:
+            raise SRecordError(lineno, "byte count does not match record length")
+        if sum(raw) & 0xFF != 0xFF:
+            raise SRecordError(lineno, "checksum error")
+
+        address = int.from_bytes(raw[1:1 + addr_len], 'big')
+        yield lineno, address, memoryview(raw)[1 + addr_len:-1]
+
+
+def read_segments(fd):
+    """
+    stream the records of an open file and merge them into contiguous segments
+    """
+    segments = []
+    seg = None
+    for lineno, address, payload in iter_records(fd):
+        if seg is None or address != seg.end:
+            seg = Segment(address)
+            segments.append(seg)
+        seg.data += payload
+    return segments
+
+
+def load_segments(path):
+    """
+    parse a .s19 file, return the list of segments in file order
+    """
+    with open(path, "r") as fd:
+        return read_segments(fd)
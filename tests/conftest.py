@@ -0,0 +1,60 @@
+# -*- coding:utf-8 -*-
+#  conftest.py
+#
+#  ~~~~~~~~~~~~
+#
+#  pytest fixtures: the modules of the repository root on sys.path, the flash record, journal,
+#  package cache and tuning files of every test in its own temporary directory, and a
+#  CCDiagEngine on the virtual device with the simulated ECUs
+#
+#  ~~~~~~~~~~~~
+#
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+SW_PATH   = os.path.join(ROOT, "LEARAD00012.s19")
+BOOT_PATH = os.path.join(ROOT, "LEDRAA00003.s19")
+
+
+@pytest.fixture(autouse=True)
+def ccdiag_dirs(tmp_path, monkeypatch):
+    monkeypatch.setenv("CCDIAG_FLASH_RECORDS", str(tmp_path / "records"))
+    monkeypatch.setenv("CCDIAG_FLASH_JOURNAL", str(tmp_path / "journal"))
+    monkeypatch.setenv("CCDIAG_FLASH_CACHE", str(tmp_path / "cache"))
+    monkeypatch.setenv("CCDIAG_ISOTP_TUNE", str(tmp_path / "isotp_tune.json"))
+    return tmp_path
+
+
+def open_engine(device="ZCAN-VIRTUAL", fd_targets=(), uds=True):
+    from ccdiag_engine import CCDiagEngine
+    engine = CCDiagEngine(os.path.join(ROOT, "dev_info.json"), os.path.join(ROOT, "DTCList.json"),
+                          did_list_path=os.path.join(ROOT, "DIDList.json"))
+    for name in fd_targets:
+        engine.set_canfd(name)
+    engine.keepalive = False
+    try:
+        engine.open_device(device, 0)
+        engine.open_channel(0, uds=uds)
+    except Exception:
+        engine.close()
+        raise
+    return engine
+
+
+@pytest.fixture
+def engine():
+    engine = open_engine()
+    yield engine
+    engine.close()
+
+
+@pytest.fixture
+def fd_engine():
+    engine = open_engine("ZCAN-VIRTUAL-FD", fd_targets=("ESC",))
+    yield engine
+    engine.close()
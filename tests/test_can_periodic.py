@@ -0,0 +1,41 @@
+# -*- coding:utf-8 -*-
+#  test_can_periodic.py
+#
+#  ~~~~~~~~~~~~
+#
+#  periodic transmit scheduler on a virtual channel
+#
+#  ~~~~~~~~~~~~
+#
+import time
+
+import pytest
+
+import can_periodic
+from zlgcan import *
+
+
+@pytest.fixture
+def scheduler():
+    zcan = ZCANVirtualDriver(bus_names={(0, 0): "test_can_periodic"})
+    chn = zcan.InitCAN(zcan.OpenDevice(ZCAN_VIRTUAL_DEVICE, 0, 0), 0, ZCAN_CHANNEL_INIT_CONFIG())
+    zcan.StartCAN(chn)
+    scheduler = can_periodic.PeriodicScheduler(zcan, chn).start()
+    yield scheduler
+    scheduler.stop()
+
+
+@pytest.mark.parametrize("period", [0, -0.01])
+def test_period_must_be_positive(scheduler, period):
+    with pytest.raises(ValueError):
+        scheduler.add(0x100, b'\x00', period)
+    assert not scheduler.messages
+
+
+def test_messages_are_sent(scheduler):
+    sent = []
+    scheduler.add_tap(lambda msgs, num: sent.extend(msgs[i].frame.can_id for i in range(num)))
+    msg = scheduler.add(0x100, b'\x01\x02', 0.01)
+    time.sleep(0.1)
+    scheduler.remove(msg)
+    assert 3 <= sent.count(0x100) <= 15
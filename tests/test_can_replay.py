@@ -0,0 +1,109 @@
+# -*- coding:utf-8 -*-
+#  test_can_replay.py
+#
+#  ~~~~~~~~~~~~
+#
+#  TraceReplay of a recorded trace onto a driver that keeps the time of every Transmit call
+#
+#  ~~~~~~~~~~~~
+#
+import time
+
+import pytest
+
+import can_trace
+from can_replay import TraceReplay, ReplayStats
+from zlgcan import ZCAN_Receive_Data, ZCAN_Transmit_Data
+
+FRAMES = 100
+STEP_US = 2000
+
+
+class TransmitDriver(object):
+    def __init__(self, ret=None):
+        self.ret  = ret
+        self.sent = []                  # (perf_counter, can_id, first data byte)
+
+    def Transmit(self, chn_handle, msgs, num):
+        t = time.perf_counter()
+        self.sent.extend((t, msgs[i].frame.can_id, msgs[i].frame.data[0]) for i in range(num))
+        return num if self.ret is None else self.ret
+
+    TransmitFD = Transmit
+
+
+@pytest.fixture
+def reader(tmp_path):
+    path = str(tmp_path / ("t" + can_trace.TRACE_EXT))
+    with can_trace.TraceRecorder(path) as recorder:
+        msgs = (ZCAN_Receive_Data * FRAMES)()
+        for i in range(FRAMES):
+            msgs[i].frame.can_id = 0x7E8 if i % 2 else 0x7E9
+            msgs[i].frame.can_dlc = 1
+            msgs[i].frame.data[0] = i
+            msgs[i].timestamp = 5000000 + i * STEP_US
+        recorder.on_rx(msgs, FRAMES)
+        tx = (ZCAN_Transmit_Data * 1)()
+        tx[0].frame.can_id = 0x7E0
+        recorder.on_tx(tx, 1)
+    with can_trace.TraceReader(path) as reader:
+        yield reader
+
+
+def replay(reader, **options):
+    zcan = TransmitDriver(options.pop("ret", None))
+    replay = TraceReplay(zcan, 1, reader, **options).start()
+    assert replay.wait(10)
+    replay.stop()
+    return replay, zcan
+
+
+@pytest.mark.parametrize("speed", [1.0, 2.0])
+def test_timing(reader, speed):
+    replayer, zcan = replay(reader, tx=False, speed=speed)
+    assert [data for _, _, data in zcan.sent] == list(range(FRAMES))
+    t0 = zcan.sent[0][0]
+    offsets = [t - t0 for t, _, _ in zcan.sent]
+    for i, offset in enumerate(offsets):
+        # sent at the recorded offset, never before it
+        assert offset >= i * STEP_US / 1e6 / speed - 0.001
+    assert offsets[-1] == pytest.approx((FRAMES - 1) * STEP_US / 1e6 / speed, abs=0.02)
+    assert replayer.stats.frames == FRAMES and replayer.stats.jitter_count == FRAMES
+    assert replayer.stats.tx_errors == 0
+
+
+def test_filters(reader):
+    replayer, zcan = replay(reader, ids=[0x7E8], start=0.05, end=0.1)
+    assert [data for _, _, data in zcan.sent] == list(range(25, 51, 2))
+    replayer, zcan = replay(reader, rx=False)
+    assert [can_id for _, can_id, _ in zcan.sent] == [0x7E0]
+
+
+def test_send_errors(reader):
+    replayer, zcan = replay(reader, tx=False, speed=10.0, ret=0xFFFFFFFF)
+    assert replayer.stats.frames == 0
+    assert replayer.stats.tx_errors == FRAMES
+
+
+def test_loop_keeps_bounded_jitter(reader):
+    zcan = TransmitDriver()
+    replayer = TraceReplay(zcan, 1, reader, tx=False, speed=20.0, loop=True)
+    replayer.stats = ReplayStats(samples=50)
+    replayer.start()
+    deadline = time.monotonic() + 10
+    while replayer.stats.jitter_count < 3 * FRAMES and time.monotonic() < deadline:
+        time.sleep(0.01)
+    replayer.stop()
+    assert replayer.stats.jitter_count >= 3 * FRAMES
+    assert len(replayer.stats.jitter) == 50
+    assert list(replayer.stats.lines())[1].startswith("jitter")
+
+
+def test_stats():
+    stats = ReplayStats(samples=10)
+    stats.add_jitter([0.001 * i for i in range(1, 101)] + [-0.2])
+    assert len(stats.jitter) == 10
+    assert stats.jitter_count == 101
+    assert stats.percentile(100) == stats.jitter_max == 0.2
+    assert stats.jitter_sum / stats.jitter_count == pytest.approx((5.05 + 0.2) / 101)
+    assert 0.001 <= stats.percentile(99) <= 0.2
@@ -0,0 +1,128 @@
+# -*- coding:utf-8 -*-
+#  test_can_trace.py
+#
+#  ~~~~~~~~~~~~
+#
+#  TraceRecorder / TraceReader round trip, time range queries and the ASC/BLF export
+#
+#  ~~~~~~~~~~~~
+#
+import zlib
+
+import can_trace
+from zlgcan import ZCAN_Receive_Data, ZCAN_ReceiveFD_Data, ZCAN_Transmit_Data
+
+RX_FRAMES = 10000           # more than two index blocks
+
+
+def rx_batch(first, num, step_us=100, can_id=0x7E8):
+    msgs = (ZCAN_Receive_Data * num)()
+    for i in range(num):
+        msgs[i].frame.can_id = can_id
+        msgs[i].frame.can_dlc = 8
+        msgs[i].frame.data[0] = (first + i) & 0xFF
+        msgs[i].timestamp = 1000000 + (first + i) * step_us
+    return msgs
+
+
+def record(path, fd=False):
+    with can_trace.TraceRecorder(path, fd=fd) as recorder:
+        # sent before anything was received: host clock, far after the device timestamps below
+        tx = (ZCAN_Transmit_Data * 1)()
+        tx[0].frame.can_id = 0x7E0
+        tx[0].frame.can_dlc = 3
+        tx[0].frame.data[0:3] = [0x02, 0x10, 0x03]
+        recorder.on_tx(tx, 1)
+        for first in range(0, RX_FRAMES, 1000):
+            recorder.on_rx(rx_batch(first, 1000), 1000)
+        if fd:
+            fd_msgs = (ZCAN_ReceiveFD_Data * 1)()
+            fd_msgs[0].frame.can_id = 0x18DAF1E8
+            fd_msgs[0].frame.eff = 1
+            fd_msgs[0].frame.len = 64
+            fd_msgs[0].frame.brs = 1
+            fd_msgs[0].timestamp = 1000000 + RX_FRAMES * 100
+            recorder.on_rx(fd_msgs, 1)
+    return recorder
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / ("t" + can_trace.TRACE_EXT))
+    assert record(path).frames == RX_FRAMES + 1
+    with can_trace.TraceReader(path) as reader:
+        assert len(reader) == RX_FRAMES + 1
+        assert len(reader.blocks) > 1
+        # the earliest device timestamp, not the host timestamp of record 0
+        assert reader.start_ts == 1000000
+        frames = list(reader.frames())
+        assert frames[0].tx and frames[0].can_id == 0x7E0 and frames[0].data == b'\x02\x10\x03'
+        assert all(f.timestamp >= reader.start_ts for f in frames)
+        # 0.5 s .. 0.6 s: frames 5000 .. 6000, from one index block
+        window = list(reader.frames(0.5, 0.6))
+        assert [f.timestamp for f in window] == [1000000 + i * 100 for i in range(5000, 6001)]
+        assert not any(f.tx for f in window)
+
+
+def test_missing_index(tmp_path):
+    path = str(tmp_path / ("t" + can_trace.TRACE_EXT))
+    record(path)
+    with open(path + can_trace.INDEX_EXT, "wb"):
+        pass
+    with can_trace.TraceReader(path) as reader:
+        assert sum(b[1] for b in reader.blocks) == RX_FRAMES + 1
+        assert reader.start_ts == 1000000
+        assert len(list(reader.frames(0.5, 0.6))) == 1001
+
+
+def test_asc(tmp_path):
+    path = str(tmp_path / ("t" + can_trace.TRACE_EXT))
+    record(path, fd=True)
+    with can_trace.TraceReader(path) as reader:
+        can_trace.to_asc(reader, str(tmp_path / "t.asc"), start=0.0, end=0.0002)
+        tx = [f for f in reader.frames() if f.tx][0]
+        can_trace.to_asc(reader, str(tmp_path / "tx.asc"), start=(tx.timestamp - reader.start_ts) / 1e6)
+    with open(str(tmp_path / "t.asc")) as fd:
+        lines = fd.read().splitlines()
+    assert lines[0].startswith("date ")
+    frames = [line.split() for line in lines[6:-1]]
+    assert [(f[0], f[2], f[3]) for f in frames] == [("0.000000", "7E8", "Rx"), ("0.000100", "7E8", "Rx"),
+                                                    ("0.000200", "7E8", "Rx")]
+    assert frames[1][4:7] == ["d", "8", "01"]
+    with open(str(tmp_path / "tx.asc")) as fd:
+        assert [line.split()[2:] for line in fd.read().splitlines()[6:-1]] == [["7E0", "Tx", "d", "3", "02", "10", "03"]]
+
+
+def blf_objects(path):
+    with open(path, "rb") as fd:
+        data = fd.read()
+    header = can_trace.BLF_FILE_HEADER.unpack_from(data)
+    assert header[0] == b"LOGG" and header[10] == len(data)
+    # objects may continue in the next log container
+    pos, stream = can_trace.BLF_FILE_HEADER_SIZE, b""
+    while pos < len(data):
+        _, _, _, size, obj_type = can_trace.BLF_OBJ_HEADER.unpack_from(data, pos)
+        assert obj_type == can_trace.BLF_LOG_CONTAINER_T
+        stream += zlib.decompress(data[pos + can_trace.BLF_OBJ_HEADER.size + can_trace.BLF_LOG_CONTAINER.size:pos + size])
+        pos += size + size % 4
+    i, objects = 0, []
+    while i < len(stream):
+        magic, header_size, _, obj_size, obj_type = can_trace.BLF_OBJ_HEADER.unpack_from(stream, i)
+        assert magic == b"LOBJ"
+        objects.append((obj_type, stream[i + header_size:i + obj_size]))
+        i += obj_size + (obj_size - header_size) % 4
+    return header, objects
+
+
+def test_blf(tmp_path):
+    path = str(tmp_path / ("t" + can_trace.TRACE_EXT))
+    record(path, fd=True)
+    with can_trace.TraceReader(path) as reader:
+        assert can_trace.to_blf(reader, str(tmp_path / "t.blf")) == RX_FRAMES + 2
+    header, objects = blf_objects(str(tmp_path / "t.blf"))
+    assert header[12] == len(objects) == RX_FRAMES + 2
+    assert [t for t, _ in objects].count(can_trace.BLF_CAN_FD_MESSAGE) == 1
+    channel, flags, dlc, can_id, data = can_trace.BLF_CAN_MSG.unpack(objects[0][1])
+    assert (flags & can_trace.BLF_DIR_TX, dlc, can_id, data[:3]) == (can_trace.BLF_DIR_TX, 3, 0x7E0, b'\x02\x10\x03')
+    fd = can_trace.BLF_CAN_FD_MSG.unpack(objects[-1][1])
+    assert fd[3] == 0x18DAF1E8 | can_trace.BLF_CAN_EXT
+    assert fd[6] == can_trace.BLF_FD_EDL | can_trace.BLF_FD_BRS and fd[7] == 64
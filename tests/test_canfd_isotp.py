@@ -0,0 +1,73 @@
+# -*- coding:utf-8 -*-
+#  test_canfd_isotp.py
+#
+#  ~~~~~~~~~~~~
+#
+#  ISO-TP over CAN FD for the ECUs named in set_canfd, classic CAN for the others on the same channel
+#
+#  ~~~~~~~~~~~~
+#
+import pytest
+
+from ccdiag_engine import CCDiagError
+from zlgcan import ZCAN_ReceiveFD_Data, ZCAN_TransmitFD_Data
+
+
+class FrameTap(object):
+    """
+    (can_id, fd, length) of every frame seen by a dispatcher or TX ring tap
+    """
+    def __init__(self):
+        self.frames = []
+
+    def __call__(self, msgs, num):
+        fd = msgs._type_ in (ZCAN_ReceiveFD_Data, ZCAN_TransmitFD_Data)
+        for i in range(num):
+            frame = msgs[i].frame
+            self.frames.append((frame.can_id, fd, frame.len if fd else frame.can_dlc))
+
+
+def read_with_taps(engine, name, dids):
+    rx, tx = FrameTap(), FrameTap()
+    target = engine.targets[name]
+    engine._dispatcher.add_tap(rx)
+    target.tx_ring.add_tap(tx)
+    try:
+        engine.set_target(name)
+        result = engine.read_dids(dids).result()
+    finally:
+        engine._dispatcher.remove_tap(rx)
+        target.tx_ring.remove_tap(tx)
+    address = engine.ADDRESSES[name]
+    return (result, [f for f in rx.frames if f[0] == address.rxid], [f for f in tx.frames if f[0] == address.txid])
+
+
+def test_fd_targets(fd_engine):
+    assert fd_engine.targets["ESC"].is_fd
+    assert not fd_engine.targets["ESC_FUNC"].is_fd
+    assert not fd_engine.targets["EPS"].is_fd
+    assert fd_engine.simulator.ecu("ESC").fd
+    assert not fd_engine.simulator.ecu("EPS").fd
+
+
+def test_fd_did_read(fd_engine):
+    result, rx, tx = read_with_taps(fd_engine, "ESC", [0xF190, 0xF18C, 0xF195])
+    assert set(result.values) == {0xF190, 0xF18C, 0xF195}
+    # the response fits one CAN FD frame, the request one CAN FD single frame
+    assert rx and all(fd for _, fd, _ in rx)
+    assert max(length for _, _, length in rx) > 8
+    assert len(rx) == 1
+    assert tx and all(fd for _, fd, _ in tx)
+
+
+def test_classic_target_on_fd_channel(fd_engine):
+    result, rx, tx = read_with_taps(fd_engine, "EPS", [0xF190, 0xF18C, 0xF195])
+    assert set(result.values) == {0xF190, 0xF18C, 0xF195}
+    assert len(rx) > 1
+    assert all(not fd and length <= 8 for _, fd, length in rx + tx)
+
+
+def test_fd_needs_a_known_target(engine):
+    with pytest.raises(CCDiagError):
+        engine.set_canfd("ABS")
+    assert not engine.targets["ESC"].is_fd
@@ -0,0 +1,56 @@
+# -*- coding:utf-8 -*-
+#  test_ccdiag_engine.py
+#
+#  ~~~~~~~~~~~~
+#
+#  CCDiagEngine operations and the command line against the simulated ECUs
+#
+#  ~~~~~~~~~~~~
+#
+import threading
+
+import ccdiag_cli
+import ecu_sim
+from conftest import ROOT
+
+
+def test_dtcs(engine):
+    dtcs = engine.read_dtc(9).result()
+    assert sorted(dtc.id for dtc in dtcs) == [0x512316, 0xC07300]
+    assert engine.describe_dtc(0x123456) == "unknow DTC"
+    assert engine.clear_dtc().result() is True
+    assert engine.read_dtc(9).result() == []
+    assert not engine.simulator.ecu("ESC").dtcs
+
+
+def test_target_selection(engine):
+    engine.set_target("EPS")
+    engine.simulator.ecu("EPS").dids[0xF195] = b'\x07'
+    assert engine.read_sw_version().result() == engine.did_registry.codecs()[0xF195].decode(b'\x07')
+    engine.reset_ecu().result()
+    assert engine.simulator.ecu("EPS").session == ecu_sim.DEFAULT_SESSION
+    assert engine.simulator.ecu("ESC").requests == 0
+
+
+def test_operations_run_in_order_on_one_thread(engine):
+    threads = []
+    futures = [engine.submit(lambda i=i: threads.append((i, threading.current_thread()))) for i in range(5)]
+    for f in futures:
+        f.result()
+    assert [i for i, _ in threads] == list(range(5))
+    assert len(set(t for _, t in threads)) == 1 and threads[0][1] is not threading.current_thread()
+
+
+def test_cli(monkeypatch, capsys):
+    monkeypatch.chdir(ROOT)
+    assert ccdiag_cli.main(["--device", "ZCAN-VIRTUAL", "read-dtc", "--mask", "0x01"]) == 0
+    out = capsys.readouterr().out
+    assert "C07300  09" in out and "1 DTC(s)" in out
+    assert ccdiag_cli.main(["--device", "ZCAN-VIRTUAL", "--target", "EPS", "read-did", "F18C"]) == 0
+    assert "F18C" in capsys.readouterr().out
+
+
+def test_cli_error(monkeypatch, capsys):
+    monkeypatch.chdir(ROOT)
+    assert ccdiag_cli.main(["--device", "NO-SUCH-DEVICE", "info"]) == 1
+    assert capsys.readouterr().out.startswith("ERROR:")
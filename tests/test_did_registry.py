@@ -0,0 +1,73 @@
+# -*- coding:utf-8 -*-
+#  test_did_registry.py
+#
+#  ~~~~~~~~~~~~
+#
+#  DID codecs of DIDList.json and batched reads of the simulated ESC
+#
+#  ~~~~~~~~~~~~
+#
+import pytest
+
+import did_registry
+
+
+@pytest.fixture
+def registry():
+    return did_registry.load()
+
+
+def test_codec_encode_decode(registry):
+    codec = registry[0xF199].codec
+    value = (0x20, 0x26, 0x10, 0x18, 0x12, 0x30, 0x00)
+    assert len(codec) == 7
+    # udsoncan passes the value of a DidCodec subclass as one argument
+    assert codec.encode(value) == bytes(value)
+    assert codec.encode(list(value)) == bytes(value)
+    assert codec.encode(*value) == bytes(value)
+    assert codec.decode(bytes(value)) == value
+    assert registry[0xF195].codec.encode(3) == b'\x03'
+
+
+def test_text(registry):
+    assert registry[0xF190].text(registry[0xF190].codec.decode(b'LSDYNA0000000001')) == "LSDYNA0000000001"
+    assert registry[0xF18B].text((0x26, 0x10, 0x18)) == "261018"
+    assert registry[0xF193].text((0x01, 0x00)) == "01 00"
+    assert registry[0xF195].text((0x03,)) == "0x03"
+
+
+def test_registry(registry):
+    assert 0xF190 in registry and 0x1234 not in registry
+    assert registry.group("coding") == [0xF1A8]
+    assert registry.group("identification")[0] == 0xF187
+    assert set(registry.codecs()) == set(registry.definitions)
+    with pytest.raises(KeyError) as e:
+        registry[0x1234]
+    assert "0x1234" in str(e.value)
+    assert did_registry.load() is registry
+
+
+def test_read_identification(engine, registry):
+    result = engine.read_identification().result()
+    dids = registry.group("identification")
+    assert list(result.values) == dids
+    assert result.requests == 1 and result.max_dids is None
+    assert bytes(result.values[0xF190]) == b'LSDYNA0000000001'
+
+
+def test_read_split_on_length_nrc(engine, registry):
+    engine.simulator.ecu("ESC").max_dids = 4
+    dids = registry.group("identification")
+    result = engine.read_dids(dids).result()
+    assert list(result.values) == dids
+    assert result.max_dids is not None and result.max_dids <= 4
+    # the limit is kept for the next read
+    again = engine.read_dids(dids).result()
+    assert again.requests == -(-len(dids) // again.max_dids)
+
+
+def test_read_unsupported(engine):
+    del engine.simulator.ecu("ESC").dids[0xF198]
+    result = engine.read_dids([0xF190, 0xF198, 0xF195]).result()
+    assert result.unsupported == [0xF198]
+    assert list(result.values) == [0xF190, 0xF195]
@@ -0,0 +1,125 @@
+# -*- coding:utf-8 -*-
+#  test_ecu_sim.py
+#
+#  ~~~~~~~~~~~~
+#
+#  SimulatedEcu request handling, and the simulator answering the engine on the virtual bus
+#
+#  ~~~~~~~~~~~~
+#
+import time
+
+import ecu_sim
+from ccdiag_engine import sec_algo, SECURITY_ALGO_PARAMS
+from ecu_sim import SimulatedEcu
+
+
+def make_ecu(**options):
+    return SimulatedEcu("ESC", 0x73E, 0x736, dids={0xF195: b'\x03', 0xF18C: b'SN01'}, dtcs={0xC07300: 0x09, 0x512316: 0x08},
+                        security_algo=sec_algo, security_algo_params=SECURITY_ALGO_PARAMS, **options)
+
+
+def request(ecu, *data, **options):
+    """
+    final response of one request, None when there is none
+    """
+    responses = ecu.handle(bytes(data), **options)
+    return responses[-1][1] if responses else None
+
+
+def unlock(ecu, level):
+    seed = request(ecu, 0x27, level)[2:]
+    key = sec_algo(level, seed, SECURITY_ALGO_PARAMS)
+    return request(ecu, 0x27, level + 1, *bytes(key))
+
+
+def test_sessions():
+    ecu = make_ecu()
+    assert request(ecu, 0x10, 0x02) == b'\x7F\x10\x7E'
+    assert request(ecu, 0x10, 0x03) == b'\x50\x03\x00\x32\x01\xF4'
+    assert request(ecu, 0x10, 0x02)[:2] == b'\x50\x02'
+    assert ecu.session == ecu_sim.PROGRAMMING_SESSION
+    assert request(ecu, 0x10, 0x05) == b'\x7F\x10\x12'
+    # suppressPosRspMsgIndicationBit
+    assert request(ecu, 0x3E, 0x80) is None
+    assert request(ecu, 0x11, 0x01) == b'\x51\x01'
+    assert ecu.session == ecu_sim.DEFAULT_SESSION
+
+
+def test_s3_timeout():
+    ecu = make_ecu(s3=0.05)
+    request(ecu, 0x10, 0x03)
+    time.sleep(0.1)
+    assert request(ecu, 0x2E, 0xF1, 0x99, 0x01) == b'\x7F\x2E\x7F'
+    assert ecu.session == ecu_sim.DEFAULT_SESSION
+
+
+def test_security_access():
+    ecu = make_ecu()
+    assert request(ecu, 0x27, 0x01) == b'\x7F\x27\x7F'
+    request(ecu, 0x10, 0x03)
+    assert request(ecu, 0x27, 0x02, 0, 0, 0, 0) == b'\x7F\x27\x24'
+    request(ecu, 0x27, 0x01)
+    assert request(ecu, 0x27, 0x02, 0, 0, 0, 0) == b'\x7F\x27\x35'
+    assert not ecu.unlocked
+    assert unlock(ecu, 0x01) == b'\x67\x02'
+    # unlocked: zero seed
+    assert request(ecu, 0x27, 0x01) == b'\x67\x01\x00\x00\x00\x00'
+    assert request(ecu, 0x2E, 0xF1, 0x99, 0x01, 0x02) == b'\x6E\xF1\x99'
+    assert ecu.dids[0xF199] == b'\x01\x02'
+
+
+def test_read_dids_and_dtcs():
+    ecu = make_ecu(max_dids=2)
+    assert request(ecu, 0x22, 0xF1, 0x95, 0xF1, 0x8C) == b'\x62\xF1\x95\x03\xF1\x8CSN01'
+    assert request(ecu, 0x22, 0xF1, 0x95, 0xF1, 0x8C, 0xF1, 0x95) == b'\x7F\x22\x13'
+    assert request(ecu, 0x22, 0xF1, 0x00) == b'\x7F\x22\x31'
+    assert request(ecu, 0x19, 0x02, 0x01) == b'\x59\x02\xFF\xC0\x73\x00\x09'
+    assert request(ecu, 0x19, 0x01, 0x08) == b'\x59\x01\xFF\x01\x00\x02'
+    assert request(ecu, 0x14, 0xFF, 0xFF, 0xFF) == b'\x54'
+    assert not ecu.dtcs
+    assert request(ecu, 0x99) == b'\x7F\x99\x11'
+    assert request(ecu, 0x99, functional=True) is None
+
+
+def test_injected_nrc():
+    ecu = make_ecu()
+    ecu.inject_nrc(0x22, 0x78, count=1)
+    responses = ecu.handle(b'\x22\xF1\x95')
+    assert [r for _, r in responses] == [b'\x7F\x22\x78', b'\x62\xF1\x95\x03']
+    ecu.inject_nrc(0x3E, 0x22, count=None, after=1)
+    assert request(ecu, 0x3E, 0x00) == b'\x7E\x00'
+    assert request(ecu, 0x3E, 0x00) == b'\x7F\x3E\x22'
+    assert request(ecu, 0x3E, 0x00) == b'\x7F\x3E\x22'
+    ecu.clear_nrc(0x3E)
+    assert request(ecu, 0x3E, 0x00) == b'\x7E\x00'
+
+
+def test_download_to_ram_then_flash():
+    ecu = make_ecu(max_block_length=6)
+    request(ecu, 0x10, 0x03)
+    request(ecu, 0x10, 0x02)
+    assert request(ecu, 0x34, 0x00, 0x44, 0, 0, 0, 0, 0, 0, 0, 8) == b'\x7F\x34\x33'
+    unlock(ecu, 0x11)
+    for address, driver in ((0x00DF8020, True), (0x00620000, False)):
+        assert request(ecu, 0x34, 0x00, 0x44, *(address.to_bytes(4, 'big') + (8).to_bytes(4, 'big'))) == b'\x74\x20\x00\x06'
+        assert request(ecu, 0x36, 0x01, 1, 2, 3, 4) == b'\x76\x01'
+        # a repeated block is acknowledged again, a skipped one rejected
+        assert request(ecu, 0x36, 0x01, 1, 2, 3, 4) == b'\x76\x01'
+        assert request(ecu, 0x36, 0x03, 5, 6, 7, 8) == b'\x7F\x36\x73'
+        assert request(ecu, 0x36, 0x02, 5, 6, 7, 8, 9) == b'\x7F\x36\x13'
+        assert request(ecu, 0x36, 0x02, 5, 6, 7, 8) == b'\x76\x02'
+        assert request(ecu, 0x37) == b'\x77'
+        if driver:
+            assert ecu.ram[address] == bytes(range(1, 9)) and not ecu.memory
+            assert request(ecu, 0x31, 0x01, 0x02, 0x02)[:4] == b'\x71\x01\x02\x02'
+    assert ecu.memory == {0x00620000: bytes(range(1, 9))}
+
+
+def test_simulator_answers_the_engine(engine):
+    ecu = engine.simulator.ecu("EPS")
+    ecu.latency = 0.05
+    t0 = time.monotonic()
+    assert engine.targets["EPS"].udsclient.tester_present().positive
+    assert time.monotonic() - t0 >= 0.05
+    assert ecu.requests == 1 and engine.simulator.ecu("ESC").requests == 0
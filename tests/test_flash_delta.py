@@ -0,0 +1,64 @@
+# -*- coding:utf-8 -*-
+#  test_flash_delta.py
+#
+#  ~~~~~~~~~~~~
+#
+#  delta plan of the simulated ESC against its flash record
+#
+#  ~~~~~~~~~~~~
+#
+import flash_delta
+from srecord import Segment
+
+
+class Image(object):
+    def __init__(self, sw, boot):
+        self.sw_segments   = [Segment(address, bytearray(data)) for address, data in sw]
+        self.boot_segments = [Segment(address, bytearray(data)) for address, data in boot]
+
+
+def make_image(app=b'\x11' * 64):
+    return Image([(0x00620000, app), (0x00FFFF00, b'\x01\x02\x03\x04')], [(0x00DF8020, b'\x22' * 32)])
+
+
+def plan(engine, image, store):
+    return engine.submit(flash_delta.plan, engine.targets["ESC"].udsclient, image, "ESC", store).result()
+
+
+def commit(engine, delta_plan, store):
+    engine.submit(flash_delta.commit, engine.targets["ESC"].udsclient, delta_plan, "ESC", store).result()
+
+
+def test_segment_hashes():
+    hashes = flash_delta.segment_hashes(make_image())
+    assert sorted(hashes) == ["boot 0x00DF8020", "sw 0x00620000", "sw 0x00FFFF00"]
+    assert hashes != flash_delta.segment_hashes(make_image(b'\x12' * 64))
+
+
+def test_plan(engine, tmp_path):
+    store = flash_delta.FlashRecordStore(str(tmp_path))
+    image = make_image()
+
+    first = plan(engine, image, store)
+    assert first.vin == "LSDYNA0000000001"
+    assert first.reason.startswith("no record")
+    assert not first.unchanged
+    commit(engine, first, store)
+    assert store.load(first.vin, "ESC")["sw_version"] == [3]
+
+    same = plan(engine, image, store)
+    assert same.reason is None
+    assert same.unchanged == {"sw 0x00620000", "sw 0x00FFFF00"}
+    # dropped until the flash completed
+    assert store.load(same.vin, "ESC") is None
+    commit(engine, same, store)
+
+    patched = plan(engine, make_image(b'\x11' * 63 + b'\x12'), store)
+    assert patched.unchanged == {"sw 0x00FFFF00"}
+    commit(engine, patched, store)
+
+    engine.simulator.ecu("ESC").dids[0xF195] = b'\x04'
+    other = plan(engine, image, store)
+    assert other.reason is not None and "version" in other.reason
+    assert not other.unchanged
+
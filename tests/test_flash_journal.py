@@ -0,0 +1,77 @@
+# -*- coding:utf-8 -*-
+#  test_flash_journal.py
+#
+#  ~~~~~~~~~~~~
+#
+#  flash journal: steps persisted per ECU identity and image, resume and start over,
+#  and the ECU identity read from the simulated ESC
+#
+#  ~~~~~~~~~~~~
+#
+import os
+
+import flash_delta
+import flash_journal
+
+
+class Image(object):
+    def __init__(self, key):
+        self.key = key
+
+
+def test_steps_persist_and_resume(tmp_path):
+    image = Image("a" * 64)
+    journal = flash_journal.open_journal(image, "ESC", "SN01", str(tmp_path))
+    assert not journal.resuming
+    journal.complete("erase 0x00620000")
+    journal.begin("sw 0x00620000")
+    journal.complete("sw 0x00620000")
+    journal.begin("sw 0x00FFFF00")
+
+    resumed = flash_journal.open_journal(image, "ESC", "SN01", str(tmp_path))
+    assert resumed.resuming
+    assert resumed.is_done("sw 0x00620000")
+    assert not resumed.is_done("sw 0x00FFFF00")
+    assert resumed.was_started("sw 0x00FFFF00")
+    assert resumed.skipped == ["sw 0x00620000"]
+
+
+def test_other_ecu_or_image_starts_over(tmp_path):
+    image = Image("a" * 64)
+    flash_journal.open_journal(image, "ESC", "SN01", str(tmp_path)).complete("sw 0x00620000")
+    assert not flash_journal.open_journal(image, "ESC", "SN02", str(tmp_path)).resuming
+    assert not flash_journal.open_journal(Image("b" * 64), "ESC", "SN01", str(tmp_path)).resuming
+    # the journal of SN01 was not touched by the other runs
+    assert flash_journal.open_journal(image, "ESC", "SN01", str(tmp_path)).is_done("sw 0x00620000")
+
+
+def test_no_resume_and_clear(tmp_path):
+    image = Image("a" * 64)
+    journal = flash_journal.open_journal(image, "ESC", "SN/01", str(tmp_path))
+    journal.complete("sw 0x00620000")
+    assert os.path.exists(journal.path)
+    assert os.path.dirname(journal.path) == str(tmp_path)
+
+    assert not flash_journal.open_journal(image, "ESC", "SN/01", str(tmp_path), resume=False).resuming
+    assert not os.path.exists(journal.path)
+
+    journal.complete("sw 0x00620000")
+    journal.clear()
+    assert not os.path.exists(journal.path)
+    assert not flash_journal.open_journal(image, "ESC", "SN/01", str(tmp_path)).resuming
+
+
+def test_corrupt_journal_is_ignored(tmp_path):
+    image = Image("a" * 64)
+    journal = flash_journal.open_journal(image, "ESC", "SN01", str(tmp_path))
+    with open(journal.path, "w") as fd:
+        fd.write("{not json")
+    assert not flash_journal.open_journal(image, "ESC", "SN01", str(tmp_path)).resuming
+
+
+def test_ecu_id(engine):
+    client = engine.targets["ESC"].udsclient
+    ecu = engine.simulator.ecu("ESC")
+    assert engine.submit(flash_delta.read_ecu_id, client).result() == "SN00000000000001"
+    ecu.dids[0xF18C] = b'\x00' * 16
+    assert engine.submit(flash_delta.read_ecu_id, client).result() == "LSDYNA0000000001"
@@ -0,0 +1,94 @@
+# -*- coding:utf-8 -*-
+#  test_flash_package.py
+#
+#  ~~~~~~~~~~~~
+#
+#  compiled flash package: segment table, CRC32 check, cache keyed by the sha256 of the sources
+#
+#  ~~~~~~~~~~~~
+#
+import os
+import shutil
+import struct
+
+import pytest
+
+import flash_package
+import srecord
+from conftest import SW_PATH, BOOT_PATH
+
+
+def test_package_segments(tmp_path):
+    path = flash_package.build_package(SW_PATH, BOOT_PATH, str(tmp_path / "image.ccfp"))
+    with flash_package.FlashPackage(path) as package:
+        for segments, source in ((package.boot_segments, BOOT_PATH), (package.sw_segments, SW_PATH)):
+            expected = srecord.load_segments(source)
+            assert [seg.address for seg in segments] == [seg.address for seg in expected]
+            for seg, exp in zip(segments, expected):
+                assert bytes(seg.data) == bytes(exp.data)
+                assert seg.data.readonly
+        assert package.size == sum(seg.size for seg in package.boot_segments + package.sw_segments)
+        assert package.key == flash_package.package_key(flash_package.file_sha256(SW_PATH),
+                                                        flash_package.file_sha256(BOOT_PATH))
+    assert not os.path.exists(path + ".%d.tmp" % os.getpid())
+
+
+def test_package_key():
+    key = flash_package.package_key(b"\1" * 32, b"\2" * 32)
+    assert len(key) == 64
+    assert key != flash_package.package_key(b"\2" * 32, b"\1" * 32)
+
+
+def _corrupt(path):
+    with open(path, "r+b") as fd:
+        table = fd.read(flash_package.HEADER_SIZE + flash_package.SEGMENT_SIZE)[flash_package.HEADER_SIZE:]
+        _, _, offset, _ = struct.unpack(flash_package.SEGMENT_FORMAT, table)
+        fd.seek(offset)
+        byte = fd.read(1)
+        fd.seek(offset)
+        fd.write(bytes([byte[0] ^ 0xFF]))
+
+
+def test_crc_mismatch(tmp_path):
+    path = flash_package.build_package(SW_PATH, BOOT_PATH, str(tmp_path / "image.ccfp"))
+    _corrupt(path)
+    with pytest.raises(flash_package.FlashPackageError, match="CRC32"):
+        flash_package.FlashPackage(path)
+    flash_package.FlashPackage(path, verify=False).close()
+
+
+def test_not_a_package(tmp_path):
+    path = str(tmp_path / "image.ccfp")
+    with open(path, "wb") as fd:
+        fd.write(b"S0030000FC\n" * 32)
+    with pytest.raises(flash_package.FlashPackageError, match="not a version"):
+        flash_package.FlashPackage(path)
+
+
+def test_cache(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    path = flash_package.cache_path(SW_PATH, BOOT_PATH, cache_dir)
+    with flash_package.load_package(SW_PATH, BOOT_PATH, cache_dir) as package:
+        assert package.path == path
+        assert package.sw_path == SW_PATH and package.boot_path == BOOT_PATH
+        size = package.size
+    mtime = os.stat(path).st_mtime_ns
+    with flash_package.load_package(SW_PATH, BOOT_PATH, cache_dir) as package:
+        assert package.size == size
+    assert os.stat(path).st_mtime_ns == mtime
+
+    # a damaged cache entry is rebuilt
+    _corrupt(path)
+    with flash_package.load_package(SW_PATH, BOOT_PATH, cache_dir) as package:
+        assert package.size == size
+    flash_package.FlashPackage(path).close()
+
+
+def test_cache_follows_the_sources(tmp_path):
+    sw_path = str(tmp_path / "sw.s19")
+    shutil.copy(SW_PATH, sw_path)
+    first = flash_package.cache_path(sw_path, BOOT_PATH)
+    assert os.path.dirname(first) == os.environ["CCDIAG_FLASH_CACHE"]
+    with open(sw_path, "a") as fd:
+        fd.write("S5030000FC\n")
+    assert flash_package.cache_path(sw_path, BOOT_PATH) != first
@@ -0,0 +1,86 @@
+# -*- coding:utf-8 -*-
+#  test_flash_scheduler.py
+#
+#  ~~~~~~~~~~~~
+#
+#  FlashScheduler on the channels of the virtual devices
+#
+#  ~~~~~~~~~~~~
+#
+import os
+
+import pytest
+
+import flash_package
+import srecord
+from ccdiag_engine import CCDiagError
+from conftest import ROOT, SW_PATH, BOOT_PATH
+from flash_scheduler import FlashScheduler, parse_channels
+
+DEV_INFO_PATH = os.path.join(ROOT, "dev_info.json")
+
+
+@pytest.mark.parametrize("fd", [False, True])
+def test_fd_flag(fd):
+    scheduler = FlashScheduler([("ZCAN-VIRTUAL-FD", 0, 0)], DEV_INFO_PATH, fd=fd)
+    assert scheduler.fd is fd
+    with scheduler:
+        station = scheduler._stations[0]
+        assert station.target.is_fd is fd
+        assert station.sim.ecu("ESC").fd is fd
+
+
+def test_parse_channels():
+    assert parse_channels("ZCAN-VIRTUAL:0:3") == [("ZCAN-VIRTUAL", 0, 3)]
+    assert parse_channels("PCIE-CANFD-400U:1:0-2") == [("PCIE-CANFD-400U", 1, 0), ("PCIE-CANFD-400U", 1, 1),
+                                                        ("PCIE-CANFD-400U", 1, 2)]
+
+
+def test_unknown_channel():
+    scheduler = FlashScheduler([("ZCAN-VIRTUAL", 1, 8)], DEV_INFO_PATH)
+    with pytest.raises(CCDiagError):
+        scheduler.open()
+    assert scheduler._stations == [] and scheduler._devices == {}
+
+
+def test_failing_channel_does_not_stop_the_others():
+    seen = []
+
+    def flash(udsclient, image, report=None, journal=None, unchanged=(), **options):
+        with report.phase("program"):
+            response = bytes(udsclient.read_data_by_identifier([0xF18C]).service_data.values[0xF18C])
+            seen.append(response)
+            if response.endswith(b"2"):
+                raise RuntimeError("channel 1 is broken")
+
+    with flash_package.load_package(SW_PATH, BOOT_PATH) as image:
+        with FlashScheduler(parse_channels("ZCAN-VIRTUAL:1:0-2"), DEV_INFO_PATH) as scheduler:
+            report = scheduler.run(image, flash=flash)
+        size = image.size
+    assert sorted(seen) == [b"SN00000100000001", b"SN00000100000002", b"SN00000100000003"]
+    assert [r.ok for r in report.results] == [True, False, True]
+    assert "channel 1 is broken" in report.results[1].error
+    assert report.results[1].bytes == 0 and not report.results[1].timing.ok
+    assert report.passed == 2
+    assert report.total_bytes == 2 * size
+    assert report.throughput > 0
+    lines = list(report.lines())
+    assert len(lines) == 5 and "FAIL" in lines[2]
+    assert lines[-1].startswith("2/3 channel(s) flashed")
+    channels = report.to_dict()["channels"]
+    assert [c["channel"] for c in channels] == [0, 1, 2]
+    assert channels[0]["timing"]["phases"][0]["name"] == "identify"
+
+
+def test_parallel_flash():
+    with flash_package.load_package(SW_PATH, BOOT_PATH) as image:
+        with FlashScheduler(parse_channels("ZCAN-VIRTUAL-FD:1:0-1"), DEV_INFO_PATH, fd=True) as scheduler:
+            report = scheduler.run(image, resume=False)
+            ecus = [station.sim.ecu("ESC") for station in scheduler._stations]
+            for ecu in ecus:
+                for seg in srecord.load_segments(SW_PATH):
+                    assert bytes(ecu.memory[seg.address]) == bytes(seg.data)
+    assert report.passed == 2, [r.error for r in report.results]
+    # both channels ran at the same time
+    first, second = report.results
+    assert second.start < first.start + first.elapsed
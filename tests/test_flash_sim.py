@@ -0,0 +1,23 @@
+# -*- coding:utf-8 -*-
+#  test_flash_sim.py
+#
+#  ~~~~~~~~~~~~
+#
+#  full flash of the simulated ESC through CCDiagEngine.flash, over CAN FD to keep it short
+#
+#  ~~~~~~~~~~~~
+#
+import srecord
+
+from conftest import SW_PATH, BOOT_PATH
+
+
+def test_full_flash(fd_engine):
+    report = fd_engine.flash(SW_PATH, BOOT_PATH, resume=False).result()
+    assert report.ok, report.error
+    ecu = fd_engine.simulator.ecus[0]
+    for seg in srecord.load_segments(SW_PATH):
+        assert bytes(ecu.memory[seg.address]) == bytes(seg.data)
+    # fingerprint written with the 7 byte date codec of DIDList.json
+    assert len(ecu.dids[0xF199]) == 7
+    assert ecu.session == 1
@@ -0,0 +1,93 @@
+# -*- coding:utf-8 -*-
+#  test_flash_timing.py
+#
+#  ~~~~~~~~~~~~
+#
+#  FlashTimingReport phases, counters and TransferTiming block split
+#
+#  ~~~~~~~~~~~~
+#
+import json
+
+import pytest
+
+import flash_timing
+from flash_timing import FlashTimingReport, TransferTiming
+
+
+def report_of_a_flash():
+    counters = {"tx": 10, "rx": 4}
+
+    def read_counters():
+        return dict(counters)
+
+    report = FlashTimingReport("ESC", counters=read_counters).start()
+    with report.phase("RequestDownload", segment="0x00620000"):
+        pass
+    with report.phase("TransferData", 1024, "0x00620000"):
+        timing = report.transfer("0x00620000")
+        timing.add(0.001, 0.0, 0.002, 0.003)
+        timing.add(0.001, 0.001, 0.002, 0.005)
+    with report.phase("TransferData", 512, "0x00630000"):
+        pass
+    with pytest.raises(RuntimeError):
+        with report.phase("TransferData", 256, "0x00640000"):
+            raise RuntimeError("NRC 0x72")
+    counters.update(tx=110, rx=54, nrc78=2)
+    report.finish(False, "TransferData: NRC 0x72")
+    return report
+
+
+def test_transfer_timing():
+    timing = TransferTiming()
+    assert timing.totals() == {"prep": 0.0, "stall": 0.0, "bus": 0.0, "ecu_wait": 0.0}
+    timing.add(1.0, 2.0, 3.0, 4.0)
+    timing.add(1.0, 0.0, 1.0, 2.0)
+    assert timing.totals() == {"prep": 2.0, "stall": 2.0, "bus": 4.0, "ecu_wait": 6.0}
+    lines = list(timing.lines())
+    assert lines[0] == "2 TransferData block(s)"
+    assert len(lines) == 5
+
+
+def test_phases():
+    report = report_of_a_flash()
+    assert [p.ok for p in report.phases] == [True, True, True, False]
+    assert report.phases[3].segment == "0x00640000"
+    assert all(p.elapsed >= 0 for p in report.phases)
+    assert report.phases[0].start <= report.phases[1].start <= report.phases[2].start
+    # the failed block is not counted as downloaded
+    assert report.bytes == 1536
+    assert not report.ok and report.error == "TransferData: NRC 0x72"
+    assert report.counters == {"tx": 100, "rx": 50, "nrc78": 2}
+    summary = report.summary()
+    assert [(name, count, nbytes) for name, count, _, nbytes in summary] == [
+        ("RequestDownload", 1, 0), ("TransferData", 3, 1792)]
+
+
+def test_no_report():
+    with flash_timing.phase(None, "TransferData", 16) as p:
+        assert p is None
+
+
+def test_to_dict_and_dump(tmp_path):
+    report = report_of_a_flash()
+    report.skipped = ["boot"]
+    path = str(tmp_path / "timing.json")
+    report.dump(path)
+    with open(path) as fd:
+        data = json.load(fd)
+    assert data == json.loads(json.dumps(report.to_dict()))
+    assert data["bytes"] == 1536 and data["skipped"] == ["boot"]
+    assert [p["name"] for p in data["phases"]] == ["RequestDownload"] + ["TransferData"] * 3
+    transfer = data["transfers"][0]
+    assert transfer["segment"] == "0x00620000" and transfer["blocks"] == 2
+    assert transfer["block_max"] == pytest.approx(0.008)
+
+
+def test_lines():
+    report = report_of_a_flash()
+    lines = list(report.lines())
+    assert lines[0].startswith("ESC flash FAIL (TransferData: NRC 0x72)")
+    assert lines[-1] == "nrc78:2  rx:50  tx:100"
+    assert any(line.startswith("TransferData") and " 3 " in line for line in lines)
+    assert any(line.startswith("0x00620000") for line in lines)
@@ -0,0 +1,96 @@
+# -*- coding:utf-8 -*-
+#  test_isotp_connection.py
+#
+#  ~~~~~~~~~~~~
+#
+#  event driven IsoTpConnection: two connections whose ISO-TP layers exchange frames in memory
+#
+#  ~~~~~~~~~~~~
+#
+import collections
+import time
+
+import isotp
+import pytest
+
+from ccdiag_engine import IsoTpConnection
+
+PARAMS = {'stmin' : 0, 'blocksize' : 8, 'tx_padding' : 0}
+
+
+class Link(object):
+    """
+    frames sent by one layer are queued for the other, which is woken by notify_rx()
+    """
+    def __init__(self, event_driven):
+        queues = collections.deque(), collections.deque()
+        self.process_calls = 0
+        self.tester = self._connection(0x7E0, 0x7E8, queues[0], queues[1], event_driven)
+        self.ecu = self._connection(0x7E8, 0x7E0, queues[1], queues[0], event_driven)
+
+    def _connection(self, txid, rxid, rx, tx, event_driven):
+        def rxfn():
+            return rx.popleft() if rx else None
+
+        def txfn(msg):
+            tx.append(msg)
+            peer = self.ecu if conn is self.tester else self.tester
+            peer.notify_rx()
+
+        layer = isotp.TransportLayer(rxfn=rxfn, txfn=txfn, params=PARAMS,
+                                     address=isotp.Address(isotp.AddressingMode.Normal_11bits, txid=txid, rxid=rxid))
+        process = layer.process
+
+        def counted_process():
+            self.process_calls += 1
+            return process()
+        layer.process = counted_process
+        conn = IsoTpConnection(layer, event_driven=event_driven)
+        return conn
+
+    def open(self):
+        self.tester.open()
+        self.ecu.open()
+        return self
+
+    def close(self):
+        self.tester.close()
+        self.ecu.close()
+
+
+@pytest.fixture
+def link():
+    link = Link(event_driven=True).open()
+    yield link
+    link.close()
+
+
+def test_multi_frame_exchange(link):
+    request = bytes(range(200))
+    t0 = time.perf_counter()
+    link.tester.send(request)
+    assert link.ecu.wait_frame(1) == request
+    assert link.tester.tx_done_time is not None and link.tester.tx_done_time >= t0
+    link.ecu.send(b'\x7F\x36\x78')
+    link.ecu.send(b'\x76' + bytes(100))
+    assert link.tester.wait_frame(1) == b'\x7F\x36\x78'
+    assert link.tester.wait_frame(1) == b'\x76' + bytes(100)
+    assert link.tester.response_pending == 1
+
+
+def test_idle_worker_sleeps(link):
+    link.tester.send(b'\x3E\x00')
+    assert link.ecu.wait_frame(1) == b'\x3E\x00'
+    calls = link.process_calls
+    time.sleep(0.3)
+    # polling every 0.1 ms would be thousands of passes
+    assert link.process_calls - calls < 50
+
+
+def test_polling_mode():
+    link = Link(event_driven=False).open()
+    try:
+        link.tester.send(bytes(50))
+        assert link.ecu.wait_frame(1) == bytes(50)
+    finally:
+        link.close()
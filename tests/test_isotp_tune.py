@@ -0,0 +1,27 @@
+# -*- coding:utf-8 -*-
+#  test_isotp_tune.py
+#
+#  ~~~~~~~~~~~~
+#
+#  flow control tuning of the simulated ESC, its cache and forget_tuning
+#
+#  ~~~~~~~~~~~~
+#
+import isotp_tune
+
+
+def test_tune_and_forget(engine):
+    target = engine.targets["ESC"]
+    default = target.flow_control
+    result = engine.tune_isotp(rounds=1).result()
+    assert result.throughput >= result.baseline
+    # the kept step is the fastest one that passed
+    assert result.throughput == max(rate for _, _, rate, _ in result.steps if rate is not None)
+    assert target.flow_control == (result.stmin, result.blocksize)
+    assert target.tuned
+    assert isotp_tune.IsoTpTuneStore().load("ESC")["stmin"] == result.stmin
+
+    engine.forget_tuning("ESC")
+    assert isotp_tune.IsoTpTuneStore().load("ESC") is None
+    assert target.flow_control == default
+    assert not target.tuned
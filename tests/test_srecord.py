@@ -0,0 +1,77 @@
+# -*- coding:utf-8 -*-
+#  test_srecord.py
+#
+#  ~~~~~~~~~~~~
+#
+#  S-record parsing: segment merging, record types and the errors of malformed files
+#
+#  ~~~~~~~~~~~~
+#
+import io
+
+import pytest
+
+import srecord
+
+
+def record(rtype, address, data, addr_len):
+    body = bytes([addr_len + len(data) + 1]) + address.to_bytes(addr_len, 'big') + bytes(data)
+    return "S%s%s%02X" % (rtype, body.hex().upper(), 0xFF - (sum(body) & 0xFF))
+
+
+def parse(*lines):
+    return srecord.read_segments(io.StringIO("\n".join(lines) + "\n"))
+
+
+def test_contiguous_records_merge():
+    segments = parse(record('0', 0, b'HDR', 2),
+                     record('1', 0x1000, b'\x01\x02\x03\x04', 2),
+                     record('1', 0x1004, b'\x05\x06', 2),
+                     record('9', 0x1000, b'', 2))
+    assert len(segments) == 1
+    assert segments[0].address == 0x1000
+    assert bytes(segments[0].data) == b'\x01\x02\x03\x04\x05\x06'
+    assert segments[0].size == 6 and segments[0].end == 0x1006
+
+
+def test_gap_starts_new_segment():
+    segments = parse(record('3', 0x00620000, b'\xAA' * 16, 4),
+                     record('3', 0x00620010, b'\xBB' * 4, 4),
+                     record('2', 0xFFFF00, b'\x01\x02\x03\x04', 3),
+                     record('7', 0x00620000, b'', 4))
+    assert [(s.address, s.size) for s in segments] == [(0x00620000, 20), (0xFFFF00, 4)]
+    assert bytes(segments[0].data) == b'\xAA' * 16 + b'\xBB' * 4
+
+
+def test_blank_lines_are_ignored():
+    segments = parse("", record('1', 0x10, b'\x42', 2), "   ")
+    assert bytes(segments[0].data) == b'\x42'
+
+
+def test_checksum_error():
+    line = record('1', 0x1000, b'\x01\x02', 2)
+    bad = line[:-2] + "%02X" % ((int(line[-2:], 16) + 1) & 0xFF)
+    with pytest.raises(srecord.SRecordError) as e:
+        parse(record('1', 0x0FFE, b'\x00\x00', 2), bad)
+    assert e.value.lineno == 2
+    assert "checksum" in str(e.value)
+
+
+@pytest.mark.parametrize("line, message", [
+    ("X1130000", "not an S-record"),
+    ("S4050000000000", "unknown record type"),
+    ("S105ZZ00000000", "invalid hex"),
+    ("S10600000000F9", "byte count"),
+])
+def test_malformed_records(line, message):
+    with pytest.raises(srecord.SRecordError) as e:
+        parse(line)
+    assert message in str(e.value)
+
+
+def test_image_files_load():
+    from conftest import SW_PATH, BOOT_PATH
+    sw = srecord.load_segments(SW_PATH)
+    boot = srecord.load_segments(BOOT_PATH)
+    assert [(s.address, s.size) for s in sw] == [(0x00620000, 1313816), (0xFFFF00, 4)]
+    assert boot[0].address == 0x00620000 and len(boot) == 12
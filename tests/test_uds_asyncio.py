@@ -0,0 +1,84 @@
+# -*- coding:utf-8 -*-
+#  test_uds_asyncio.py
+#
+#  ~~~~~~~~~~~~
+#
+#  AsyncUdsClient conversations with the simulated ECUs, errors of the transport layer task
+#
+#  ~~~~~~~~~~~~
+#
+import asyncio
+
+import pytest
+
+from conftest import open_engine
+
+
+@pytest.fixture
+def async_engine():
+    engine = open_engine(uds=False)
+    yield engine
+    engine.close()
+
+
+def run(engine, body, targets=("ESC",)):
+    async def main():
+        channel = engine.async_channel().start()
+        clients = [engine.async_client(channel, target) for target in targets]
+        try:
+            for client in clients:
+                client.conn.open()
+            return await body(*clients)
+        finally:
+            for client in clients:
+                await client.conn.close()
+            channel.stop()
+    return asyncio.run(main())
+
+
+def test_concurrent_conversations(async_engine):
+    async def body(esc, eps):
+        async def conversation(client):
+            await client.change_session(3)
+            await client.unlock_security_access(1)
+            response = await client.read_data_by_identifier(0xF195)
+            await client.change_session(1)
+            return response.service_data.values[0xF195]
+        return await asyncio.gather(conversation(esc), conversation(eps))
+
+    values = run(async_engine, body, ("ESC", "EPS"))
+    expected = [async_engine.did_registry.codecs()[0xF195].decode(async_engine.simulator.ecu(name).dids[0xF195])
+                for name in ("ESC", "EPS")]
+    assert values == expected
+    assert [async_engine.simulator.ecu(name).session for name in ("ESC", "EPS")] == [1, 1]
+
+
+def test_transport_error_reaches_the_request(async_engine):
+    async def body(esc):
+        process = esc.conn.layer.process
+        calls = []
+
+        def failing_process(*args, **kwargs):
+            if not calls:
+                calls.append(1)
+                raise ValueError("bad frame")
+            return process(*args, **kwargs)
+
+        esc.conn.layer.process = failing_process
+        esc.conn._wakeup.set()
+        with pytest.raises(ValueError):
+            await esc.conn.wait_frame(1)
+        # the task survived the error
+        await esc.change_session(3)
+        return esc.conn._task.done()
+
+    assert run(async_engine, body) is False
+
+
+def test_send_needs_open(async_engine):
+    async def main():
+        conn = async_engine.async_client(async_engine.async_channel(), "ESC").conn
+        with pytest.raises(RuntimeError):
+            conn.send(b'\x10\x03')
+
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+# -*- coding:utf-8 -*-
+#  test_uds_flash.py
+#
+#  ~~~~~~~~~~~~
+#
+#  TransferData blocks of uds_flash and downloads to the simulated ESC
+#
+#  ~~~~~~~~~~~~
+#
+import threading
+
+import pytest
+from udsoncan import MemoryLocation
+from udsoncan.exceptions import NegativeResponseException
+
+import ecu_sim
+import uds_flash
+from flash_timing import FlashTimingReport
+
+ADDRESS = 0x00620000
+
+
+def download(engine, data, block_len=16, **options):
+    """
+    download data to the ESC in block_len byte blocks, the flash driver RAM of the simulator holds it
+    """
+    ecu = engine.simulator.ecu("ESC")
+    ecu.max_block_length = block_len + uds_flash.TRANSFER_DATA_OVERHEAD
+    location = MemoryLocation(ADDRESS, len(data), address_format=32, memorysize_format=32)
+
+    def run(client):
+        client.change_session(ecu_sim.EXTENDED_SESSION)
+        client.change_session(ecu_sim.PROGRAMMING_SESSION)
+        client.unlock_security_access(0x11)
+        uds_flash.download_segment(client, location, data, **options)
+    engine.submit(run, engine.targets["ESC"].udsclient).result()
+    return ecu.ram[ADDRESS]
+
+
+def test_block_data_len():
+    assert uds_flash.block_data_len(0x402) == 0x400
+    with pytest.raises(ValueError):
+        uds_flash.block_data_len(2)
+
+
+def test_iter_blocks_wrap():
+    data = bytearray(range(256)) * 2
+    blocks = list(uds_flash.iter_blocks(data, 2))
+    assert len(blocks) == 256
+    assert [seq for seq, _ in blocks[253:]] == [0xFE, 0xFF, 0x00]
+    assert blocks[0][0] == 1
+    assert b"".join(bytes(block) for _, block in blocks) == bytes(data)
+    # views of data, not copies
+    data[0] = 0xAA
+    assert blocks[0][1][0] == 0xAA
+
+
+def test_iter_blocks_last_block():
+    blocks = list(uds_flash.iter_blocks(b'\x01' * 10, 4))
+    assert [(seq, len(block)) for seq, block in blocks] == [(1, 4), (2, 4), (3, 2)]
+    assert list(uds_flash.iter_blocks(b'', 4)) == []
+
+
+def test_download_wraps_the_sequence_counter(engine):
+    data = bytes(i * 7 & 0xFF for i in range(16 * 300))
+    assert bytes(download(engine, data)) == data
+
+
+def test_flash_image_blocks_shared(tmp_path):
+    sw = tmp_path / "sw.s19"
+    sw.write_text("S00600004844521B\nS1130000000102030405060708090A0B0C0D0E0F74\nS9030000FC\n")
+    image = uds_flash.FlashImage(str(sw), str(sw))
+    segment = image.sw_segments[0]
+    blocks = image.blocks(segment, 6)
+    assert image.blocks(segment, 6) is blocks
+    assert [(seq, bytes(block)) for seq, block in blocks] == [(1, bytes(range(6))), (2, bytes(range(6, 12))),
+                                                              (3, bytes(range(12, 16)))]
+    assert image.size == 32
+
+
+def test_pipelined_download(engine):
+    data = bytes(i * 13 & 0xFF for i in range(16 * 40 + 5))
+    report = FlashTimingReport("ESC").start()
+    assert bytes(download(engine, data, pipeline=True, report=report)) == data
+    assert [p.name for p in report.phases] == ["RequestDownload", "TransferData", "TransferExit"]
+    assert all(p.ok for p in report.phases)
+    assert report.bytes == len(data)
+    segment, timing = report.transfers[0]
+    assert segment == "0x%08X" % ADDRESS
+    assert len(timing.blocks) == 41
+
+
+def test_pipelined_producer_error():
+    def requests():
+        yield "request", 0.0
+        raise ValueError("bad block")
+
+    items = uds_flash._pipelined(requests(), uds_flash.PIPELINE_DEPTH)
+    assert next(items)[0] == "request"
+    with pytest.raises(ValueError, match="bad block"):
+        next(items)
+
+
+def test_pipelined_nrc_stops_the_producer(engine):
+    ecu = engine.simulator.ecu("ESC")
+    ecu.inject_nrc(0x36, 0x72, after=5)
+    engine.submit(lambda: None).result()
+    threads = threading.active_count()
+    data = bytes(16 * 50)
+    with pytest.raises(NegativeResponseException) as e:
+        download(engine, data, pipeline=True)
+    assert e.value.response.code == 0x72
+    # the producer was joined when the transfer failed
+    assert threading.active_count() == threads
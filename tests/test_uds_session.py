@@ -0,0 +1,66 @@
+# -*- coding:utf-8 -*-
+#  test_uds_session.py
+#
+#  ~~~~~~~~~~~~
+#
+#  session and security cache of SessionClient against the simulated ESC
+#
+#  ~~~~~~~~~~~~
+#
+import uds_session
+
+
+def run(engine, fn, *args):
+    return engine.submit(fn, *args).result()
+
+
+def test_ensure_skips_known_state(engine):
+    client = engine.targets["ESC"].udsclient
+    ecu = engine.simulator.ecu("ESC")
+    run(engine, client.ensure, 3, 1)
+    assert client.state.session == 3 and client.state.level == 1
+    requests, skipped = ecu.requests, client.state.skipped
+    run(engine, client.ensure, 3, 1)
+    assert ecu.requests == requests
+    assert client.state.skipped == skipped + 2
+    # level 2 is the sendKey of level 1
+    run(engine, client.ensure, 3, 2)
+    assert ecu.requests == requests
+
+
+def test_s3_expiry_sends_again(engine):
+    client = engine.targets["ESC"].udsclient
+    ecu = engine.simulator.ecu("ESC")
+    run(engine, client.ensure, 3, 1)
+    client.state.last_activity -= uds_session.S3_SERVER_S
+    assert not client.state.alive()
+    requests = ecu.requests
+    run(engine, client.ensure, 3, 1)
+    assert ecu.requests == requests + 3          # 0x10, 0x27 seed, 0x27 key
+    assert client.state.alive()
+
+
+def test_in_session_recovers_lost_state(engine):
+    client = engine.targets["ESC"].udsclient
+    ecu = engine.simulator.ecu("ESC")
+    run(engine, client.ensure, 3, 1)
+    ecu.reset()                                 # power cycle behind our back
+    response = run(engine, client.in_session, 3, 1, client.start_routine, 0xF001)
+    assert response.positive
+    assert ecu.session == 3 and client.state.session == 3
+
+
+def test_ecu_reset_clears_state(engine):
+    client = engine.targets["ESC"].udsclient
+    run(engine, client.ensure, 3, 1)
+    run(engine, client.ecu_reset, 1)
+    assert client.state.session == uds_session.DEFAULT_SESSION
+    assert client.state.level is None
+
+
+def test_client_p2_timeout(engine):
+    client = engine.targets["ESC"].udsclient
+    p2 = client.session_timing['p2_server_max']
+    with uds_session.client_p2_timeout(client):
+        assert client.session_timing['p2_server_max'] is None
+    assert client.session_timing['p2_server_max'] == p2
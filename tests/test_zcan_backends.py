@@ -0,0 +1,225 @@
+# -*- coding:utf-8 -*-
+#  test_zcan_backends.py
+#
+#  ~~~~~~~~~~~~
+#
+#  ZCAN driver backends: backend selection, the virtual bus, the vendor library prototypes
+#  against a stub library built with cc,
+#  the SocketCAN backend on a vcan interface (ZCAN_TEST_VCAN, default vcan0), both skipped
+#  when there is no compiler / no vcan interface
+#
+#  ~~~~~~~~~~~~
+#
+import os
+import platform
+import shutil
+import socket
+import struct
+import subprocess
+from ctypes import CDLL, c_void_p, c_uint
+
+import pytest
+
+import zlgcan
+from zlgcan import (ZCAN, ZCAN_CHANNEL_INIT_CONFIG, ZCAN_Receive_Data, ZCAN_Transmit_Data, ZCAN_ReceiveFD_Data,
+                    ZCAN_TransmitFD_Data, ZCANSocketCANDriver, ZCANVirtualDriver, ZCAN_USBCANFD_200U,
+                    ZCAN_VIRTUAL_DEVICE, ZCAN_STATUS_OK, ZCAN_STATUS_ERR, INVALID_CHANNEL_HANDLE)
+
+VCAN = os.environ.get("ZCAN_TEST_VCAN", "vcan0")
+CAN_FRAME   = struct.Struct("=IB3x8s")       # struct can_frame
+CANFD_FRAME = struct.Struct("=IBB2x64s")     # struct canfd_frame, flags 0x01: bit rate switch
+
+
+def test_open_backend(monkeypatch):
+    monkeypatch.setenv("ZCAN_BACKEND", "virtual")
+    assert isinstance(zlgcan.open_backend(), ZCANVirtualDriver)
+    assert isinstance(zlgcan.open_backend("socketcan", interfaces=["vcan0"]), ZCANSocketCANDriver)
+    with pytest.raises(KeyError):
+        zlgcan.open_backend("pcan")
+
+
+def virtual_channel(zcan, dev_index, fd):
+    config = ZCAN_CHANNEL_INIT_CONFIG()
+    config.can_type = 1 if fd else 0
+    chn_handle = zcan.InitCAN(zcan.OpenDevice(ZCAN_VIRTUAL_DEVICE, dev_index, 0), 0, config)
+    assert zcan.StartCAN(chn_handle) == ZCAN_STATUS_OK
+    return chn_handle
+
+
+def test_virtual_bus():
+    zcan = ZCANVirtualDriver(bus_names={(0, 0): "test_virtual_bus", (1, 0): "test_virtual_bus",
+                                        (2, 0): "test_virtual_bus"})
+    fd_node, node, classic_node = virtual_channel(zcan, 0, True), virtual_channel(zcan, 1, True), virtual_channel(zcan, 2, False)
+    try:
+        tx = (ZCAN_Transmit_Data * 2)()
+        for i in range(2):
+            tx[i].frame.can_id = 0x7E0 + i
+            tx[i].frame.can_dlc = 8
+            tx[i].frame.data[0] = i
+        tx[1].transmit_type = 2             # self send and receive
+        fd_tx = (ZCAN_TransmitFD_Data * 1)()
+        fd_tx[0].frame.can_id = 0x7E8
+        fd_tx[0].frame.len = 64
+        assert zcan.Transmit(fd_node, tx, 2) == 2
+        assert zcan.TransmitFD(fd_node, fd_tx, 1) == 1
+
+        # the sender only gets its self receive frame, a classic channel no FD frame
+        assert zcan.GetReceiveNum(fd_node) == 1
+        assert zcan.GetReceiveNum(node) == 2 and zcan.GetReceiveNum(node, 1) == 1
+        assert zcan.GetReceiveNum(classic_node) == 2 and zcan.GetReceiveNum(classic_node, 1) == 0
+        msgs, num = zcan.Receive(node, 8, 0)
+        assert [(msgs[i].frame.can_id, msgs[i].frame.data[0]) for i in range(num)] == [(0x7E0, 0), (0x7E1, 1)]
+        msgs, num = zcan.ReceiveFD(node, 8, 0, (ZCAN_ReceiveFD_Data * 8)())
+        assert num == 1 and msgs[0].frame.len == 64
+        # nothing left: the wait times out
+        assert zcan.Receive(node, 8, 20)[1] == 0
+        assert zcan.ClearBuffer(classic_node) == ZCAN_STATUS_OK
+        assert zcan.GetReceiveNum(classic_node) == 0
+    finally:
+        for chn_handle in (fd_node, node, classic_node):
+            zcan.ResetCAN(chn_handle)
+    assert zcan.ResetCAN(node) == ZCAN_STATUS_ERR
+    assert zcan.Transmit(node, tx, 1) == 0
+    assert zcan.InitCAN(99, 0, ZCAN_CHANNEL_INIT_CONFIG()) == INVALID_CHANNEL_HANDLE
+
+
+def test_rx_count():
+    assert zlgcan._rx_count(0xFFFFFFFF, 64) == 0
+    assert zlgcan._rx_count(64, 64) == 64
+
+# handles above 4 GB, as 64 bit libraries return them: truncated by a missing restype
+STUB_SOURCE = r"""
+#include <stdint.h>
+typedef struct { unsigned int id; unsigned char dlc, pad, res0, res1; unsigned char data[8]; } frame_t;
+typedef struct { frame_t frame; unsigned long long timestamp; } rx_t;
+typedef struct { frame_t frame; unsigned int transmit_type; } tx_t;
+
+static void *channel;
+static unsigned int tx_ids;
+
+void *ZCAN_OpenDevice(unsigned int t, unsigned int i, unsigned int r) { return (void *)(0x7F0000001000ULL + i); }
+unsigned int ZCAN_CloseDevice(void *h) { return h == (void *)0x7F0000001000ULL; }
+unsigned int ZCAN_GetDeviceInf(void *h, void *info) { return 1; }
+unsigned int ZCAN_IsDeviceOnLine(void *h) { return 2; }
+void *ZCAN_InitCAN(void *h, unsigned int c, void *cfg) { return (void *)((uintptr_t)h + 0x1000 + c); }
+unsigned int ZCAN_StartCAN(void *c) { return 1; }
+unsigned int ZCAN_ResetCAN(void *c) { return 1; }
+unsigned int ZCAN_ClearBuffer(void *c) { return 1; }
+unsigned int ZCAN_ReadChannelErrInfo(void *c, void *e) { return 1; }
+unsigned int ZCAN_ReadChannelStatus(void *c, void *s) { return 1; }
+unsigned int ZCAN_GetReceiveNum(void *c, unsigned char t) { channel = c; return 20 + t; }
+unsigned int ZCAN_Transmit(void *c, tx_t *m, unsigned int n) {
+    unsigned int i;
+    channel = c;
+    for (i = 0; i < n; i++) tx_ids += m[i].frame.id;
+    return n;
+}
+unsigned int ZCAN_Receive(void *c, rx_t *m, unsigned int n, int w) {
+    unsigned int i;
+    channel = c;
+    for (i = 0; i < n; i++) { m[i].frame.id = 0x700 + i; m[i].frame.dlc = 8; m[i].timestamp = (unsigned long long)w; }
+    return n;
+}
+unsigned int ZCAN_TransmitFD(void *c, void *m, unsigned int n) { return n; }
+unsigned int ZCAN_ReceiveFD(void *c, void *m, unsigned int n, int w) { return 0; }
+void *GetIProperty(void *h) { return 0; }
+unsigned int ReleaseIProperty(void *p) { return 1; }
+void *last_channel(void) { return channel; }
+unsigned int transmitted_ids(void) { return tx_ids; }
+"""
+
+
+@pytest.fixture(scope="module")
+def stub_lib(tmp_path_factory):
+    cc = os.environ.get("CC", "cc")
+    if platform.system() == "Windows" or shutil.which(cc) is None:
+        pytest.skip("no C compiler")
+    work_dir = tmp_path_factory.mktemp("zcan_stub")
+    src, lib = str(work_dir / "zlgcan_stub.c"), str(work_dir / "libzlgcan_stub.so")
+    with open(src, "w") as fd:
+        fd.write(STUB_SOURCE)
+    subprocess.check_call([cc, "-shared", "-fPIC", "-o", lib, src])
+    return lib
+
+
+def test_vendor_library_prototypes(stub_lib):
+    zcan = ZCAN(stub_lib)
+    stub = CDLL(stub_lib)
+    stub.last_channel.restype = c_void_p
+    stub.transmitted_ids.restype = c_uint
+
+    dev_handle = zcan.OpenDevice(ZCAN_USBCANFD_200U, 0, 0)
+    assert dev_handle == 0x7F0000001000
+    chn_handle = zcan.InitCAN(dev_handle, 1, ZCAN_CHANNEL_INIT_CONFIG())
+    assert chn_handle == 0x7F0000002001
+    assert zcan.GetReceiveNum(chn_handle) == 20
+    assert zcan.GetReceiveNum(chn_handle, 1) == 21
+    assert stub.last_channel() == chn_handle
+
+    rx_msgs = (ZCAN_Receive_Data * 4)()
+    msgs, num = zcan.Receive(chn_handle, 4, 25, rx_msgs)
+    assert msgs is rx_msgs and num == 4
+    assert [m.frame.can_id for m in rx_msgs] == [0x700, 0x701, 0x702, 0x703]
+    assert rx_msgs[3].timestamp == 25
+
+    tx_msgs = (ZCAN_Transmit_Data * 3)()
+    for i in range(3):
+        tx_msgs[i].frame.can_id = 0x100 << i
+    assert zcan.Transmit(chn_handle, tx_msgs, 3) == 3
+    assert stub.transmitted_ids() == 0x700
+    assert stub.last_channel() == chn_handle
+
+    # the channel boxes go with their device
+    assert zcan._ZCAN__chn_handles
+    assert zcan.CloseDevice(dev_handle) == 1
+    assert not zcan._ZCAN__chn_handles
+
+
+def vcan_socket():
+    try:
+        sock = socket.socket(socket.PF_CAN, socket.SOCK_RAW, socket.CAN_RAW)
+    except (AttributeError, OSError):
+        pytest.skip("no SocketCAN")
+    try:
+        sock.setsockopt(socket.SOL_CAN_RAW, socket.CAN_RAW_FD_FRAMES, 1)
+        sock.bind((VCAN,))
+    except OSError:
+        sock.close()
+        pytest.skip("no %s interface" % VCAN)
+    return sock
+
+
+@pytest.mark.skipif(platform.system() == "Windows", reason="zlgcan.dll is the default on Windows")
+def test_vendor_library_required():
+    with pytest.raises(OSError):
+        ZCAN()
+
+
+@pytest.mark.parametrize("recvmmsg", [True, False])
+def test_socketcan_receive_fd_drops_classic_frames(recvmmsg):
+    sender = vcan_socket()
+    zcan = ZCANSocketCANDriver([VCAN])
+    if not recvmmsg:
+        zcan._recvmmsg = None
+    dev_handle = zcan.OpenDevice(0, 0, 0)
+    config = ZCAN_CHANNEL_INIT_CONFIG()
+    config.can_type = 1
+    chn_handle = zcan.InitCAN(dev_handle, 0, config)
+    assert chn_handle != zlgcan.INVALID_CHANNEL_HANDLE
+    try:
+        sender.send(CAN_FRAME.pack(0x7E0, 8, b'\x02\x10\x03' + b'\x00' * 5))
+        sender.send(CANFD_FRAME.pack(0x7E1, 64, 0x01, bytes(range(64))))
+        sender.send(CAN_FRAME.pack(0x7E2, 2, b'\x3E\x00'))
+
+        msgs, num = zcan.ReceiveFD(chn_handle, 8, 200)
+        assert num == 1
+        assert msgs[0].frame.can_id == 0x7E1
+        assert msgs[0].frame.len == 64
+        assert bytes(msgs[0].frame.data) == bytes(range(64))
+
+        msgs, num = zcan.Receive(chn_handle, 8, 200)
+        assert [msgs[i].frame.can_id for i in range(num)] == [0x7E0, 0x7E2]
+    finally:
+        zcan.ResetCAN(chn_handle)
+        zcan.CloseDevice(dev_handle)
+        sender.close()
@@ -0,0 +1,187 @@
+# -*- coding:utf-8 -*-
+#  test_zcan_isotp.py
+#
+#  ~~~~~~~~~~~~
+#
+#  ZCANDispatcher / ZCANTxRing between two channels of one virtual bus, ZCANTxRing on a
+#  driver that counts the Transmit calls, ZCANDispatcher on one that hands out prepared batches,
+#  the CCDiagEngine targets sharing one dispatcher
+#
+#  ~~~~~~~~~~~~
+#
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from isotp import CanMessage
+
+from zlgcan import *
+from zcan_isotp import ZCANDispatcher, ZCANTxRing, RX_BATCH_MIN
+
+_bus_ids = itertools.count()
+
+
+def open_channel(zcan, dev_index, fd):
+    cfg = ZCAN_CHANNEL_INIT_CONFIG()
+    cfg.can_type = 1 if fd else 0
+    chn = zcan.InitCAN(zcan.OpenDevice(ZCAN_VIRTUAL_DEVICE, dev_index, 0), 0, cfg)
+    zcan.StartCAN(chn)
+    return chn
+
+
+@pytest.fixture(params=[False, True], ids=["can", "canfd"])
+def link(request):
+    bus = "test_zcan_isotp%d" % next(_bus_ids)
+    zcan = ZCANVirtualDriver(bus_names={(0, 0): bus, (1, 0): bus})
+    tx = ZCANTxRing(zcan, open_channel(zcan, 0, request.param))
+    dispatcher = ZCANDispatcher(zcan, open_channel(zcan, 1, request.param), fd=request.param).start()
+    yield tx, dispatcher, request.param
+    dispatcher.stop()
+
+
+def wait_for(queue, count, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while queue.rx_frames < count and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+def test_route_by_id_and_eff(link):
+    tx, dispatcher, fd = link
+    std = dispatcher.subscribe(0x7E8)
+    ext = dispatcher.subscribe(0x7E8, extended=True)
+    tx.send(CanMessage(arbitration_id=0x7E8, dlc=1, data=b'\x01', is_fd=fd))
+    tx.send(CanMessage(arbitration_id=0x7E8, dlc=2, data=b'\x02\x02', extended_id=True, is_fd=fd))
+    tx.send(CanMessage(arbitration_id=0x7E8, dlc=1, data=b'\x03', is_fd=fd))
+    tx.flush()
+    wait_for(std, 2)
+    wait_for(ext, 1)
+
+    assert [bytes(m.data) for m in iter(std.recv, None)] == [b'\x01', b'\x03']
+    msg = ext.recv()
+    assert bytes(msg.data) == b'\x02\x02' and msg.is_extended_id and msg.is_fd == fd
+    assert ext.recv() is None
+
+
+def test_detach_and_unrouted(link):
+    tx, dispatcher, fd = link
+    queue = dispatcher.subscribe(0x18DAF100, extended=True)
+    dispatcher.detach(queue)
+    tx.send(CanMessage(arbitration_id=0x18DAF100, dlc=1, data=b'\x01', extended_id=True, is_fd=fd))
+    tx.flush()
+    deadline = time.monotonic() + 2.0
+    while dispatcher.dropped < 1 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert dispatcher.dropped == 1
+    assert queue.recv() is None
+
+
+class TransmitDriver(object):
+    def __init__(self, ret=None):
+        self.ret   = ret
+        self.calls = []
+
+    def Transmit(self, chn_handle, msgs, num):
+        self.calls.append([(msgs[i].frame.can_id, bytes(msgs[i].frame.data[:msgs[i].frame.can_dlc])) for i in range(num)])
+        return num if self.ret is None else self.ret
+
+    TransmitFD = Transmit
+
+
+def test_tx_ring_batches():
+    zcan = TransmitDriver()
+    tx = ZCANTxRing(zcan, 1, size=4)
+    for i in range(6):
+        tx.send(CanMessage(arbitration_id=0x7E0, dlc=8, data=bytes([0x21 + i]) * 8))
+    # full ring: the first four went out in one call, the rest wait for flush
+    assert [len(c) for c in zcan.calls] == [4]
+    tx.flush()
+    assert [len(c) for c in zcan.calls] == [4, 2]
+    assert [data[0] for call in zcan.calls for _, data in call] == [0x21, 0x22, 0x23, 0x24, 0x25, 0x26]
+    assert (tx.tx_calls, tx.tx_frames, tx.tx_errors) == (2, 6, 0)
+    tx.flush()
+    assert tx.tx_calls == 2
+
+
+@pytest.mark.parametrize("ret", [0xFFFFFFFF, 1])
+def test_tx_ring_errors(ret):
+    zcan = TransmitDriver(ret)
+    failed, tapped = [], []
+    tx = ZCANTxRing(zcan, 1, on_error=failed.append)
+    tx.add_tap(lambda msgs, num: tapped.append(num))
+    for i in range(3):
+        tx.send(CanMessage(arbitration_id=0x7E0, dlc=8, data=b'\x00' * 8))
+    tx.flush()
+    sent = 1 if ret == 1 else 0
+    assert (tx.tx_frames, tx.tx_errors) == (sent, 3 - sent)
+    assert failed == [3 - sent]
+    assert tapped == ([sent] if sent else [])
+
+
+class ReceiveDriver(object):
+    """
+    Receive fills the array with the frames of the next batch, or returns ret
+    """
+    def __init__(self):
+        self.batches = []
+        self.sizes   = []
+
+    def Receive(self, chn_handle, rcv_num, wait_time, rcv_msgs):
+        self.sizes.append(rcv_num)
+        frames = self.batches.pop(0) if self.batches else []
+        if isinstance(frames, int):
+            return rcv_msgs, frames
+        n = min(len(frames), rcv_num)
+        for i, (can_id, data) in enumerate(frames[:n]):
+            rcv_msgs[i].frame.can_id = can_id
+            rcv_msgs[i].frame.eff = 0
+            rcv_msgs[i].frame.can_dlc = len(data)
+            rcv_msgs[i].frame.data[0:len(data)] = list(data)
+        return rcv_msgs, n
+
+
+def test_batched_receive():
+    zcan = ReceiveDriver()
+    dispatcher = ZCANDispatcher(zcan, 1)
+    woken = []
+    queue = dispatcher.subscribe(0x7E8, on_rx=lambda: woken.append(1))
+    tapped = []
+    dispatcher.add_tap(lambda msgs, num: tapped.append(num))
+    zcan.batches = [[(0x7E8, b'\x10\x14'), (0x7E9, b'\x01'), (0x7E8, b'\x21\x01')]]
+    assert dispatcher._dispatch(zcan.Receive, dispatcher._rcv_msgs, 0, False) == 3
+    # one wakeup per batch, frames of other ids are counted as dropped
+    assert woken == [1] and tapped == [3]
+    assert [bytes(m.data) for m in iter(queue.recv, None)] == [b'\x10\x14', b'\x21\x01']
+    assert dispatcher.dropped == 1 and dispatcher.rx_frames == 3
+
+
+def test_batch_size_follows_the_load():
+    zcan = ReceiveDriver()
+    dispatcher = ZCANDispatcher(zcan, 1)
+    dispatcher.subscribe(0x7E8)
+    full = RX_BATCH_MIN
+    for i in range(3):
+        zcan.batches.append([(0x7E8, b'\x00')] * full)
+        dispatcher._dispatch(zcan.Receive, dispatcher._rcv_msgs, 0, False)
+        full *= 2
+    assert zcan.sizes == [RX_BATCH_MIN, RX_BATCH_MIN * 2, RX_BATCH_MIN * 4]
+    # quiet bus or a driver error (0xFFFFFFFF): back towards RX_BATCH_MIN
+    zcan.batches = [[(0x7E8, b'\x00')], 0xFFFFFFFF, [], []]
+    for i in range(4):
+        assert dispatcher._dispatch(zcan.Receive, dispatcher._rcv_msgs, 0, False) == (1 if i == 0 else 0)
+    assert zcan.sizes[3:] == [RX_BATCH_MIN * 8, RX_BATCH_MIN * 4, RX_BATCH_MIN * 2, RX_BATCH_MIN]
+    assert dispatcher._batch[False] == RX_BATCH_MIN
+
+
+def test_engine_targets_share_the_dispatcher(engine):
+    names = ("ESC", "EPS", "EPS4wd")
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(engine.targets[name].udsclient.tester_present) for name in names]
+        assert all(f.result().positive for f in futures)
+    assert [engine.simulator.ecu(name).requests for name in names] == [1, 1, 1]
+
+    route = engine.targets["ESC"].rx_queue.route
+    with engine.attached("ESC_FUNC") as func:
+        assert len(engine._dispatcher._routes[route]) == 2
+        assert func.udsclient.tester_present().positive
+    assert engine._dispatcher._routes[route] == (engine.targets["ESC"].rx_queue,)
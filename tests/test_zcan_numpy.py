@@ -0,0 +1,68 @@
+# -*- coding:utf-8 -*-
+#  test_zcan_numpy.py
+#
+#  ~~~~~~~~~~~~
+#
+#  zcan_numpy columns against the ctypes fields of the same receive buffers
+#
+#  ~~~~~~~~~~~~
+#
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import zcan_numpy
+from zlgcan import ZCAN_Receive_Data, ZCAN_ReceiveFD_Data, ZCAN_Transmit_Data
+
+
+def fill(msgs, fd=False):
+    for i, msg in enumerate(msgs):
+        msg.frame.can_id = 0x18DA10F1 + i if i % 2 else 0x700 + i
+        msg.frame.eff = i % 2
+        msg.frame.rtr = 1 if i == 2 else 0
+        msg.frame.err = 1 if i == 3 else 0
+        length = (8 + i) if fd else i % 9
+        if fd:
+            msg.frame.len = length
+            msg.frame.brs = i % 2
+            msg.frame.esi = 1 if i == 1 else 0
+        else:
+            msg.frame.can_dlc = length
+        for j in range(length):
+            msg.frame.data[j] = (i * 16 + j) & 0xFF
+        msg.timestamp = 1000000 + i * 250
+    return msgs
+
+
+@pytest.mark.parametrize("rcv_type, fd", [(ZCAN_Receive_Data, False), (ZCAN_ReceiveFD_Data, True)])
+def test_decode(rcv_type, fd):
+    msgs = fill((rcv_type * 10)(), fd)
+    frames = zcan_numpy.decode(msgs, 6)
+    assert len(frames) == 6 and frames.fd is fd
+    for i in range(6):
+        frame = msgs[i].frame
+        assert frames.id[i] == frame.can_id
+        assert frames.eff[i] == frame.eff and frames.rtr[i] == frame.rtr and frames.err[i] == frame.err
+        assert frames.dlc[i] == (frame.len if fd else frame.can_dlc)
+        assert frames.timestamp[i] == msgs[i].timestamp
+        assert frames.payload(i) == bytes(frame.data[:frames.dlc[i]])
+        if fd:
+            assert frames.brs[i] == frame.brs and frames.esi[i] == frame.esi
+    if not fd:
+        assert frames.brs is None and frames.esi is None
+
+
+def test_view_shares_the_buffer():
+    msgs = fill((ZCAN_Receive_Data * 4)())
+    records = zcan_numpy.view(msgs)
+    assert len(records) == 4
+    assert len(zcan_numpy.view(msgs, 100)) == 4
+    frames = zcan_numpy.decode(msgs)
+    msgs[1].frame.data[0] = 0xEE
+    msgs[1].timestamp = 7
+    assert frames.data[1, 0] == 0xEE and frames.timestamp[1] == 7
+
+
+def test_view_type():
+    with pytest.raises(TypeError):
+        zcan_numpy.view((ZCAN_Transmit_Data * 2)())
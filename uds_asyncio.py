@@ -0,0 +1,264 @@
+# -*- coding:utf-8 -*-
+#  uds_asyncio.py
+#
+#  ~~~~~~~~~~~~
+#
+#  asyncio UDS client over ZCAN ISO-TP: one channel, one transport layer per ECU,
+#  several diagnostic conversations in flight on the same event loop
+#
+#  ~~~~~~~~~~~~
+#
+import asyncio
+from functools import partial
+
+import isotp
+
+from udsoncan import services, Response
+from udsoncan.exceptions import TimeoutException, NegativeResponseException, InvalidResponseException, UnexpectedResponseException
+
+from zcan_isotp import ZCANDispatcher, ZCANRxQueue, ZCANTxRing
+
+ISOTP_PARAMS = {
+    'stmin' : 0,
+    'blocksize' : 8,
+    'tx_padding' : 0,
+    'rx_flowcontrol_timeout' : 1000,
+    'rx_consecutive_frame_timeout' : 1000,
+    }
+
+
+class AsyncZCANChannel(object):
+    """
+    ZCAN channel driven from an asyncio loop. Frames come from a ZCANDispatcher (shared with other
+    users of the channel, or owned when none is given) and wake the AsyncIsoTpConnection of their
+    arbitration id; transmit goes through one ZCANTxRing used from the loop thread only.
+    Create it in a coroutine of the loop, or pass that loop.
+    """
+    def __init__(self, zcan, chn_handle, loop=None, dispatcher=None):
+        self._loop       = loop if loop is not None else asyncio.get_running_loop()
+        self._own        = dispatcher is None
+        self.dispatcher  = dispatcher if dispatcher is not None else ZCANDispatcher(zcan, chn_handle)
+        self.tx_ring     = ZCANTxRing(zcan, chn_handle)
+        self._conns      = {}               # rxid -> AsyncIsoTpConnection
+
+    def connection(self, address, params=None):
+        """
+        AsyncIsoTpConnection for one ECU, address is an isotp.Address whose rxid is not in use on this channel
+        """
+        if address.rxid in self._conns:
+            raise ValueError("rxid 0x%X already has a connection" % address.rxid)
+        conn = AsyncIsoTpConnection(self, address, params)
+        conn.rx_queue.on_rx = partial(self._loop.call_soon_threadsafe, conn.notify_rx)
+        self._conns[address.rxid] = conn
+        self.dispatcher.attach(conn.rx_queue)
+        return conn
+
+    def remove(self, conn):
+        if self._conns.pop(conn.address.rxid, None) is not None:
+            self.dispatcher.detach(conn.rx_queue)
+
+    def start(self):
+        if self._own:
+            self.dispatcher.start()
+        return self
+
+    def stop(self):
+        for conn in list(self._conns.values()):
+            self.remove(conn)
+        if self._own:
+            self.dispatcher.stop()
+
+
+class AsyncIsoTpConnection(object):
+    """
+    ISO-TP conversation with one ECU. The transport layer is processed by a task of the event loop,
+    woken by received frames, by send() or by its own sleep_time(). An error of the transport layer
+    is raised by the next wait_frame(), the task goes on.
+    """
+    def __init__(self, channel, address, params=None):
+        self.channel   = channel
+        self.address   = address
+        self.rx_queue  = ZCANRxQueue(address.rxid, extended=address.is_29bits)
+        self.layer     = isotp.TransportLayer(rxfn=self.rx_queue.recv, txfn=channel.tx_ring.send,
+                                              address=address, params=params or ISOTP_PARAMS)
+        self._wakeup   = None
+        self._payloads = None
+        self._task     = None
+
+    def open(self):
+        """
+        start the processing task, call from the event loop
+        """
+        self._wakeup   = asyncio.Event()
+        self._payloads = asyncio.Queue()
+        self._task     = asyncio.ensure_future(self._run())
+        return self
+
+    async def close(self):
+        self.channel.remove(self)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.layer.reset()
+
+    async def __aenter__(self):
+        return self.open()
+
+    async def __aexit__(self, type, value, traceback):
+        await self.close()
+
+    def notify_rx(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def send(self, payload):
+        if self._task is None:
+            raise RuntimeError("connection 0x%X is not open" % self.address.rxid)
+        self.layer.send(bytearray(payload))
+        self._wakeup.set()
+
+    async def wait_frame(self, timeout):
+        payload = await asyncio.wait_for(self._payloads.get(), timeout)
+        if isinstance(payload, Exception):
+            raise payload
+        return payload
+
+    def empty_rxqueue(self):
+        while not self._payloads.empty():
+            self._payloads.get_nowait()
+
+    async def _run(self):
+        while True:
+            try:
+                self.layer.process()
+                self.channel.tx_ring.flush()
+                while self.layer.available():
+                    self._payloads.put_nowait(bytes(self.layer.recv()))
+            except Exception as e:
+                print("ERROR: ISO-TP 0x%X: %r" % (self.address.rxid, e))
+                self._payloads.put_nowait(e)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.layer.sleep_time())
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+
+class AsyncUdsClient(object):
+    """
+    UDS client coroutines on an AsyncIsoTpConnection, requests and responses are built and parsed
+    by udsoncan.services. config takes the udsoncan Client keys used here: security_algo,
+    security_algo_params, data_identifiers, server_address_format, server_memorysize_format.
+    Negative responses raise NegativeResponseException, 0x78 extends the wait to p2_star_timeout.
+    """
+    def __init__(self, conn, request_timeout=2, p2_timeout=1, p2_star_timeout=5, config=None):
+        self.conn            = conn
+        self.request_timeout = request_timeout
+        self.p2_timeout      = p2_timeout
+        self.p2_star_timeout = p2_star_timeout
+        self.config          = dict(config or {})
+
+    async def send_request(self, request, timeout=None):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (self.request_timeout if timeout is None else timeout)
+        wait = self.p2_timeout
+        self.conn.empty_rxqueue()
+        self.conn.send(request.get_payload())
+        if request.suppress_positive_response:
+            return None
+
+        while True:
+            remaining = deadline - loop.time()
+            try:
+                payload = await self.conn.wait_frame(max(min(wait, remaining), 0))
+            except asyncio.TimeoutError:
+                raise TimeoutException("Did not receive response in time (timeout=%.3f sec)" % min(wait, remaining))
+
+            response = Response.from_payload(payload)
+            if not response.valid:
+                raise InvalidResponseException(response)
+            if response.service != request.service:
+                raise UnexpectedResponseException(response, "Response for service 0x%02X received" % response.service.request_id())
+            if not response.positive:
+                if response.code == Response.Code.RequestCorrectlyReceived_ResponsePending:
+                    wait = self.p2_star_timeout
+                    continue
+                raise NegativeResponseException(response)
+            return response
+
+    async def change_session(self, session):
+        response = await self.send_request(services.DiagnosticSessionControl.make_request(session))
+        services.DiagnosticSessionControl.interpret_response(response)
+        return response
+
+    async def ecu_reset(self, reset_type):
+        response = await self.send_request(services.ECUReset.make_request(reset_type))
+        services.ECUReset.interpret_response(response)
+        return response
+
+    async def tester_present(self):
+        response = await self.send_request(services.TesterPresent.make_request())
+        services.TesterPresent.interpret_response(response)
+        return response
+
+    async def unlock_security_access(self, level):
+        mode = services.SecurityAccess.Mode
+        response = await self.send_request(services.SecurityAccess.make_request(level, mode.RequestSeed))
+        services.SecurityAccess.interpret_response(response, mode.RequestSeed)
+        seed = response.service_data.seed
+        if len(seed) > 0 and seed == b'\x00' * len(seed):
+            return response
+        key = self.config['security_algo'](level, seed, self.config.get('security_algo_params'))
+        response = await self.send_request(services.SecurityAccess.make_request(level, mode.SendKey, bytes(key)))
+        services.SecurityAccess.interpret_response(response, mode.SendKey)
+        return response
+
+    async def read_data_by_identifier(self, didlist):
+        didconfig = self.config.get('data_identifiers', {})
+        response = await self.send_request(services.ReadDataByIdentifier.make_request(didlist, didconfig))
+        services.ReadDataByIdentifier.interpret_response(response, didlist, didconfig)
+        return response
+
+    async def write_data_by_identifier(self, did, value):
+        didconfig = self.config.get('data_identifiers', {})
+        response = await self.send_request(services.WriteDataByIdentifier.make_request(did, value, didconfig))
+        services.WriteDataByIdentifier.interpret_response(response)
+        return response
+
+    async def start_routine(self, routine_id, data=None):
+        request = services.RoutineControl.make_request(routine_id, services.RoutineControl.ControlType.startRoutine, data)
+        response = await self.send_request(request)
+        services.RoutineControl.interpret_response(response)
+        return response
+
+    async def get_dtc_by_status_mask(self, status_mask):
+        subfn = services.ReadDTCInformation.Subfunction.reportDTCByStatusMask
+        response = await self.send_request(services.ReadDTCInformation.make_request(subfn, status_mask=status_mask))
+        services.ReadDTCInformation.interpret_response(response, subfn)
+        return response
+
+    async def clear_dtc(self, group=0xFFFFFF):
+        response = await self.send_request(services.ClearDiagnosticInformation.make_request(group))
+        services.ClearDiagnosticInformation.interpret_response(response)
+        return response
+
+    async def request_download(self, memory_location):
+        memory_location.set_format_if_none(address_format=self.config.get('server_address_format'),
+                                           memorysize_format=self.config.get('server_memorysize_format'))
+        response = await self.send_request(services.RequestDownload.make_request(memory_location))
+        services.RequestDownload.interpret_response(response)
+        return response
+
+    async def transfer_data(self, sequence_number, data=None):
+        response = await self.send_request(services.TransferData.make_request(sequence_number, data))
+        services.TransferData.interpret_response(response)
+        return response
+
+    async def request_transfer_exit(self, data=None):
+        response = await self.send_request(services.RequestTransferExit.make_request(data))
+        services.RequestTransferExit.interpret_response(response)
+        return response
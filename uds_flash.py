@@ -0,0 +1,212 @@
+# -*- coding:utf-8 -*-
+#  uds_flash.py
+#
+#  ~~~~~~~~~~~~
+#
+#  UDS download engine: RequestDownload / TransferData / RequestTransferExit
+#
+#  Optional pipeline: a producer thread encodes the next TransferData requests while the
+#  current one is on the bus, flash_timing.TransferTiming splits each block into host-prep, bus and ECU-wait
+#
+#  FlashImage: application and flash driver parsed once, blocks cut once,
+#  shared read-only by every channel of a parallel flashing run
+#
+#  ~~~~~~~~~~~~
+#
+import queue
+import threading
+import time
+
+from udsoncan import Request, services
+from udsoncan.exceptions import UnexpectedResponseException
+
+import srecord
+from flash_timing import TransferTiming, phase
+
+# SID + blockSequenceCounter are counted in maxNumberOfBlockLength
+TRANSFER_DATA_OVERHEAD = 2
+# requests encoded ahead of the one on the bus when pipelined
+PIPELINE_DEPTH = 2
+
+
+def block_data_len(max_number_of_block_length):
+    """
+    payload bytes of one TransferData request for the ECU's maxNumberOfBlockLength
+    """
+    n = max_number_of_block_length - TRANSFER_DATA_OVERHEAD
+    if n <= 0:
+        raise ValueError("maxNumberOfBlockLength %d is too small" % max_number_of_block_length)
+    return n
+
+
+def iter_blocks(data, block_len):
+    """
+    yield (sequence_counter, view) over data without copying it,
+    the counter starts at 1 and wraps from 0xFF to 0x00
+    """
+    view = memoryview(data)
+    seq = 1
+    for offset in range(0, len(view), block_len):
+        yield seq, view[offset:offset + block_len]
+        seq = (seq + 1) & 0xFF
+
+
+class PreparedRequest(Request):
+    """
+    TransferData request encoded once, off the critical path; udsoncan send_request() takes it as is
+    """
+    def __init__(self, sequence_number, data):
+        request = services.TransferData.make_request(sequence_number, data)
+        Request.__init__(self, service=request.service, data=request.data)
+        self.sequence_number = sequence_number
+        self.payload = request.get_payload()
+
+    def get_payload(self, suppress_positive_response=None):
+        return self.payload
+
+
+def _prepare(data, block_len, blocks):
+    """
+    yield (request, prep seconds) for every block of data
+    """
+    t0 = time.perf_counter()
+    for seq, block in (iter_blocks(data, block_len) if blocks is None else blocks(block_len)):
+        request = PreparedRequest(seq, bytes(block))
+        t1 = time.perf_counter()
+        yield request, t1 - t0
+        t0 = time.perf_counter()
+
+
+def _producer(requests, out, stop):
+    try:
+        for item in requests:
+            while not stop.is_set():
+                try:
+                    out.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if stop.is_set():
+                return
+        out.put(None)
+    except Exception as e:
+        out.put(e)
+
+
+def _pipelined(requests, depth):
+    """
+    run the requests generator on a producer thread, yield (request, prep, stall)
+    """
+    out = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    thread = threading.Thread(target=_producer, args=(requests, out, stop), daemon=True)
+    thread.start()
+    try:
+        while True:
+            t0 = time.perf_counter()
+            item = out.get()
+            stall = time.perf_counter() - t0
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item[0], item[1], stall
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _transfer(udsclient, request):
+    response = udsclient.send_request(request)
+    services.TransferData.interpret_response(response)
+    if response.service_data.sequence_number_echo != request.sequence_number:
+        raise UnexpectedResponseException(response, "Block sequence number of response (0x%02x) does not match request block sequence number (0x%02x)" % (
+            response.service_data.sequence_number_echo, request.sequence_number))
+    return response
+
+
+def download_segment(udsclient, memory_location, data, blocks=None, pipeline=False, timing=None, report=None):
+    """
+    RequestDownload the memory location, send data in TransferData blocks and exit,
+    data is any contiguous buffer (bytes, bytearray, mmap), each block is copied once.
+    blocks(block_len) may return the (sequence_counter, bytes) list of data already cut,
+    like FlashImage.blocks, then nothing is copied.
+    pipeline: encode the next requests on a producer thread while the current one is in flight.
+    timing: TransferTiming collecting the per block split
+    report: flash_timing.FlashTimingReport, gets the RequestDownload/TransferData/TransferExit phases
+    """
+    segment = "0x%08X" % memory_location.address if memory_location is not None else None
+    if report is not None and timing is None:
+        timing = report.transfer(segment)
+
+    with phase(report, "RequestDownload", segment=segment):
+        resp = udsclient.request_download(memory_location=memory_location)
+    block_len = block_data_len(resp.service_data.max_length)
+    with phase(report, "TransferData", len(data), segment):
+        if not pipeline and timing is None:
+            for seq, block in (iter_blocks(data, block_len) if blocks is None else blocks(block_len)):
+                udsclient.transfer_data(sequence_number=seq, data=bytes(block))
+        else:
+            _transfer_all(udsclient, data, block_len, blocks, pipeline, timing)
+    with phase(report, "TransferExit", segment=segment):
+        udsclient.request_transfer_exit()
+
+
+def _transfer_all(udsclient, data, block_len, blocks, pipeline, timing):
+    requests = _prepare(data, block_len, blocks)
+    if pipeline:
+        requests = _pipelined(requests, PIPELINE_DEPTH)
+    else:
+        requests = ((request, prep, 0.0) for request, prep in requests)
+    try:
+        for request, prep, stall in requests:
+            t_send = time.perf_counter()
+            _transfer(udsclient, request)
+            t_resp = time.perf_counter()
+            if timing is not None:
+                tx_done = getattr(udsclient.conn, "tx_done_time", None)
+                bus = tx_done - t_send if tx_done is not None and t_send <= tx_done <= t_resp else 0.0
+                timing.add(prep, stall, bus, t_resp - t_send - bus)
+    finally:
+        # a failed block leaves the generator suspended, the traceback would keep the producer running
+        requests.close()
+
+
+class FlashImage(object):
+    """
+    application (sw) and flash driver (boot) .s19 parsed once. The TransferData blocks of a
+    segment are cut on first use for each maxNumberOfBlockLength and kept, so N channels flashing
+    the same image share one copy of it
+    """
+    def __init__(self, sw_path, boot_path):
+        self.sw_path       = sw_path
+        self.boot_path     = boot_path
+        self.sw_segments   = srecord.load_segments(sw_path)
+        self.boot_segments = srecord.load_segments(boot_path)
+        self._blocks       = {}             # (id(segment), block_len) -> [(seq, bytes)]
+        self._lock         = threading.Lock()
+
+    @property
+    def size(self):
+        """
+        bytes downloaded to one ECU
+        """
+        return sum(seg.size for seg in self.sw_segments) + sum(seg.size for seg in self.boot_segments)
+
+    def blocks(self, segment, block_len):
+        key = (id(segment), block_len)
+        blocks = self._blocks.get(key)
+        if blocks is None:
+            with self._lock:
+                blocks = self._blocks.get(key)
+                if blocks is None:
+                    blocks = [(seq, bytes(block)) for seq, block in iter_blocks(segment.data, block_len)]
+                    self._blocks[key] = blocks
+        return blocks
+
+    def download(self, udsclient, memory_location, segment, **options):
+        """
+        download_segment of one segment of the image with its shared blocks, options as download_segment
+        """
+        download_segment(udsclient, memory_location, segment.data,
+                         blocks=lambda block_len: self.blocks(segment, block_len), **options)
@@ -0,0 +1,157 @@
+# -*- coding:utf-8 -*-
+#  uds_session.py
+#
+#  ~~~~~~~~~~~~
+#
+#  Session and security state of one ECU as seen by its udsoncan client. SessionClient follows
+#  every DiagnosticSessionControl, SecurityAccess and ECUReset it sends and the time of its last
+#  request (the S3 timer of the ECU), so ensure(3, 1) only sends the 0x10/0x27 exchanges the ECU
+#  still needs. A TesterPresent running in the background keeps the session alive past S3.
+#  When the ECU answers "not in this session" / "security access denied" anyway (power cycle,
+#  reset by another tester) the state is dropped and the steps are sent again once.
+#
+#  ~~~~~~~~~~~~
+#
+import contextlib
+import threading
+import time
+
+from udsoncan.client import Client
+from udsoncan.exceptions import NegativeResponseException, TimeoutException
+
+DEFAULT_SESSION     = 1
+PROGRAMMING_SESSION = 2
+EXTENDED_SESSION    = 3
+
+# S3server of ISO 14229-2: a non default session ends after 5 s without request
+S3_SERVER_S = 5.0
+# a session older than S3 minus this margin is not trusted any more
+S3_MARGIN_S = 0.5
+
+# negative responses telling the session or security state was not what we believed
+STATE_NRCS = (0x33, 0x7E, 0x7F)
+
+
+@contextlib.contextmanager
+def client_p2_timeout(client):
+    """
+    wait for the client's own p2_timeout instead of the P2 the ECU announced, for the long
+    multi-frame responses our STmin paces past it (multi-DID reads)
+    """
+    p2_server_max = client.session_timing['p2_server_max']
+    client.session_timing['p2_server_max'] = None
+    try:
+        yield client
+    finally:
+        client.session_timing['p2_server_max'] = p2_server_max
+
+
+class SessionState(object):
+    """
+    session: current session, None when unknown. level: unlocked security level (odd, the
+    requestSeed one), None when locked. kept_alive: a TesterPresent is sent to the ECU in the
+    background, S3 does not run out. skipped counts the 0x10/0x27 exchanges saved by ensure
+    """
+    def __init__(self, s3=S3_SERVER_S):
+        self.s3            = s3
+        self.session       = None
+        self.level         = None
+        self.last_activity = 0.0
+        self.kept_alive    = False
+        self.skipped       = 0
+
+    def reset(self, session=None):
+        self.session = session
+        self.level   = None
+
+    def touch(self):
+        self.last_activity = time.monotonic()
+
+    def alive(self):
+        """
+        False when the ECU dropped back to the default session by S3 since the last request
+        """
+        if self.session in (None, DEFAULT_SESSION) or self.kept_alive:
+            return True
+        return time.monotonic() - self.last_activity < self.s3 - S3_MARGIN_S
+
+    def __repr__(self):
+        return "SessionState(session %s, level %s%s)" % (self.session, self.level, ", kept alive" if self.kept_alive else "")
+
+
+class SessionClient(Client):
+    """
+    udsoncan Client keeping the SessionState of its ECU in state
+    """
+    def __init__(self, conn, s3=S3_SERVER_S, **kwargs):
+        Client.__init__(self, conn, **kwargs)
+        self.state = SessionState(s3)
+        self._state_lock = threading.RLock()
+
+    def send_request(self, request, timeout=-1):
+        try:
+            response = Client.send_request(self, request, timeout)
+        except NegativeResponseException:
+            self.state.touch()
+            raise
+        if response is not None:
+            self.state.touch()
+        return response
+
+    def change_session(self, newsession):
+        with self._state_lock:
+            try:
+                response = Client.change_session(self, newsession)
+            except TimeoutException:
+                self.state.reset()
+                raise
+            if response is not None and response.positive:
+                self.state.reset(newsession)
+            return response
+
+    def unlock_security_access(self, level, seed_params=bytes()):
+        with self._state_lock:
+            response = Client.unlock_security_access(self, level, seed_params)
+            if response is not None and response.positive:
+                self.state.level = level if level & 1 else level - 1
+            return response
+
+    def ecu_reset(self, reset_type):
+        with self._state_lock:
+            response = Client.ecu_reset(self, reset_type)
+            if response is not None and response.positive:
+                self.state.reset(DEFAULT_SESSION)
+            return response
+
+    def ensure(self, session, level=None):
+        """
+        be in session with level unlocked, sending only the steps still missing
+        """
+        with self._state_lock:
+            state = self.state
+            if not state.alive():
+                state.reset(DEFAULT_SESSION)
+            if state.session != session:
+                self.change_session(session)
+            else:
+                state.skipped += 1
+            if level is not None:
+                if state.level != (level if level & 1 else level - 1):
+                    self.unlock_security_access(level)
+                else:
+                    state.skipped += 1
+
+    def in_session(self, session, level, fn, *args, **kwargs):
+        """
+        fn(*args, **kwargs) after ensure(session, level). Repeated once after sending the session and
+        security steps again if the ECU says it is not in that state
+        """
+        self.ensure(session, level)
+        try:
+            return fn(*args, **kwargs)
+        except NegativeResponseException as e:
+            if e.response.code not in STATE_NRCS:
+                raise
+            self.state.reset()
+            self.ensure(session, level)
+            return fn(*args, **kwargs)
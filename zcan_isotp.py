@@ -0,0 +1,264 @@
+# -*- coding:utf-8 -*-
+#  zcan_isotp.py
+#
+#  ~~~~~~~~~~~~
+#
+#  CAN link layer between the ZCAN channel and isotp.TransportLayer rxfn/txfn
+#
+#  ~~~~~~~~~~~~
+#
+import collections
+import threading
+
+from zlgcan import *
+from isotp import CanMessage
+
+RX_BATCH_MIN    = 64
+RX_BATCH_MAX    = 4096
+RX_WAIT_TIME_MS = 10
+
+TX_RING_SIZE    = 64
+
+# eff bit of the ZCAN can_id word: 29 bit identifier
+CAN_EFF_FLAG    = 0x80000000
+
+
+class ZCANRxQueue(object):
+    """
+    Frames of one arbitration id handed out by a ZCANDispatcher. recv() is the isotp rxfn,
+    on_rx() is called from the dispatcher thread after frames were queued.
+    extended: rxid is a 29 bit identifier, 0x7E8 and 0x000007E8 are different ids on the bus
+    """
+    def __init__(self, rxid, on_rx=None, extended=False):
+        self.rxid      = rxid
+        self.extended  = extended
+        self.route     = rxid | (CAN_EFF_FLAG if extended else 0)
+        self.on_rx     = on_rx
+        self._queue    = collections.deque()
+        self.rx_frames = 0
+
+    def recv(self):
+        """
+        isotp rxfn: next CanMessage for rxid or None
+        """
+        try:
+            return self._queue.popleft()
+        except IndexError:
+            return None
+
+    def clear(self):
+        self._queue.clear()
+
+
+class ZCANDispatcher(object):
+    """
+    Receive stage of one channel. A thread drains the driver buffer into a preallocated
+    ZCAN_Receive_Data array once and routes every frame by arbitration id and eff bit to the ZCANRxQueue(s)
+    attached for it, so several ISO-TP layers (ESC, EPS, EPS4wd, functional) share one Receive call.
+
+    The batch grows while the driver fills it completely and shrinks back when the bus is quiet.
+    fd: CAN FD channel, frames are read from Receive and ReceiveFD, FD frames become
+    CanMessage(is_fd=True) for the ISO-TP layers of CAN FD ECUs. Both queues are read without
+    waiting while frames come in, once both are empty the thread blocks on the one that received
+    last: a frame of the other type waits for the end of that wait (wait_time at most).
+    Taps (can_trace.TraceRecorder.on_rx) see every received batch as (msgs, num) before it is routed.
+    """
+    def __init__(self, zcan, chn_handle, wait_time=RX_WAIT_TIME_MS, fd=False):
+        self._zcan       = zcan
+        self._chn_handle = chn_handle
+        self._wait_time  = wait_time
+        self._fd         = fd
+        self._rcv_msgs   = (ZCAN_Receive_Data * RX_BATCH_MAX)()
+        self._rcv_fd_msgs = (ZCAN_ReceiveFD_Data * RX_BATCH_MAX)() if fd else None
+        self._batch      = [RX_BATCH_MIN, RX_BATCH_MIN]     # classic, FD
+        self._idle_fd    = False            # queue of the last frames, the idle wait blocks on it
+        self._routes     = {}               # rxid | eff flag -> tuple of ZCANRxQueue, replaced on change
+        self._taps       = ()
+        self._lock       = threading.Lock()
+        self._thread     = None
+        self._terminated = False
+        self.rx_frames   = 0
+        self.dropped     = 0
+
+    def attach(self, rx_queue):
+        with self._lock:
+            routes = dict(self._routes)
+            routes[rx_queue.route] = routes.get(rx_queue.route, ()) + (rx_queue,)
+            self._routes = routes
+        return rx_queue
+
+    def detach(self, rx_queue):
+        with self._lock:
+            routes = dict(self._routes)
+            queues = tuple(q for q in routes.get(rx_queue.route, ()) if q is not rx_queue)
+            if queues:
+                routes[rx_queue.route] = queues
+            else:
+                routes.pop(rx_queue.route, None)
+            self._routes = routes
+        rx_queue.clear()
+
+    def subscribe(self, rxid, on_rx=None, extended=False):
+        return self.attach(ZCANRxQueue(rxid, on_rx, extended))
+
+    def add_tap(self, tap):
+        with self._lock:
+            self._taps = self._taps + (tap,)
+
+    def remove_tap(self, tap):
+        with self._lock:
+            self._taps = tuple(t for t in self._taps if t is not tap)
+
+    def start(self):
+        self._terminated = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._terminated = True
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for queues in self._routes.values():
+            for rx_queue in queues:
+                rx_queue.clear()
+
+    def _run(self):
+        while not self._terminated:
+            if not self._fd:
+                self._dispatch(self._zcan.Receive, self._rcv_msgs, self._wait_time, False)
+            elif not (self._dispatch(self._zcan.Receive, self._rcv_msgs, 0, False) +
+                      self._dispatch(self._zcan.ReceiveFD, self._rcv_fd_msgs, 0, True)):
+                # idle bus: block with the normal wait time instead of polling both queues
+                if self._idle_fd:
+                    self._dispatch(self._zcan.ReceiveFD, self._rcv_fd_msgs, self._wait_time, True)
+                else:
+                    self._dispatch(self._zcan.Receive, self._rcv_msgs, self._wait_time, False)
+
+    def _dispatch(self, receive, rcv_msgs, wait_time, is_fd):
+        """
+        receive and route one batch, number of frames received
+        """
+        batch = self._batch[is_fd]
+        msgs, num = receive(self._chn_handle, batch, wait_time, rcv_msgs)
+        # 0xFFFFFFFF (-1 as c_uint) on a driver error
+        if num <= 0 or num > batch:
+            self._batch[is_fd] = max(RX_BATCH_MIN, batch // 2)
+            return 0
+
+        if num >= batch:
+            self._batch[is_fd] = min(RX_BATCH_MAX, batch * 2)
+        elif num < batch // 4:
+            self._batch[is_fd] = max(RX_BATCH_MIN, batch // 2)
+
+        self._idle_fd = is_fd
+        for tap in self._taps:
+            tap(msgs, num)
+
+        routes = self._routes
+        woken = []
+        for i in range(num):
+            frame = msgs[i].frame
+            queues = routes.get(frame.can_id | (frame.eff << 31))
+            if queues is None:
+                self.dropped += 1
+                continue
+            if is_fd:
+                dlc = frame.len
+                msg = CanMessage(arbitration_id=frame.can_id, dlc=dlc, data=bytearray(frame.data[:dlc]),
+                                 extended_id=bool(frame.eff), is_fd=True, bitrate_switch=bool(frame.brs))
+            else:
+                dlc = frame.can_dlc
+                msg = CanMessage(arbitration_id=frame.can_id, dlc=dlc,
+                                 data=bytearray(frame.data[:dlc]), extended_id=bool(frame.eff))
+            for rx_queue in queues:
+                rx_queue._queue.append(msg)
+                rx_queue.rx_frames += 1
+                if rx_queue not in woken:
+                    woken.append(rx_queue)
+        self.rx_frames += num
+        for rx_queue in woken:
+            if rx_queue.on_rx is not None:
+                rx_queue.on_rx()
+        return num
+
+
+class ZCANTxRing(object):
+    """
+    Transmit stage of one channel. isotp txfn frames are packed into a preallocated
+    ZCAN_Transmit_Data array, flush() hands all of them to the driver in one Transmit call,
+    so the consecutive frames of one ISO-TP block go out together.
+
+    CanMessage(is_fd=True) frames of CAN FD ECUs go to a second ZCAN_TransmitFD_Data array and out
+    with TransmitFD, bitrate_switch sets BRS.
+    Send failures are counted in tx_errors and reported to on_error(failed_num), never raised.
+    Taps (can_trace.TraceRecorder.on_tx) see the frames the driver accepted as (msgs, num).
+    """
+    def __init__(self, zcan, chn_handle, size=TX_RING_SIZE, transmit_type=0, on_error=None):
+        self._zcan          = zcan
+        self._chn_handle    = chn_handle
+        self._size          = size
+        self._transmit_type = transmit_type
+        self._on_error      = on_error
+        self._msgs          = (ZCAN_Transmit_Data * size)()
+        self._buf           = memoryview(self._msgs).cast('B')
+        self._count         = 0
+        self._fd_msgs       = None          # allocated with the first CAN FD frame
+        self._fd_buf        = None
+        self._fd_count      = 0
+        self._taps          = ()
+        self.tx_frames      = 0
+        self.tx_calls       = 0
+        self.tx_errors      = 0
+
+    def add_tap(self, tap):
+        self._taps = self._taps + (tap,)
+
+    def remove_tap(self, tap):
+        self._taps = tuple(t for t in self._taps if t is not tap)
+
+    def send(self, msg):
+        """
+        isotp txfn: queue one CanMessage, flushes by itself when the ring is full
+        """
+        can_id = msg.arbitration_id | (CAN_EFF_FLAG if msg.is_extended_id else 0)
+        if msg.is_fd:
+            if self._fd_msgs is None:
+                self._fd_msgs = (ZCAN_TransmitFD_Data * self._size)()
+                self._fd_buf = memoryview(self._fd_msgs).cast('B')
+            if self._fd_count == self._size:
+                self.flush()
+            ZCAN_TRANSMITFD_FORMAT.pack_into(self._fd_buf, self._fd_count * ZCAN_TRANSMITFD_FORMAT.size, can_id, len(msg.data),
+                                             1 if msg.bitrate_switch else 0, bytes(msg.data), self._transmit_type)
+            self._fd_count += 1
+            return
+        if self._count == self._size:
+            self.flush()
+        ZCAN_TRANSMIT_FORMAT.pack_into(self._buf, self._count * ZCAN_TRANSMIT_FORMAT.size,
+                                       can_id, msg.dlc, bytes(msg.data), self._transmit_type)
+        self._count += 1
+
+    def flush(self):
+        if self._count:
+            num, self._count = self._count, 0
+            self._transmit(self._zcan.Transmit, self._msgs, num)
+        if self._fd_count:
+            num, self._fd_count = self._fd_count, 0
+            self._transmit(self._zcan.TransmitFD, self._fd_msgs, num)
+
+    def _transmit(self, transmit, msgs, num):
+        ret = transmit(self._chn_handle, msgs, num)
+        # 0xFFFFFFFF (-1 as c_uint) on a driver error
+        if ret < 0 or ret > num:
+            ret = 0
+        self.tx_calls += 1
+        self.tx_frames += ret
+        if ret > 0:
+            for tap in self._taps:
+                tap(msgs, ret)
+        if ret != num:
+            self.tx_errors += num - ret
+            if self._on_error is not None:
+                self._on_error(num - ret)
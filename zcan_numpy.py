@@ -0,0 +1,104 @@
+# -*- coding:utf-8 -*-
+#  zcan_numpy.py
+#
+#  ~~~~~~~~~~~~
+#
+#  NumPy views of the ZCAN_Receive_Data / ZCAN_ReceiveFD_Data arrays filled by Receive/ReceiveFD.
+#  The receive buffer is viewed as a structured array without copy, can_id/err/rtr/eff are
+#  cut out of the first word with vector operations and returned as columns, so a full
+#  receive batch decodes without touching the ctypes fields of every frame.
+#
+#  usage:
+#      msgs, num = zcan.Receive(chn_handle, 1000)
+#      frames = zcan_numpy.decode(msgs, num)
+#      frames.id[frames.dlc == 8], frames.data[:, 0], frames.timestamp
+#
+#  ~~~~~~~~~~~~
+#
+from ctypes import sizeof
+
+import numpy as np
+
+from zlgcan import ZCAN_CAN_FRAME, ZCAN_CANFD_FRAME, ZCAN_Receive_Data, ZCAN_ReceiveFD_Data
+
+# layout of the first frame word, see ZCAN_CAN_FRAME: can_id:29 err:1 rtr:1 eff:1 from the lsb
+CAN_ID_MASK = 0x1FFFFFFF
+ERR_SHIFT   = 29
+RTR_SHIFT   = 30
+EFF_SHIFT   = 31
+# flags byte of ZCAN_CANFD_FRAME: brs:1 esi:1
+BRS_MASK    = 0x01
+ESI_MASK    = 0x02
+
+
+def _dtype(rcv_type, frame_type, len_field, data_len):
+    """
+    structured dtype with the offsets and size of the ctypes receive structure
+    """
+    frame = rcv_type.frame.offset
+    names = ['word', 'dlc', 'data', 'timestamp']
+    formats = ['<u4', 'u1', ('u1', data_len), '<u8']
+    offsets = [frame, frame + getattr(frame_type, len_field).offset,
+               frame + frame_type.data.offset, rcv_type.timestamp.offset]
+    if frame_type is ZCAN_CANFD_FRAME:
+        names.append('flags')
+        formats.append('u1')
+        offsets.append(frame + ZCAN_CANFD_FRAME.brs.offset)
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': sizeof(rcv_type)})
+
+
+CAN_DTYPE   = _dtype(ZCAN_Receive_Data, ZCAN_CAN_FRAME, 'can_dlc', 8)
+CANFD_DTYPE = _dtype(ZCAN_ReceiveFD_Data, ZCAN_CANFD_FRAME, 'len', 64)
+
+
+def view(msgs, count=None):
+    """
+    structured array on the memory of a ZCAN_Receive_Data or ZCAN_ReceiveFD_Data array, no copy.
+    count: frames received, the rest of the buffer is left out
+    """
+    if msgs._type_ is ZCAN_ReceiveFD_Data:
+        dtype = CANFD_DTYPE
+    elif msgs._type_ is ZCAN_Receive_Data:
+        dtype = CAN_DTYPE
+    else:
+        raise TypeError("not a ZCAN_Receive_Data or ZCAN_ReceiveFD_Data array: %r" % (msgs,))
+    count = len(msgs) if count is None else min(count, len(msgs))
+    return np.frombuffer(msgs, dtype=dtype, count=count)
+
+
+class FrameColumns(object):
+    """
+    columns of a received batch: id, eff, rtr, err, dlc, timestamp and data (frames x 8 or 64 bytes).
+    dlc, timestamp and data are views on the receive buffer, valid until it is filled again;
+    brs and esi are None for classic CAN
+    """
+    __slots__ = ('id', 'eff', 'rtr', 'err', 'dlc', 'timestamp', 'data', 'brs', 'esi', 'fd')
+
+    def __init__(self, records):
+        word = records['word']
+        self.id        = word & CAN_ID_MASK
+        self.err       = ((word >> ERR_SHIFT) & 1).astype(np.bool_)
+        self.rtr       = ((word >> RTR_SHIFT) & 1).astype(np.bool_)
+        self.eff       = (word >> EFF_SHIFT).astype(np.bool_)
+        self.dlc       = records['dlc']
+        self.timestamp = records['timestamp']
+        self.data      = records['data']
+        self.fd        = 'flags' in records.dtype.names
+        self.brs       = (records['flags'] & BRS_MASK).astype(np.bool_) if self.fd else None
+        self.esi       = (records['flags'] & ESI_MASK).astype(np.bool_) if self.fd else None
+
+    def __len__(self):
+        return len(self.id)
+
+    def payload(self, i):
+        """
+        bytes of frame i, dlc long
+        """
+        return self.data[i, :self.dlc[i]].tobytes()
+
+
+def decode(msgs, count=None):
+    """
+    FrameColumns of the first count frames of a Receive/ReceiveFD buffer
+    """
+    return FrameColumns(view(msgs, count))
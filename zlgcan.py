@@ -15,7 +15,15 @@
 #  ------------------------------------------------------------------
 #
 from ctypes import *
+from ctypes import util as ctypes_util
+import collections
+import os
 import platform
+import select
+import socket
+import struct
+import threading
+import time
 
 ZCAN_DEVICE_TYPE = c_uint
 
@@ -233,6 +241,20 @@ class ZCAN_TransmitFD_Data(Structure):
 class ZCAN_ReceiveFD_Data(Structure):
     _fields_ = [("frame", ZCAN_CANFD_FRAME), ("timestamp", c_ulonglong)]
 
+'''
+ raw layouts of the four structures above, to pack and unpack whole arrays without the ctypes fields
+ can_id|err|rtr|eff, can_dlc, 3 pad bytes, data[8], transmit_type / timestamp
+ can_id|err|rtr|eff, len, brs|esi, 2 reserved bytes, data[64], transmit_type / timestamp
+'''
+ZCAN_TRANSMIT_FORMAT   = struct.Struct('<IB3x8sI')
+ZCAN_RECEIVE_FORMAT    = struct.Struct('<IB3x8sQ')
+ZCAN_TRANSMITFD_FORMAT = struct.Struct('<IBB2x64sI')
+ZCAN_RECEIVEFD_FORMAT  = struct.Struct('<IBB2x64sQ')
+assert ZCAN_TRANSMIT_FORMAT.size == sizeof(ZCAN_Transmit_Data)
+assert ZCAN_RECEIVE_FORMAT.size == sizeof(ZCAN_Receive_Data)
+assert ZCAN_TRANSMITFD_FORMAT.size == sizeof(ZCAN_TransmitFD_Data)
+assert ZCAN_RECEIVEFD_FORMAT.size == sizeof(ZCAN_ReceiveFD_Data)
+
 class ZCAN_AUTO_TRANSMIT_OBJ(Structure):
     _fields_ = [("enable",   c_ushort),
                 ("index",    c_ushort),
@@ -245,30 +267,185 @@ class ZCANFD_AUTO_TRANSMIT_OBJ(Structure):
                 ("interval", c_uint),
                 ("obj",      ZCAN_TransmitFD_Data)]
 
+'''
+ IProperty function prototypes, built once
+'''
+_IPROPERTY_SET_VALUE = CFUNCTYPE(c_uint, c_char_p, c_char_p)
+_IPROPERTY_GET_VALUE = CFUNCTYPE(c_char_p, c_char_p)
+
 class IProperty(Structure):
-    _fields_ = [("SetValue", c_void_p), 
-                ("GetValue", c_void_p),
+    _fields_ = [("SetValue", _IPROPERTY_SET_VALUE), 
+                ("GetValue", _IPROPERTY_GET_VALUE),
                 ("GetPropertys", c_void_p)]
 
-class ZCAN(object):
-    def __init__(self):
-        if platform.system() == "Windows":
+'''
+ zlgcan.dll function prototypes: name -> (restype, argtypes)
+ handles are pointers in the library, c_size_t keeps them as int (0 == INVALID_xxx_HANDLE).
+ The receive/transmit calls take the channel handle as c_void_p: ZCAN boxes it once per channel
+ and passes the box and its ctypes buffers, which their argtypes accept without a conversion
+ (see benchmarks/bench_zcan_calls.py).
+'''
+_DEVICE_HANDLE  = c_size_t
+_CHANNEL_HANDLE = c_size_t
+_CHANNEL_BOX    = c_void_p
+
+ZCAN_PROTOTYPES = {
+    "ZCAN_OpenDevice"         : (_DEVICE_HANDLE, [c_uint, c_uint, c_uint]),
+    "ZCAN_CloseDevice"        : (c_uint, [_DEVICE_HANDLE]),
+    "ZCAN_GetDeviceInf"       : (c_uint, [_DEVICE_HANDLE, POINTER(ZCAN_DEVICE_INFO)]),
+    "ZCAN_IsDeviceOnLine"     : (c_uint, [_DEVICE_HANDLE]),
+    "ZCAN_InitCAN"            : (_CHANNEL_HANDLE, [_DEVICE_HANDLE, c_uint, POINTER(ZCAN_CHANNEL_INIT_CONFIG)]),
+    "ZCAN_StartCAN"           : (c_uint, [_CHANNEL_HANDLE]),
+    "ZCAN_ResetCAN"           : (c_uint, [_CHANNEL_HANDLE]),
+    "ZCAN_ClearBuffer"        : (c_uint, [_CHANNEL_HANDLE]),
+    "ZCAN_ReadChannelErrInfo" : (c_uint, [_CHANNEL_HANDLE, POINTER(ZCAN_CHANNEL_ERR_INFO)]),
+    "ZCAN_ReadChannelStatus"  : (c_uint, [_CHANNEL_HANDLE, POINTER(ZCAN_CHANNEL_STATUS)]),
+    "ZCAN_GetReceiveNum"      : (c_uint, [_CHANNEL_BOX, c_uint]),      # BYTE type, passed like ZCAN_TYPE_CAN (c_uint)
+    "ZCAN_Transmit"           : (c_uint, [_CHANNEL_BOX, POINTER(ZCAN_Transmit_Data), c_uint]),
+    "ZCAN_Receive"            : (c_uint, [_CHANNEL_BOX, POINTER(ZCAN_Receive_Data), c_uint, c_int]),
+    "ZCAN_TransmitFD"         : (c_uint, [_CHANNEL_BOX, POINTER(ZCAN_TransmitFD_Data), c_uint]),
+    "ZCAN_ReceiveFD"          : (c_uint, [_CHANNEL_BOX, POINTER(ZCAN_ReceiveFD_Data), c_uint, c_int]),
+    "GetIProperty"            : (POINTER(IProperty), [_DEVICE_HANDLE]),
+    "ReleaseIProperty"        : (c_uint, [POINTER(IProperty)]),
+}
+
+def _load_prototypes(dll):
+    funcs = {}
+    for name, (restype, argtypes) in ZCAN_PROTOTYPES.items():
+        func = getattr(dll, name)
+        func.restype  = restype
+        func.argtypes = argtypes
+        funcs[name] = func
+    return funcs
+
+class ZCANDriver(object):
+    """
+    Interface of a CAN backend. Every backend keeps the zlgcan.dll call surface, handles are
+    ints and INVALID_xxx_HANDLE (0) means failure, so application code runs on any of them.
+    """
+    def OpenDevice(self, device_type, device_index, reserved):
+        raise NotImplementedError
+
+    def CloseDevice(self, device_handle):
+        raise NotImplementedError
+
+    def GetDeviceInf(self, device_handle):
+        raise NotImplementedError
+
+    def DeviceOnLine(self, device_handle):
+        return ZCAN_STATUS_ONLINE
+
+    def InitCAN(self, device_handle, can_index, init_config):
+        raise NotImplementedError
+
+    def StartCAN(self, chn_handle):
+        raise NotImplementedError
+
+    def ResetCAN(self, chn_handle):
+        raise NotImplementedError
+
+    def ClearBuffer(self, chn_handle):
+        raise NotImplementedError
+
+    def ReadChannelErrInfo(self, chn_handle):
+        return None
+
+    def ReadChannelStatus(self, chn_handle):
+        return None
+
+    def GetReceiveNum(self, chn_handle, can_type = ZCAN_TYPE_CAN):
+        raise NotImplementedError
+
+    def Transmit(self, chn_handle, std_msg, len):
+        raise NotImplementedError
+
+    def Receive(self, chn_handle, rcv_num, wait_time = c_int(-1), rcv_can_msgs = None):
+        raise NotImplementedError
+
+    def TransmitFD(self, chn_handle, fd_msg, len):
+        raise NotImplementedError
+
+    def ReceiveFD(self, chn_handle, rcv_num, wait_time = c_int(-1), rcv_canfd_msgs = None):
+        raise NotImplementedError
+
+    # device properties (clock, resistance, baud rate of USBCAN-E-U ...) only exist on ZLG
+    # hardware, the other backends accept and ignore them
+    def GetIProperty(self, device_handle):
+        return None
+
+    def SetValue(self, iproperty, path, value):
+        return ZCAN_STATUS_OK
+
+    def GetValue(self, iproperty, path):
+        return None
+
+    def ReleaseIProperty(self, iproperty):
+        return ZCAN_STATUS_OK
+
+    # periodic frames sent by the device itself (ZCAN_AUTO_TRANSMIT_OBJ / ZCANFD_AUTO_TRANSMIT_OBJ),
+    # only ZLG hardware has them, the other backends report ZCAN_STATUS_ERR
+    def SetAutoSend(self, device_handle, chn_index, auto_obj):
+        return ZCAN_STATUS_ERR
+
+    def ApplyAutoSend(self, device_handle, chn_index):
+        return ZCAN_STATUS_ERR
+
+    def ClearAutoSend(self, device_handle, chn_index):
+        return ZCAN_STATUS_ERR
+
+class ZCAN(ZCANDriver):
+    """
+    vendor library backend: zlgcan.dll on Windows, or any library exporting the ZCAN_* API
+    """
+    def __init__(self, lib_path = None):
+        self.__dll = None
+        self.__chn_handles = {}     # channel handle -> its c_void_p box
+        self.__chn_devices = {}     # channel handle -> device handle
+        if lib_path is not None:
+            self.__dll = (windll if platform.system() == "Windows" else cdll).LoadLibrary(lib_path)
+        elif platform.system() == "Windows":
             self.__dll = windll.LoadLibrary("zlgcan.dll")
         else:
-            print("No support now!")
-        if self.__dll == None:
-            print("DLL couldn't be loaded!")
+            raise OSError("no zlgcan library on %s, pass lib_path or use open_backend()" % platform.system())
+
+        f = _load_prototypes(self.__dll)
+        self.__OpenDevice         = f["ZCAN_OpenDevice"]
+        self.__CloseDevice        = f["ZCAN_CloseDevice"]
+        self.__GetDeviceInf       = f["ZCAN_GetDeviceInf"]
+        self.__IsDeviceOnLine     = f["ZCAN_IsDeviceOnLine"]
+        self.__InitCAN            = f["ZCAN_InitCAN"]
+        self.__StartCAN           = f["ZCAN_StartCAN"]
+        self.__ResetCAN           = f["ZCAN_ResetCAN"]
+        self.__ClearBuffer        = f["ZCAN_ClearBuffer"]
+        self.__ReadChannelErrInfo = f["ZCAN_ReadChannelErrInfo"]
+        self.__ReadChannelStatus  = f["ZCAN_ReadChannelStatus"]
+        self.__GetReceiveNum      = f["ZCAN_GetReceiveNum"]
+        self.__Transmit           = f["ZCAN_Transmit"]
+        self.__Receive            = f["ZCAN_Receive"]
+        self.__TransmitFD         = f["ZCAN_TransmitFD"]
+        self.__ReceiveFD          = f["ZCAN_ReceiveFD"]
+        self.__GetIProperty       = f["GetIProperty"]
+        self.__ReleaseIProperty   = f["ReleaseIProperty"]
+
+    def __chn(self, chn_handle):
+        # channel handle boxed once for the receive/transmit calls
+        h = self.__chn_handles[chn_handle] = _CHANNEL_BOX(chn_handle)
+        return h
+
 
     def OpenDevice(self, device_type, device_index, reserved):
         try:
-            return self.__dll.ZCAN_OpenDevice(device_type, device_index, reserved)
+            return self.__OpenDevice(device_type, device_index, reserved)
         except:
             print("Exception on OpenDevice!") 
             raise
 
     def CloseDevice(self, device_handle):
+        for chn_handle in [c for c, d in self.__chn_devices.items() if d == device_handle]:
+            del self.__chn_devices[chn_handle]
+            self.__chn_handles.pop(chn_handle, None)
         try:
-            return self.__dll.ZCAN_CloseDevice(device_handle)
+            return self.__CloseDevice(device_handle)
         except:
             print("Exception on CloseDevice!")
             raise
@@ -276,7 +453,7 @@ class ZCAN(object):
     def GetDeviceInf(self, device_handle):
         try:
             info = ZCAN_DEVICE_INFO()
-            ret = self.__dll.ZCAN_GetDeviceInf(device_handle, byref(info))
+            ret = self.__GetDeviceInf(device_handle, info)
             return info if ret == ZCAN_STATUS_OK else None
         except:
             print("Exception on ZCAN_GetDeviceInf")
@@ -284,35 +461,39 @@ class ZCAN(object):
 
     def DeviceOnLine(self, device_handle):
         try:
-            return self.__dll.ZCAN_IsDeviceOnLine(device_handle)
+            return self.__IsDeviceOnLine(device_handle)
         except:
             print("Exception on ZCAN_ZCAN_IsDeviceOnLine!")
             raise
 
     def InitCAN(self, device_handle, can_index, init_config):
         try:
-            return self.__dll.ZCAN_InitCAN(device_handle, can_index, byref(init_config))
+            chn_handle = self.__InitCAN(device_handle, can_index, init_config)
+            if chn_handle != INVALID_CHANNEL_HANDLE:
+                self.__chn_devices[chn_handle] = device_handle
+            return chn_handle
         except:
             print("Exception on ZCAN_InitCAN!")
             raise
 
     def StartCAN(self, chn_handle):
         try:
-            return self.__dll.ZCAN_StartCAN(chn_handle)
+            return self.__StartCAN(chn_handle)
         except:
             print("Exception on ZCAN_StartCAN!")
             raise
 
     def ResetCAN(self, chn_handle):
+        self.__chn_handles.pop(chn_handle, None)
         try:
-            return self.__dll.ZCAN_ResetCAN(chn_handle)
+            return self.__ResetCAN(chn_handle)
         except:
             print("Exception on ZCAN_ResetCAN!")
             raise
 
     def ClearBuffer(self, chn_handle):
         try:
-            return self.__dll.ZCAN_ClearBuffer(chn_handle)
+            return self.__ClearBuffer(chn_handle)
         except:
             print("Exception on ZCAN_ClearBuffer!")
             raise
@@ -320,7 +501,7 @@ class ZCAN(object):
     def ReadChannelErrInfo(self, chn_handle):
         try:
             ErrInfo = ZCAN_CHANNEL_ERR_INFO()
-            ret = self.__dll.ZCAN_ReadChannelErrInfo(chn_handle, byref(ErrInfo))
+            ret = self.__ReadChannelErrInfo(chn_handle, ErrInfo)
             return ErrInfo if ret == ZCAN_STATUS_OK else None
         except:
             print("Exception on ZCAN_ReadChannelErrInfo!")
@@ -329,7 +510,7 @@ class ZCAN(object):
     def ReadChannelStatus(self, chn_handle):
         try:
             status = ZCAN_CHANNEL_STATUS()
-            ret = self.__dll.ZCAN_ReadChannelStatus(chn_handle, byref(status))
+            ret = self.__ReadChannelStatus(chn_handle, status)
             return status if ret == ZCAN_STATUS_OK else None
         except:
             print("Exception on ZCAN_ReadChannelStatus!")
@@ -337,22 +518,23 @@ class ZCAN(object):
 
     def GetReceiveNum(self, chn_handle, can_type = ZCAN_TYPE_CAN):
         try:
-            return self.__dll.ZCAN_GetReceiveNum(chn_handle, can_type)
+            return self.__GetReceiveNum(self.__chn_handles.get(chn_handle) or self.__chn(chn_handle), can_type)
         except:
             print("Exception on ZCAN_GetReceiveNum!")
             raise
 
     def Transmit(self, chn_handle, std_msg, len):
         try:
-            return self.__dll.ZCAN_Transmit(chn_handle, byref(std_msg), len)
+            return self.__Transmit(self.__chn_handles.get(chn_handle) or self.__chn(chn_handle), std_msg, len)
         except:
             print("Exception on ZCAN_Transmit!")
             raise
 
-    def Receive(self, chn_handle, rcv_num, wait_time = c_int(-1)):
+    def Receive(self, chn_handle, rcv_num, wait_time = c_int(-1), rcv_can_msgs = None):
         try:
-            rcv_can_msgs = (ZCAN_Receive_Data * rcv_num)()
-            ret = self.__dll.ZCAN_Receive(chn_handle, byref(rcv_can_msgs), rcv_num, wait_time)
+            if rcv_can_msgs is None:
+                rcv_can_msgs = (ZCAN_Receive_Data * rcv_num)()
+            ret = self.__Receive(self.__chn_handles.get(chn_handle) or self.__chn(chn_handle), rcv_can_msgs, rcv_num, wait_time)
             return rcv_can_msgs, ret
         except:
             print("Exception on ZCAN_Receive!")
@@ -360,15 +542,16 @@ class ZCAN(object):
     
     def TransmitFD(self, chn_handle, fd_msg, len):
         try:
-            return self.__dll.ZCAN_TransmitFD(chn_handle, byref(fd_msg), len)
+            return self.__TransmitFD(self.__chn_handles.get(chn_handle) or self.__chn(chn_handle), fd_msg, len)
         except:
             print("Exception on ZCAN_TransmitFD!")
             raise
     
-    def ReceiveFD(self, chn_handle, rcv_num, wait_time = c_int(-1)):
+    def ReceiveFD(self, chn_handle, rcv_num, wait_time = c_int(-1), rcv_canfd_msgs = None):
         try:
-            rcv_canfd_msgs = (ZCAN_ReceiveFD_Data * rcv_num)()
-            ret = self.__dll.ZCAN_ReceiveFD(chn_handle, byref(rcv_canfd_msgs), rcv_num, wait_time)
+            if rcv_canfd_msgs is None:
+                rcv_canfd_msgs = (ZCAN_ReceiveFD_Data * rcv_num)()
+            ret = self.__ReceiveFD(self.__chn_handles.get(chn_handle) or self.__chn(chn_handle), rcv_canfd_msgs, rcv_num, wait_time)
             return rcv_canfd_msgs, ret
         except:
             print("Exception on ZCAN_ReceiveFD!")
@@ -376,34 +559,746 @@ class ZCAN(object):
 
     def GetIProperty(self, device_handle):
         try:
-            self.__dll.GetIProperty.restype = POINTER(IProperty)
-            return self.__dll.GetIProperty(device_handle)
+            return self.__GetIProperty(device_handle)
         except:
             print("Exception on ZCAN_GetIProperty!")
             raise
 
     def SetValue(self, iproperty, path, value):
         try:
-            func = CFUNCTYPE(c_uint, c_char_p, c_char_p)(iproperty.contents.SetValue)
-            return func(c_char_p(path.encode("utf-8")), c_char_p(value.encode("utf-8")))
+            return iproperty.contents.SetValue(path.encode("utf-8"), value.encode("utf-8"))
         except:
             print("Exception on IProperty SetValue")
             raise
 
     def GetValue(self, iproperty, path):
         try:
-            func = CFUNCTYPE(c_char_p, c_char_p)(iproperty.contents.GetValue)
-            return func(c_char_p(path.encode))
+            return iproperty.contents.GetValue(path.encode("utf-8"))
         except:
             print("Exception on IProperty GetValue")
             raise
 
     def ReleaseIProperty(self, iproperty):
         try:
-            return self.__dll.ReleaseIProperty(iproperty)
+            return self.__ReleaseIProperty(iproperty)
         except:
             print("Exception on ZCAN_ReleaseIProperty!")
             raise
+
+    def __set_property(self, device_handle, path, value):
+        ip = self.GetIProperty(device_handle)
+        if not ip:
+            return ZCAN_STATUS_ERR
+        try:
+            return ip.contents.SetValue(path.encode("utf-8"), value)
+        except:
+            print("Exception on IProperty SetValue %s" % path)
+            raise
+        finally:
+            self.ReleaseIProperty(ip)
+
+    def SetAutoSend(self, device_handle, chn_index, auto_obj):
+        fd = isinstance(auto_obj, ZCANFD_AUTO_TRANSMIT_OBJ)
+        return self.__set_property(device_handle, "%d/auto_send%s" % (chn_index, "_canfd" if fd else ""),
+                                   cast(byref(auto_obj), c_char_p))
+
+    def ApplyAutoSend(self, device_handle, chn_index):
+        return self.__set_property(device_handle, "%d/apply_auto_send" % chn_index, b"0")
+
+    def ClearAutoSend(self, device_handle, chn_index):
+        return self.__set_property(device_handle, "%d/clear_auto_send" % chn_index, b"0")
+
+def _wait_ms(wait_time):
+    # zlgcan wait_time in ms, -1 waits forever; returns seconds or None
+    if isinstance(wait_time, c_int):
+        wait_time = wait_time.value
+    return None if wait_time < 0 else wait_time / 1000.0
+
+def _can_type(can_type):
+    return can_type.value if isinstance(can_type, c_uint) else can_type
+
+def _timestamp_us():
+    return int(time.monotonic() * 1000000)
+
+def _fill_device_info(info, can_num, serial, hw_type):
+    info.can_Num = can_num
+    serial = serial.encode("ascii")[:19]
+    hw_type = hw_type.encode("ascii")[:39]
+    memmove(info.str_Serial_Num, serial, len(serial))
+    memmove(info.str_hw_Type, hw_type, len(hw_type))
+    return info
+
+###############################################################################
+'''
+ ZLG Linux library backend (libusbcanfd.so), structures as in the vendor zcan.h
+'''
+LINUX_USBCANFD_DEVICE_TYPE = 33     # one device type for all USBCANFD models in the Linux library
+LINUX_CMD_CAN_TRES         = 0x18   # VCI_SetReference: termination resistor
+
+class _VCI_TIMING(Structure):
+    _fields_ = [("tseg1", c_ubyte),
+                ("tseg2", c_ubyte),
+                ("sjw",   c_ubyte),
+                ("smp",   c_ubyte),
+                ("brp",   c_ushort)]
+
+class _VCI_INIT(Structure):
+    _fields_ = [("clk",  c_uint),
+                ("mode", c_uint),
+                ("atim", _VCI_TIMING),
+                ("dtim", _VCI_TIMING)]
+
+class _VCI_MSG_HDR(Structure):
+    _fields_ = [("ts",  c_uint),
+                ("id",  c_uint),
+                ("txm", c_ushort, 4),
+                ("fmt", c_ushort, 4),
+                ("sdf", c_ushort, 1),
+                ("sef", c_ushort, 1),
+                ("err", c_ushort, 1),
+                ("brs", c_ushort, 1),
+                ("est", c_ushort, 1),
+                ("pad", c_ushort, 3),
+                ("chn", c_ubyte),
+                ("len", c_ubyte)]
+
+class _VCI_CAN_MSG(Structure):
+    _fields_ = [("hdr", _VCI_MSG_HDR), ("dat", c_ubyte * 8)]
+
+class _VCI_CANFD_MSG(Structure):
+    _fields_ = [("hdr", _VCI_MSG_HDR), ("dat", c_ubyte * 64)]
+
+# raw layouts used to convert between the two libraries without touching ctypes fields
+_VCI_CAN_FORMAT      = struct.Struct('<IIHBB8s')
+_VCI_CANFD_FORMAT    = struct.Struct('<IIHBB64s')
+
+def _split_timing(timing):
+    # zlgcan.dll timing word: tseg1 bit0-7, tseg2 bit8-14, sjw bit15-21, brp bit22-31
+    t = _VCI_TIMING()
+    t.tseg1 = timing & 0xFF
+    t.tseg2 = (timing >> 8) & 0x7F
+    t.sjw   = (timing >> 15) & 0x7F
+    t.brp   = timing >> 22
+    return t
+
+def _rx_count(ret, rcv_num):
+    # the library returns 0xFFFFFFFF (-1) on error, never trust more frames than the buffer holds
+    return 0 if ret > rcv_num else ret
+
+class ZCANLinuxDriver(ZCANDriver):
+    """
+    ZLG Linux library backend. The library addresses channels by (type, card, port) and uses its own
+    message layout, handles are synthesized here and frames are converted batch by batch.
+    """
+    LINUX_PROTOTYPES = {
+        "VCI_OpenDevice"    : [c_uint, c_uint, c_uint],
+        "VCI_CloseDevice"   : [c_uint, c_uint],
+        "VCI_InitCAN"       : [c_uint, c_uint, c_uint, POINTER(_VCI_INIT)],
+        "VCI_StartCAN"      : [c_uint, c_uint, c_uint],
+        "VCI_ResetCAN"      : [c_uint, c_uint, c_uint],
+        "VCI_ClearBuffer"   : [c_uint, c_uint, c_uint],
+        "VCI_GetReceiveNum" : [c_uint, c_uint, c_uint],
+        "VCI_SetReference"  : [c_uint, c_uint, c_uint, c_uint, c_void_p],
+        "VCI_Transmit"      : [c_uint, c_uint, c_uint, POINTER(_VCI_CAN_MSG), c_uint],
+        "VCI_TransmitFD"    : [c_uint, c_uint, c_uint, POINTER(_VCI_CANFD_MSG), c_uint],
+        "VCI_Receive"       : [c_uint, c_uint, c_uint, POINTER(_VCI_CAN_MSG), c_uint, c_uint],
+        "VCI_ReceiveFD"     : [c_uint, c_uint, c_uint, POINTER(_VCI_CANFD_MSG), c_uint, c_uint],
+    }
+
+    def __init__(self, lib_path = "libusbcanfd.so"):
+        self.__dll = cdll.LoadLibrary(lib_path)
+        for name, argtypes in self.LINUX_PROTOTYPES.items():
+            func = getattr(self.__dll, name)
+            func.restype  = c_uint
+            func.argtypes = argtypes
+        self.__devices  = {}    # device handle -> (type, card)
+        self.__channels = {}    # channel handle -> (type, card, port)
+        self.__clock    = {}    # (device handle, port) -> clock set through SetValue
+        self.__handle   = 0
+        self.__rx_bufs  = {}    # (channel handle, message type) -> receive buffer of that channel
+
+    def __new_handle(self):
+        self.__handle += 1
+        return self.__handle
+
+    def OpenDevice(self, device_type, device_index, reserved):
+        device_type = _can_type(device_type)
+        if device_type in (41, 42, 43):
+            device_type = LINUX_USBCANFD_DEVICE_TYPE
+        if not self.__dll.VCI_OpenDevice(device_type, device_index, reserved):
+            return INVALID_DEVICE_HANDLE
+        handle = self.__new_handle()
+        self.__devices[handle] = (device_type, device_index)
+        return handle
+
+    def CloseDevice(self, device_handle):
+        dev = self.__devices.pop(device_handle, None)
+        if dev is None:
+            return ZCAN_STATUS_ERR
+        for chn in [h for h, c in self.__channels.items() if c[:2] == dev]:
+            del self.__channels[chn]
+            self.__rx_bufs.pop((chn, _VCI_CAN_MSG), None)
+            self.__rx_bufs.pop((chn, _VCI_CANFD_MSG), None)
+        return self.__dll.VCI_CloseDevice(*dev)
+
+    def GetDeviceInf(self, device_handle):
+        dev = self.__devices.get(device_handle)
+        if dev is None:
+            return None
+        return _fill_device_info(ZCAN_DEVICE_INFO(), 2, "%d-%d" % dev, "USBCANFD(Linux)")
+
+    def InitCAN(self, device_handle, can_index, init_config):
+        dev = self.__devices.get(device_handle)
+        if dev is None:
+            return INVALID_CHANNEL_HANDLE
+        init = _VCI_INIT()
+        init.clk = self.__clock.get((device_handle, can_index), 60000000)
+        if init_config.can_type == 1:
+            init.mode = init_config.config.canfd.mode
+            init.atim = _split_timing(init_config.config.canfd.abit_timing)
+            init.dtim = _split_timing(init_config.config.canfd.dbit_timing)
+        else:
+            init.mode = init_config.config.can.mode
+        if not self.__dll.VCI_InitCAN(dev[0], dev[1], can_index, init):
+            return INVALID_CHANNEL_HANDLE
+        handle = self.__new_handle()
+        self.__channels[handle] = (dev[0], dev[1], can_index)
+        return handle
+
+    def StartCAN(self, chn_handle):
+        return self.__dll.VCI_StartCAN(*self.__channels[chn_handle])
+
+    def ResetCAN(self, chn_handle):
+        return self.__dll.VCI_ResetCAN(*self.__channels[chn_handle])
+
+    def ClearBuffer(self, chn_handle):
+        return self.__dll.VCI_ClearBuffer(*self.__channels[chn_handle])
+
+    def GetReceiveNum(self, chn_handle, can_type = ZCAN_TYPE_CAN):
+        # the Linux library counts CAN and CANFD frames together
+        return self.__dll.VCI_GetReceiveNum(*self.__channels[chn_handle])
+
+    def __rx_buf(self, chn_handle, msg_type, rcv_num):
+        # one buffer per channel, the channels are read by their own threads
+        buf = self.__rx_bufs.get((chn_handle, msg_type))
+        if buf is None or len(buf) < rcv_num:
+            buf = self.__rx_bufs[(chn_handle, msg_type)] = (msg_type * rcv_num)()
+        return buf
+
+    def Transmit(self, chn_handle, std_msg, len):
+        t, card, port = self.__channels[chn_handle]
+        src = string_at(addressof(std_msg), len * ZCAN_TRANSMIT_FORMAT.size)
+        msgs = (_VCI_CAN_MSG * len)()
+        dst = memoryview(msgs).cast('B')
+        for i in range(len):
+            can_id, dlc, data, transmit_type = ZCAN_TRANSMIT_FORMAT.unpack_from(src, i * ZCAN_TRANSMIT_FORMAT.size)
+            inf = (transmit_type & 0xF) | (((can_id >> 30) & 1) << 8) | ((can_id >> 31) << 9)
+            _VCI_CAN_FORMAT.pack_into(dst, i * _VCI_CAN_FORMAT.size, 0, can_id & 0x1FFFFFFF, inf, port, dlc, data)
+        return self.__dll.VCI_Transmit(t, card, port, msgs, len)
+
+    def Receive(self, chn_handle, rcv_num, wait_time = c_int(-1), rcv_can_msgs = None):
+        t, card, port = self.__channels[chn_handle]
+        if rcv_can_msgs is None:
+            rcv_can_msgs = (ZCAN_Receive_Data * rcv_num)()
+        buf = self.__rx_buf(chn_handle, _VCI_CAN_MSG, rcv_num)
+        wait = _wait_ms(wait_time)
+        ret = _rx_count(self.__dll.VCI_Receive(t, card, port, buf, rcv_num, 0xFFFFFFFF if wait is None else int(wait * 1000)), rcv_num)
+        src = memoryview(buf).cast('B')
+        dst = memoryview(rcv_can_msgs).cast('B')
+        for i in range(ret):
+            ts, can_id, inf, chn, dlc, data = _VCI_CAN_FORMAT.unpack_from(src, i * _VCI_CAN_FORMAT.size)
+            can_id |= (((inf >> 10) & 1) << 29) | (((inf >> 8) & 1) << 30) | (((inf >> 9) & 1) << 31)
+            ZCAN_RECEIVE_FORMAT.pack_into(dst, i * ZCAN_RECEIVE_FORMAT.size, can_id, dlc, data, ts)
+        return rcv_can_msgs, ret
+
+    def TransmitFD(self, chn_handle, fd_msg, len):
+        t, card, port = self.__channels[chn_handle]
+        src = string_at(addressof(fd_msg), len * ZCAN_TRANSMITFD_FORMAT.size)
+        msgs = (_VCI_CANFD_MSG * len)()
+        dst = memoryview(msgs).cast('B')
+        for i in range(len):
+            can_id, dlc, flags, data, transmit_type = ZCAN_TRANSMITFD_FORMAT.unpack_from(src, i * ZCAN_TRANSMITFD_FORMAT.size)
+            inf = (transmit_type & 0xF) | (1 << 4) | (((can_id >> 30) & 1) << 8) | ((can_id >> 31) << 9) | ((flags & 1) << 11)
+            _VCI_CANFD_FORMAT.pack_into(dst, i * _VCI_CANFD_FORMAT.size, 0, can_id & 0x1FFFFFFF, inf, port, dlc, data)
+        return self.__dll.VCI_TransmitFD(t, card, port, msgs, len)
+
+    def ReceiveFD(self, chn_handle, rcv_num, wait_time = c_int(-1), rcv_canfd_msgs = None):
+        t, card, port = self.__channels[chn_handle]
+        if rcv_canfd_msgs is None:
+            rcv_canfd_msgs = (ZCAN_ReceiveFD_Data * rcv_num)()
+        buf = self.__rx_buf(chn_handle, _VCI_CANFD_MSG, rcv_num)
+        wait = _wait_ms(wait_time)
+        ret = _rx_count(self.__dll.VCI_ReceiveFD(t, card, port, buf, rcv_num, 0xFFFFFFFF if wait is None else int(wait * 1000)), rcv_num)
+        src = memoryview(buf).cast('B')
+        dst = memoryview(rcv_canfd_msgs).cast('B')
+        for i in range(ret):
+            ts, can_id, inf, chn, dlc, data = _VCI_CANFD_FORMAT.unpack_from(src, i * _VCI_CANFD_FORMAT.size)
+            can_id |= (((inf >> 10) & 1) << 29) | (((inf >> 8) & 1) << 30) | (((inf >> 9) & 1) << 31)
+            flags = ((inf >> 11) & 1) | (((inf >> 12) & 1) << 1)
+            ZCAN_RECEIVEFD_FORMAT.pack_into(dst, i * ZCAN_RECEIVEFD_FORMAT.size, can_id, dlc, flags, data, ts)
+        return rcv_canfd_msgs, ret
+
+    def GetIProperty(self, device_handle):
+        return device_handle
+
+    def SetValue(self, iproperty, path, value):
+        chn, _, key = path.partition("/")
+        if key == "clock":
+            self.__clock[(iproperty, int(chn))] = int(value)
+            return ZCAN_STATUS_OK
+        if key == "initenal_resistance":
+            t, card = self.__devices[iproperty]
+            res = c_uint(int(value))
+            return self.__dll.VCI_SetReference(t, card, int(chn), LINUX_CMD_CAN_TRES, byref(res))
+        return ZCAN_STATUS_OK
+
+###############################################################################
+'''
+ SocketCAN backend (raw CAN sockets), batched with recvmmsg/sendmmsg from libc when available.
+ struct can_frame / canfd_frame have the same layout as ZCAN_CAN_FRAME / ZCAN_CANFD_FRAME,
+ so the kernel reads and writes the ZCAN arrays in place.
+ Bit rates are configured on the interface (ip link set canX type can bitrate ...), not here.
+'''
+CAN_MTU   = 16
+CANFD_MTU = 72
+_MSG_DONTWAIT = 0x40
+
+class _iovec(Structure):
+    _fields_ = [("iov_base", c_void_p), ("iov_len", c_size_t)]
+
+class _msghdr(Structure):
+    _fields_ = [("msg_name",       c_void_p),
+                ("msg_namelen",    c_uint),
+                ("msg_iov",        POINTER(_iovec)),
+                ("msg_iovlen",     c_size_t),
+                ("msg_control",    c_void_p),
+                ("msg_controllen", c_size_t),
+                ("msg_flags",      c_int)]
+
+class _mmsghdr(Structure):
+    _fields_ = [("msg_hdr", _msghdr), ("msg_len", c_uint)]
+
+def _load_mmsg():
+    try:
+        libc = CDLL(ctypes_util.find_library("c"), use_errno=True)
+        recvmmsg, sendmmsg = libc.recvmmsg, libc.sendmmsg
+    except (OSError, AttributeError, TypeError):
+        return None, None
+    recvmmsg.argtypes = [c_int, POINTER(_mmsghdr), c_uint, c_int, c_void_p]
+    sendmmsg.argtypes = [c_int, POINTER(_mmsghdr), c_uint, c_int]
+    recvmmsg.restype = sendmmsg.restype = c_int
+    return recvmmsg, sendmmsg
+
+class _MMsgVector(object):
+    """
+    iovec/mmsghdr vector pointing at every element of a ctypes array, built once per array
+    """
+    def __init__(self, array, frame_len):
+        n = len(array)
+        stride = sizeof(array) // n if n else 0
+        base = addressof(array)
+        self.array = array
+        self.iov = (_iovec * n)()
+        self.hdr = (_mmsghdr * n)()
+        for i in range(n):
+            self.iov[i].iov_base = base + i * stride
+            self.iov[i].iov_len = frame_len
+            self.hdr[i].msg_hdr.msg_iov = pointer(self.iov[i])
+            self.hdr[i].msg_hdr.msg_iovlen = 1
+
+class _SocketCANChannel(object):
+    def __init__(self, ifname, is_canfd):
+        self.ifname = ifname
+        self.is_canfd = is_canfd
+        self.sock = socket.socket(socket.PF_CAN, socket.SOCK_RAW, socket.CAN_RAW)
+        self.sock.bind((ifname,))
+        # classic frames only on sock, CAN FD frames on sock_fd (classic ones read there are dropped)
+        self.sock_fd = None
+        if is_canfd:
+            self.sock_fd = socket.socket(socket.PF_CAN, socket.SOCK_RAW, socket.CAN_RAW)
+            self.sock_fd.setsockopt(socket.SOL_CAN_RAW, socket.CAN_RAW_FD_FRAMES, 1)
+            self.sock_fd.bind((ifname,))
+        self.vectors = {}
+
+    def vector(self, array, frame_len):
+        key = (addressof(array), len(array), frame_len)
+        vec = self.vectors.get(key)
+        if vec is None:
+            if len(self.vectors) > 8:
+                self.vectors.clear()
+            vec = self.vectors[key] = _MMsgVector(array, frame_len)
+        return vec
+
+    def close(self):
+        self.sock.close()
+        if self.sock_fd is not None:
+            self.sock_fd.close()
+        self.vectors.clear()
+
+class ZCANSocketCANDriver(ZCANDriver):
+    """
+    SocketCAN backend. interfaces[device_index][can_index] names the network interface of a channel,
+    a flat list is taken as the channels of device 0; default "can<can_index>".
+    Environment ZCAN_SOCKETCAN_IFACES="vcan0,vcan1;can2" gives the same per device (';') and channel (',').
+    """
+    def __init__(self, interfaces = None):
+        if interfaces is None and os.environ.get("ZCAN_SOCKETCAN_IFACES"):
+            interfaces = [dev.split(",") for dev in os.environ["ZCAN_SOCKETCAN_IFACES"].split(";")]
+        if interfaces and isinstance(interfaces[0], str):
+            interfaces = [interfaces]
+        self._interfaces = interfaces or []
+        self._recvmmsg, self._sendmmsg = _load_mmsg()
+        self._devices  = {}
+        self._channels = {}
+        self._handle   = 0
+
+    def _new_handle(self):
+        self._handle += 1
+        return self._handle
+
+    def interface_name(self, device_index, can_index):
+        if device_index < len(self._interfaces) and can_index < len(self._interfaces[device_index]):
+            return self._interfaces[device_index][can_index]
+        return "can%d" % can_index
+
+    def OpenDevice(self, device_type, device_index, reserved):
+        handle = self._new_handle()
+        self._devices[handle] = device_index
+        return handle
+
+    def CloseDevice(self, device_handle):
+        if self._devices.pop(device_handle, None) is None:
+            return ZCAN_STATUS_ERR
+        return ZCAN_STATUS_OK
+
+    def GetDeviceInf(self, device_handle):
+        if device_handle not in self._devices:
+            return None
+        index = self._devices[device_handle]
+        num = len(self._interfaces[index]) if index < len(self._interfaces) else 1
+        return _fill_device_info(ZCAN_DEVICE_INFO(), num, "socketcan%d" % index, "SocketCAN")
+
+    def InitCAN(self, device_handle, can_index, init_config):
+        if device_handle not in self._devices:
+            return INVALID_CHANNEL_HANDLE
+        try:
+            chn = _SocketCANChannel(self.interface_name(self._devices[device_handle], can_index), init_config.can_type == 1)
+        except OSError as e:
+            print("SocketCAN: %s" % e)
+            return INVALID_CHANNEL_HANDLE
+        handle = self._new_handle()
+        self._channels[handle] = chn
+        return handle
+
+    def StartCAN(self, chn_handle):
+        return ZCAN_STATUS_OK if chn_handle in self._channels else ZCAN_STATUS_ERR
+
+    def ResetCAN(self, chn_handle):
+        chn = self._channels.pop(chn_handle, None)
+        if chn is None:
+            return ZCAN_STATUS_ERR
+        chn.close()
+        return ZCAN_STATUS_OK
+
+    def ClearBuffer(self, chn_handle):
+        chn = self._channels[chn_handle]
+        for sock in (chn.sock, chn.sock_fd):
+            while sock is not None and select.select([sock], [], [], 0)[0]:
+                sock.recv(CANFD_MTU)
+        return ZCAN_STATUS_OK
+
+    def GetReceiveNum(self, chn_handle, can_type = ZCAN_TYPE_CAN):
+        # a raw socket cannot tell how many frames are queued: 1 when at least one is readable
+        chn = self._channels[chn_handle]
+        sock = chn.sock_fd if _can_type(can_type) == 1 else chn.sock
+        if sock is None:
+            return 0
+        return 1 if select.select([sock], [], [], 0)[0] else 0
+
+    def _send(self, chn, sock, msgs, num, mtu):
+        if not isinstance(msgs, Array):
+            msgs = (type(msgs) * 1).from_buffer(msgs)
+        if self._sendmmsg is not None:
+            ret = self._sendmmsg(sock.fileno(), chn.vector(msgs, mtu).hdr, num, 0)
+            return max(ret, 0)
+        stride = sizeof(msgs) // len(msgs)
+        raw = string_at(addressof(msgs), stride * num)
+        sent = 0
+        for i in range(num):
+            try:
+                sock.send(raw[i * stride:i * stride + mtu])
+            except OSError:
+                break
+            sent += 1
+        return sent
+
+    def _recv(self, chn, sock, msgs, num, wait_time, mtu, sizes = None):
+        """
+        read up to num frames into msgs, the byte count of each one is appended to sizes when given
+        """
+        if not select.select([sock], [], [], _wait_ms(wait_time))[0]:
+            return 0
+        if self._recvmmsg is not None:
+            vec = chn.vector(msgs, mtu)
+            ret = max(self._recvmmsg(sock.fileno(), vec.hdr, num, _MSG_DONTWAIT, None), 0)
+            if sizes is not None:
+                sizes.extend(vec.hdr[i].msg_len for i in range(ret))
+            return ret
+        view = memoryview(msgs).cast('B')
+        stride = sizeof(msgs) // len(msgs)
+        ret = 0
+        while ret < num:
+            try:
+                nbytes = sock.recv_into(view[ret * stride:ret * stride + mtu], mtu, _MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                break
+            if sizes is not None:
+                sizes.append(nbytes)
+            ret += 1
+        return ret
+
+    def Transmit(self, chn_handle, std_msg, len):
+        chn = self._channels[chn_handle]
+        return self._send(chn, chn.sock, std_msg, len, CAN_MTU)
+
+    def Receive(self, chn_handle, rcv_num, wait_time = c_int(-1), rcv_can_msgs = None):
+        chn = self._channels[chn_handle]
+        if rcv_can_msgs is None:
+            rcv_can_msgs = (ZCAN_Receive_Data * rcv_num)()
+        ret = self._recv(chn, chn.sock, rcv_can_msgs, rcv_num, wait_time, CAN_MTU)
+        ts = _timestamp_us()
+        for i in range(ret):
+            rcv_can_msgs[i].timestamp = ts
+        return rcv_can_msgs, ret
+
+    def TransmitFD(self, chn_handle, fd_msg, len):
+        chn = self._channels[chn_handle]
+        if chn.sock_fd is None:
+            return 0
+        return self._send(chn, chn.sock_fd, fd_msg, len, CANFD_MTU)
+
+    def ReceiveFD(self, chn_handle, rcv_num, wait_time = c_int(-1), rcv_canfd_msgs = None):
+        chn = self._channels[chn_handle]
+        if rcv_canfd_msgs is None:
+            rcv_canfd_msgs = (ZCAN_ReceiveFD_Data * rcv_num)()
+        if chn.sock_fd is None:
+            return rcv_canfd_msgs, 0
+        sizes = []
+        ret = self._recv(chn, chn.sock_fd, rcv_canfd_msgs, rcv_num, wait_time, CANFD_MTU, sizes)
+        # classic frames also show up on the FD socket, they were returned by Receive already
+        ts = _timestamp_us()
+        num = 0
+        for i in range(ret):
+            if sizes[i] != CANFD_MTU:
+                continue
+            if num != i:
+                memmove(byref(rcv_canfd_msgs[num]), byref(rcv_canfd_msgs[i]), CANFD_MTU)
+            rcv_canfd_msgs[num].timestamp = ts
+            num += 1
+        return rcv_canfd_msgs, num
+
+###############################################################################
+'''
+ In-process virtual bus backend, also used by the ECU simulator
+'''
+class VirtualCANBus(object):
+    """
+    in-process CAN bus: every attached node gets the frames the other nodes send.
+    a node implements deliver(frames, is_fd, timestamp), frames are ZCAN_CAN_FRAME/ZCAN_CANFD_FRAME bytes
+    """
+    def __init__(self, name):
+        self.name   = name
+        self._nodes = ()
+        self._lock  = threading.Lock()
+
+    def attach(self, node):
+        with self._lock:
+            if node not in self._nodes:
+                self._nodes = self._nodes + (node,)
+
+    def detach(self, node):
+        with self._lock:
+            self._nodes = tuple(n for n in self._nodes if n is not node)
+
+    def send(self, sender, frames, is_fd = False, self_rcv = False):
+        ts = _timestamp_us()
+        for node in self._nodes:
+            if node is not sender or self_rcv:
+                node.deliver(frames, is_fd, ts)
+
+_virtual_buses = {}
+_virtual_buses_lock = threading.Lock()
+
+def virtual_bus(name):
+    """
+    get or create the virtual bus of that name
+    """
+    with _virtual_buses_lock:
+        bus = _virtual_buses.get(name)
+        if bus is None:
+            bus = _virtual_buses[name] = VirtualCANBus(name)
+        return bus
+
+def virtual_bus_name(device_index, can_index):
+    return "virtual%d/%d" % (device_index, can_index)
+
+class _VirtualChannel(object):
+    def __init__(self, bus, is_canfd):
+        self.bus      = bus
+        self.is_canfd = is_canfd
+        self.rx       = collections.deque()
+        self.rx_fd    = collections.deque()
+        self.cond     = threading.Condition()
+
+    def deliver(self, frames, is_fd, timestamp):
+        if is_fd and not self.is_canfd:
+            return
+        ts = struct.pack('<Q', timestamp)
+        with self.cond:
+            (self.rx_fd if is_fd else self.rx).extend(frame + ts for frame in frames)
+            self.cond.notify_all()
+
+    def pop_into(self, queue, msgs, num, wait):
+        rec_len = sizeof(msgs) // len(msgs)
+        view = memoryview(msgs).cast('B')
+        with self.cond:
+            if not queue and wait != 0:
+                deadline = None if wait is None else time.monotonic() + wait
+                while not queue:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+            num = min(num, len(queue))
+            for i in range(num):
+                view[i * rec_len:(i + 1) * rec_len] = queue.popleft()
+        return num
+
+class ZCANVirtualDriver(ZCANDriver):
+    """
+    pure in-process backend, channel can_index of device device_index sits on virtual_bus(virtual_bus_name(...)).
+    bus_names maps (device_index, can_index) to another bus name, e.g. to wire two devices together.
+    """
+    def __init__(self, bus_names = None):
+        self._bus_names = bus_names or {}
+        self._devices   = {}
+        self._channels  = {}
+        self._handle    = 0
+
+    def _new_handle(self):
+        self._handle += 1
+        return self._handle
+
+    def OpenDevice(self, device_type, device_index, reserved):
+        handle = self._new_handle()
+        self._devices[handle] = device_index
+        return handle
+
+    def CloseDevice(self, device_handle):
+        if self._devices.pop(device_handle, None) is None:
+            return ZCAN_STATUS_ERR
+        return ZCAN_STATUS_OK
+
+    def GetDeviceInf(self, device_handle):
+        if device_handle not in self._devices:
+            return None
+        return _fill_device_info(ZCAN_DEVICE_INFO(), 8, "VIRTUAL%d" % self._devices[device_handle], "ZCAN_VIRTUAL")
+
+    def InitCAN(self, device_handle, can_index, init_config):
+        if device_handle not in self._devices:
+            return INVALID_CHANNEL_HANDLE
+        key = (self._devices[device_handle], can_index)
+        bus = virtual_bus(self._bus_names.get(key, virtual_bus_name(*key)))
+        handle = self._new_handle()
+        self._channels[handle] = _VirtualChannel(bus, init_config.can_type == 1)
+        return handle
+
+    def StartCAN(self, chn_handle):
+        chn = self._channels.get(chn_handle)
+        if chn is None:
+            return ZCAN_STATUS_ERR
+        chn.bus.attach(chn)
+        return ZCAN_STATUS_OK
+
+    def ResetCAN(self, chn_handle):
+        chn = self._channels.pop(chn_handle, None)
+        if chn is None:
+            return ZCAN_STATUS_ERR
+        chn.bus.detach(chn)
+        return ZCAN_STATUS_OK
+
+    def ClearBuffer(self, chn_handle):
+        chn = self._channels[chn_handle]
+        with chn.cond:
+            chn.rx.clear()
+            chn.rx_fd.clear()
+        return ZCAN_STATUS_OK
+
+    def GetReceiveNum(self, chn_handle, can_type = ZCAN_TYPE_CAN):
+        chn = self._channels[chn_handle]
+        return len(chn.rx_fd if _can_type(can_type) == 1 else chn.rx)
+
+    def _transmit(self, chn_handle, msgs, num, frame_len, is_fd):
+        chn = self._channels.get(chn_handle)
+        if chn is None:
+            return 0
+        stride = sizeof(msgs) // len(msgs) if isinstance(msgs, Array) else sizeof(msgs)
+        raw = string_at(addressof(msgs), stride * num)
+        frames, self_frames = [], []
+        for i in range(num):
+            # transmit_type 2/3: self send and receive
+            (self_frames if raw[i * stride + frame_len] & 2 else frames).append(raw[i * stride:i * stride + frame_len])
+        if frames:
+            chn.bus.send(chn, frames, is_fd)
+        if self_frames:
+            chn.bus.send(chn, self_frames, is_fd, self_rcv = True)
+        return num
+
+    def Transmit(self, chn_handle, std_msg, len):
+        return self._transmit(chn_handle, std_msg, len, CAN_MTU, False)
+
+    def TransmitFD(self, chn_handle, fd_msg, len):
+        return self._transmit(chn_handle, fd_msg, len, CANFD_MTU, True)
+
+    def Receive(self, chn_handle, rcv_num, wait_time = c_int(-1), rcv_can_msgs = None):
+        chn = self._channels[chn_handle]
+        if rcv_can_msgs is None:
+            rcv_can_msgs = (ZCAN_Receive_Data * rcv_num)()
+        return rcv_can_msgs, chn.pop_into(chn.rx, rcv_can_msgs, rcv_num, _wait_ms(wait_time))
+
+    def ReceiveFD(self, chn_handle, rcv_num, wait_time = c_int(-1), rcv_canfd_msgs = None):
+        chn = self._channels[chn_handle]
+        if rcv_canfd_msgs is None:
+            rcv_canfd_msgs = (ZCAN_ReceiveFD_Data * rcv_num)()
+        return rcv_canfd_msgs, chn.pop_into(chn.rx_fd, rcv_canfd_msgs, rcv_num, _wait_ms(wait_time))
+
+###############################################################################
+'''
+ Backend selection
+'''
+ZCAN_BACKENDS = {
+    "dll"       : ZCAN,
+    "linux"     : ZCANLinuxDriver,
+    "socketcan" : ZCANSocketCANDriver,
+    "virtual"   : ZCANVirtualDriver,
+}
+
+def open_backend(name = None, **options):
+    """
+    create the CAN backend: name, else environment ZCAN_BACKEND, else zlgcan.dll on Windows,
+    libusbcanfd.so on Linux when installed, SocketCAN otherwise. options go to the backend constructor
+    """
+    if name is None:
+        name = os.environ.get("ZCAN_BACKEND")
+    if name is None:
+        if platform.system() == "Windows":
+            name = "dll"
+        elif ctypes_util.find_library("usbcanfd"):
+            name = "linux"
+        else:
+            name = "socketcan"
+    return ZCAN_BACKENDS[name](**options)
+
 ###############################################################################
 '''
 USBCANFD-MINI Demo
@@ -433,7 +1328,7 @@ def can_start(zcanlib, device_handle, chn):
     return chn_handle
 
 if __name__ == "__main__":
-    zcanlib = ZCAN() 
+    zcanlib = open_backend()
     handle = zcanlib.OpenDevice(ZCAN_USBCANFD_MINI, 0,0)
     if handle == INVALID_DEVICE_HANDLE:
         print("Open Device failed!")